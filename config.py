@@ -35,3 +35,272 @@ MAVERICK_TOKEN_REPRICE_FILENAME = "data/maverick/maverick_token_Reprice.csv"
 MAVERICK_TOKEN_TRANSFER_FILENAME = "data/maverick/maverick_token_Transfer.csv"
 
 MAX_BATCH=1000
+
+####################
+# Fetching
+####################
+
+# Alchemy accepts up to 2000 blocks per eth_getLogs request
+BLOCK_WINDOW = 2000
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # seconds, doubled after each failed attempt
+
+# Provider throughput limit and cost of each RPC method, in compute units
+COMPUTE_UNITS_PER_SECOND = 330
+RPC_COMPUTE_UNITS = {
+    "eth_blockNumber": 10,
+    "eth_chainId": 0,
+    "eth_getBlockByNumber": 16,
+    "eth_getLogs": 75,
+    "eth_call": 26,
+}
+RPC_DEFAULT_COMPUTE_UNITS = 20
+
+####################
+# Events
+####################
+
+# Fetch all the events of a contract with a single multi-topic eth_getLogs request per window
+MULTI_TOPIC_GETLOGS = True
+
+# Every indexed contract: the project it is stored under, its protocol, ABI and stored events.
+# "events" maps each event name to its file, or to a dict with the "filename" and optional "renames"
+# of the stored columns; without a file, events are stored in data/<project>/<name>_<event>.csv.
+# "columns" pins the stored columns and their order, for the files written before the columns were
+# derived from the ABI.
+# The event store partitions the events by pool name and event.
+POOLS = [
+    {
+        "name": "curve_steth_lp_token",
+        "project": "curve",
+        "protocol": "curve_lp_token",
+        "address": CURVE_TOKEN_ADDRESS,
+        "abi": CURVE_TOKEN_ABI_PATH,
+        "events": {
+            "Transfer": {
+                "filename": CURVE_TOKEN_TRANSFERS_FILENAME,
+                "renames": {"_from": "from", "_to": "to", "_value": "vaue"},
+            },
+        },
+    },
+    {
+        "name": "curve_steth_pool",
+        "project": "curve",
+        "protocol": "curve_plain_pool",
+        "address": CURVE_POOL_ADDRESS,
+        "abi": CURVE_POOL_ABI_PATH,
+        "events": {
+            "AddLiquidity": CURVE_POOL_ADDLIQUIDITY_FILENAME,
+            "RemoveLiquidity": CURVE_POOL_REMOVELIQUIDITY_FILENAME,
+            "RemoveLiquidityOne": CURVE_POOL_REMOVELIQUIDITYONE_FILENAME,
+            "RemoveLiquidityImbalance": {
+                "filename": CURVE_POOL_REMOVELIQUIDITYIMBALANCE_FILENAME,
+                "columns": [
+                    "provider",
+                    "token_amounts_a",
+                    "token_amounts_b",
+                    "invariant",
+                    "token_supply",
+                ],
+            },
+            "TokenExchange": CURVE_POOL_TOKENSWAPS_FILENAME,
+        },
+    },
+    {
+        "name": "maverick_sweth_lp_token",
+        "project": "maverick",
+        "protocol": "maverick_boosted_position",
+        "address": MAVERICK_TOKEN_ADDRESS,
+        "abi": MAVERICK_TOKEN_ABI_PATH,
+        "events": {
+            "ETHDepositReceived": {
+                "filename": MAVERICK_TOKEN_DEPOSITS_FILENAME,
+                "columns": [
+                    "from",
+                    "referral",
+                    "amount",
+                    "swETHMinted",
+                    "newTotalETHDeposited",
+                ],
+            },
+            "ETHWithdrawn": MAVERICK_TOKEN_WITHDRAWALS_FILENAME,
+            "Reprice": MAVERICK_TOKEN_REPRICE_FILENAME,
+            "Transfer": MAVERICK_TOKEN_TRANSFER_FILENAME,
+        },
+    },
+]
+
+# Contracts sharing an ABI are fetched together, with one eth_getLogs request per window filtering
+# on the list of their addresses, at most this many addresses per request
+MAX_ADDRESSES_PER_REQUEST = 50
+
+
+def _event_entry(pool, event, target):
+    target = target if isinstance(target, dict) else {"filename": target}
+    return {
+        "project": pool["project"],
+        "pool": pool["name"],
+        "protocol": pool["protocol"],
+        "contract": pool["address"],
+        "abi": pool["abi"],
+        "event": event,
+        "filename": target.get("filename")
+        or f"data/{pool['project']}/{pool['name']}_{event}.csv",
+        "renames": target.get("renames"),
+        "columns": target.get("columns"),
+    }
+
+
+# Every stored event, derived from POOLS. The stored columns are derived from the ABI: one column per
+# argument, fixed size arrays split into <name>_a, <name>_b, ..., renamed with the optional "renames".
+EVENTS = [
+    _event_entry(pool, event, target)
+    for pool in POOLS
+    for event, target in pool["events"].items()
+]
+
+####################
+# Block timestamps
+####################
+
+# Persistent block number -> timestamp store shared by all projects
+BLOCK_TIMESTAMPS_DB = "data/block_timestamps.sqlite"
+# Maximum number of JSON-RPC calls per batched HTTP request
+RPC_BATCH_SIZE = 500
+
+####################
+# Sync
+####################
+
+# Highest fully stored block of every (contract, event), used by the --sync mode
+SYNC_MANIFEST_FILENAME = "data/sync_manifest.json"
+
+# Window sizes are adapted to the log density, between these bounds
+MIN_BLOCK_WINDOW = 10
+MAX_BLOCK_WINDOW = 100000
+TARGET_LOGS_PER_REQUEST = 2000
+# Provider errors asking for a smaller eth_getLogs range, the range is then bisected
+LOG_RANGE_ERRORS = [
+    "query returned more than",
+    "response size exceeded",
+    "block range",
+    "range is too large",
+    "-32005",
+]
+
+####################
+# Follow
+####################
+
+# Blocks a block must be buried under before its events are appended by the --follow mode
+FOLLOW_CONFIRMATIONS = 12
+# Seconds between two polls of the chain head in --follow mode
+FOLLOW_POLL_INTERVAL = 4
+# With the event store, confirmed events are buffered and written as one partition per event every
+# this many blocks (about 2 hours), rather than one tiny partition per poll
+FOLLOW_FLUSH_BLOCKS = 600
+
+####################
+# Event store
+####################
+
+# "csv" writes one CSV fragment per event and window, "parquet" writes to the partitioned event store
+STORE_FORMAT = "csv"
+EVENT_STORE_DIR = "data/store"
+# Addresses are stored in the event store as integer ids of this shared table
+ADDRESS_TABLE_DB = "data/store/addresses.sqlite"
+PARQUET_COMPRESSION = "zstd"
+
+# Maximum number of fetched windows waiting to be decoded, and decoded windows waiting to be written
+PIPELINE_QUEUE_SIZE = 4
+
+# Worker processes decoding and writing the fetched logs, None for one per available core and 1 to
+# decode and write in threads of the main process
+DECODE_WORKERS = None
+
+####################
+# Loader
+####################
+
+# Typed events parsed by loader.load_events from the CSV files, cached as memory-mapped Arrow files
+LOADER_CACHE_DIR = "data/cache"
+# Decimals of the pool tokens: load_events returns the uint256 amounts divided by 10**TOKEN_DECIMALS
+TOKEN_DECIMALS = 18
+# Index of the logs of every stored event by transaction and block, see tx_index.TransactionIndex
+TX_INDEX_FILENAME = "data/cache/tx_index.arrow"
+
+####################
+# Pool state
+####################
+
+# Snapshots of the Curve pool state rebuilt from its events, one every CURVE_SNAPSHOT_INTERVAL blocks (~1 day)
+CURVE_SNAPSHOTS_FILENAME = "data/curve_pool_snapshots.json"
+CURVE_SNAPSHOT_INTERVAL = 7200
+
+# Historical eth_call results, cached once their block is final
+ETH_CALL_CACHE_DB = "data/eth_call_cache.sqlite"
+# Blocks behind the head after which a block is considered final and its calls cached
+FINALITY_DEPTH = 64
+# Blocks between two samples of the Curve pool state (7200 ~ 1 day, 300 ~ 1 hour)
+CURVE_SAMPLE_CADENCE = 7200
+
+# First proof-of-stake block: from there on, block timestamps sit on a grid of SLOT_SECONDS slots
+MERGE_BLOCK = 15537394
+SLOT_SECONDS = 12
+
+####################
+# RPC cache
+####################
+
+# Compressed responses of the requests on final blocks (older than FINALITY_DEPTH), keyed by a hash of the request
+RPC_CACHE_DIR = "data/rpc_cache"
+# Methods whose responses never change once their block is final. eth_call results are cached by
+# the state sampler in ETH_CALL_CACHE_DB only, rather than once more as one file per call
+RPC_CACHE_METHODS = [
+    "eth_getLogs",
+    "eth_getBlockByNumber",
+    "eth_getBalance",
+    "eth_getCode",
+    "eth_getStorageAt",
+]
+# Seconds the head block number is reused before being requested again
+RPC_CACHE_HEAD_TTL = 12
+
+####################
+# Endpoints
+####################
+
+# RPC endpoints the requests are spread over, each with a relative weight and its own rate limit.
+# The URL of an endpoint is read from the environment variable named by "url_env", endpoints whose
+# variable is not set are skipped.
+RPC_ENDPOINTS = [
+    {
+        "url_env": "PROVIDER_URL",
+        "weight": 1.0,
+        "compute_units_per_second": COMPUTE_UNITS_PER_SECOND,
+    },
+    {
+        "url_env": "FALLBACK_PROVIDER_URL",
+        "weight": 1.0,
+        "compute_units_per_second": COMPUTE_UNITS_PER_SECOND,
+    },
+]
+# Kept-alive connections per endpoint, more than MAX_WORKERS so that no worker waits for a connection
+RPC_POOL_SIZE = 2 * MAX_WORKERS
+RPC_TIMEOUT = 60  # seconds
+# Seconds an endpoint is left aside after an HTTP error response without Retry-After, doubled on each failure in a row
+ENDPOINT_COOLDOWN = 1.0
+MAX_ENDPOINT_COOLDOWN = 60.0
+
+####################
+# Metrics
+####################
+
+# Metrics of the last run, as JSON and in the Prometheus text format (e.g. for the node exporter textfile collector)
+METRICS_FILENAME = "data/metrics.json"
+PROMETHEUS_FILENAME = "data/metrics.prom"
+# Upper bounds of the RPC latency histogram buckets, in seconds
+RPC_LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+# Seconds between two refreshes of the --progress line
+PROGRESS_INTERVAL = 2
@@ -0,0 +1,296 @@
+"""
+Throughput benchmarks of the data fetching, run against the local mock node of tests/mock_rpc.py so
+that they need no network access. Each benchmark runs in its own process and working directory, and
+reports the logs processed per second, the RPC calls per 1k blocks and the peak RSS of the process.
+
+Run using: poetry run python -m tests.benchmark
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from web3 import Web3
+
+from config import *
+from tests.mock_rpc import MockRPCServer, build_fixture, load_fixture, save_fixture
+from tokemak_quant_project.consolidate import consolidate_events
+from tokemak_quant_project.events import REGISTRY, group_by_abi
+from tokemak_quant_project.fetch_pool_data import (
+    PoolDataFetcher,
+    construct_store_pipeline,
+    decode_batch,
+    fetch_and_store_events,
+    split_by_contract,
+    store_events,
+)
+from tokemak_quant_project.loader import load_events
+from tokemak_quant_project.scheduler import AdaptiveWindow, run_windows
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATE_FILES = [
+    "data/curve/blockNumberDates.csv",
+    "data/maverick/blockNumberDates_Maverick.csv",
+]
+
+
+class Measurement:
+    """
+    Context manager timing a block of code and counting the RPC calls the mock node got meanwhile.
+    """
+
+    def __init__(self, w3):
+        self.w3 = w3
+        self.seconds = None
+        self.rpc_calls = None
+
+    def _calls(self):
+        calls = self.w3.provider.make_request("mock_calls", [])["result"]
+        return sum(count for method, count in calls.items() if method != "mock_calls")
+
+    def __enter__(self):
+        self.calls_before = self._calls()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        self.rpc_calls = self._calls() - self.calls_before
+
+
+def _windows(start_block, end_block):
+    return [
+        (window_start, min(end_block, window_start + BLOCK_WINDOW - 1))
+        for window_start in range(start_block, end_block + 1, BLOCK_WINDOW)
+    ]
+
+
+def _fetch_batches(w3, start_block, end_block):
+    batches = []
+    for contracts, abi, specs in group_by_abi(REGISTRY):
+        fetcher = PoolDataFetcher(w3, contracts, abi)
+        event_names = list(dict.fromkeys(spec.event for spec in specs))
+        for batch_n, (window_start, window_end) in enumerate(
+            _windows(start_block, end_block)
+        ):
+            raw_logs = fetcher.get_raw_logs(event_names, window_start, window_end)
+            raw_logs = split_by_contract(specs, dict(zip(event_names, raw_logs)))
+            batches.append((specs, raw_logs, window_start, window_end, batch_n))
+    return batches
+
+
+def bench_get_logs(w3, start_block, end_block):
+    """
+    PoolDataFetcher.get_logs over BLOCK_WINDOW windows, one group of contracts sharing an ABI
+    after the other.
+    """
+    with Measurement(w3) as measurement:
+        for contracts, abi, specs in group_by_abi(REGISTRY):
+            fetcher = PoolDataFetcher(w3, contracts, abi)
+            event_names = list(dict.fromkeys(spec.event for spec in specs))
+            for window_start, window_end in _windows(start_block, end_block):
+                fetcher.get_logs(event_names, window_start, window_end)
+    return measurement
+
+
+def _bench_backfill(workers):
+    def bench_backfill(w3, start_block, end_block):
+        with Measurement(w3) as measurement:
+            pipeline = construct_store_pipeline(workers=workers)
+
+            def fetch_window(window_start, window_end, batch_n):
+                return fetch_and_store_events(
+                    w3, REGISTRY, window_start, window_end, batch_n, pipeline=pipeline
+                )
+
+            sizer = AdaptiveWindow()
+            failed = run_windows(
+                [fetch_window], sizer.split(start_block, end_block), sizer=sizer
+            )
+            failed += pipeline.close()
+        if failed:
+            raise RuntimeError(f"{len(failed)} windows failed: {failed}")
+        return measurement
+
+    bench_backfill.__doc__ = (
+        "The backfill of fetch_pool_data.main: adaptive windows fetched concurrently, then "
+        "decoded and written to CSV fragments by the store pipeline, "
+        + ("in threads." if workers == 1 else "in worker processes.")
+    )
+    return bench_backfill
+
+
+def _bench_store(store_format):
+    def bench_store(w3, start_block, end_block):
+        batches = _fetch_batches(w3, start_block, end_block)
+        with Measurement(w3) as measurement:
+            for batch in batches:
+                store_events(*decode_batch(batch), store_format=store_format)
+        return measurement
+
+    bench_store.__doc__ = f"Decoding and storing the fetched logs as {store_format}."
+    return bench_store
+
+
+def _store_csv_fragments(w3, start_block, end_block):
+    """
+    Stores the CSV fragments of a backfill.
+    """
+    batches = _fetch_batches(w3, start_block, end_block)
+    for batch in batches:
+        store_events(*decode_batch(batch), store_format="csv")
+
+
+def bench_consolidate(w3, start_block, end_block):
+    """
+    Consolidating the CSV fragments of a backfill, with an empty block timestamp store.
+    """
+    _store_csv_fragments(w3, start_block, end_block)
+    with Measurement(w3) as measurement:
+        consolidate_events(REGISTRY, w3)
+    return measurement
+
+
+def _bench_load(cached):
+    def bench_load(w3, start_block, end_block):
+        _store_csv_fragments(w3, start_block, end_block)
+        consolidate_events(REGISTRY, w3)
+        if cached:
+            for spec in REGISTRY:
+                load_events(spec.pool, spec.event)
+        with Measurement(w3) as measurement:
+            for spec in REGISTRY:
+                load_events(spec.pool, spec.event)
+        return measurement
+
+    bench_load.__doc__ = (
+        f"Loading every consolidated CSV file with load_events, "
+        f"{'from' if cached else 'filling'} the typed cache."
+    )
+    return bench_load
+
+
+BENCHMARKS = {
+    "get_logs": bench_get_logs,
+    "backfill": _bench_backfill(DECODE_WORKERS),
+    "backfill_threads": _bench_backfill(1),
+    "store_csv": _bench_store("csv"),
+    "store_parquet": _bench_store("parquet"),
+    "consolidate": bench_consolidate,
+    "load_events": _bench_load(False),
+    "load_events_cached": _bench_load(True),
+}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_benchmark(name, url, start_block, end_block):
+    """
+    Runs a benchmark in the current process and prints its results as JSON.
+    """
+    w3 = Web3(Web3.HTTPProvider(url))
+    measurement = BENCHMARKS[name](w3, start_block, end_block)
+    print(
+        json.dumps(
+            {
+                "seconds": measurement.seconds,
+                "rpc_calls": measurement.rpc_calls,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+    )
+
+
+def spawn_benchmark(name, url, start_block, end_block):
+    """
+    Runs a benchmark in a new process, in an empty working directory.
+
+    :return: The results printed by run_benchmark.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.symlink(os.path.join(ROOT_DIR, "abis"), os.path.join(work_dir, "abis"))
+        os.makedirs(os.path.join(work_dir, "data", "curve"))
+        os.makedirs(os.path.join(work_dir, "data", "maverick"))
+        env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+        process = subprocess.run(
+            [sys.executable, "-m", "tests.benchmark", "--run", name, "--url", url]
+            + ["--start", str(start_block), "--end", str(end_block)],
+            cwd=work_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark {name} failed:\n{process.stderr[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--fixture",
+        help="A fixture written by save_fixture, seeded from data/ if omitted",
+    )
+    parser.add_argument(
+        "--save-fixture", help="Write the fixture seeded from data/ to this path"
+    )
+    parser.add_argument(
+        "--blocks", type=int, help="Only replay the last blocks of the fixture"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every response"
+    )
+    parser.add_argument(
+        "--max-logs",
+        type=int,
+        default=10000,
+        help="Largest eth_getLogs result before the node rejects the range",
+    )
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--run", choices=list(BENCHMARKS), help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--start", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--end", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_benchmark(args.run, args.url, args.start, args.end)
+        return
+
+    if args.fixture:
+        fixture = load_fixture(args.fixture)
+    else:
+        fixture = build_fixture(date_files=DATE_FILES)
+        if args.save_fixture:
+            save_fixture(fixture, args.save_fixture)
+
+    blocks = [int(log["blockNumber"], 16) for log in fixture["logs"]]
+    end_block = fixture["head"]
+    start_block = min(blocks) if args.blocks is None else end_block - args.blocks + 1
+    n_logs = sum(start_block <= block <= end_block for block in blocks)
+    n_blocks = end_block - start_block + 1
+    print(f"Replaying {n_logs} logs over blocks {start_block} to {end_block}\n")
+
+    print(
+        f"{'benchmark':<18}{'seconds':>10}{'logs/s':>12}{'RPC calls/1k blocks':>22}{'peak RSS (MB)':>16}"
+    )
+    with MockRPCServer(fixture, max_logs=args.max_logs, latency=args.latency) as server:
+        for name in args.only or BENCHMARKS:
+            result = spawn_benchmark(name, server.url, start_block, end_block)
+            print(
+                f"{name:<18}{result['seconds']:>10.2f}{n_logs / result['seconds']:>12.0f}"
+                f"{1000 * result['rpc_calls'] / n_blocks:>22.2f}{result['peak_rss_mb']:>16.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import pytest
+from web3 import Web3
+
+from tests.mock_rpc import MockRPCServer
+
+
+@pytest.fixture
+def in_tmp_dir(tmp_path, monkeypatch):
+    """
+    Runs the test in an empty directory, so that the relative paths of config.py (data/...) are
+    created under it.
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def mock_node():
+    """
+    Starts a mock node from a fixture dict: mock_node(fixture, max_logs=...) returns a Web3 instance
+    connected to it, and the node.
+    """
+    servers = []
+
+    def start(fixture, **kwargs):
+        server = MockRPCServer(fixture, **kwargs).start()
+        servers.append(server)
+        return Web3(Web3.HTTPProvider(server.url)), server.node
+
+    yield start
+    for server in servers:
+        server.stop()
@@ -0,0 +1,463 @@
+"""
+Local stand-in for an Ethereum JSON-RPC node, replaying eth_getLogs, eth_getBlockByNumber,
+eth_blockNumber and eth_call responses from a fixture, so that the fetcher can be exercised without
+network access.
+
+A fixture is a dict {"logs": [raw logs], "timestamps": {block number: timestamp}, "head": block number},
+with optionally "calls": {address: {calldata: {block number: result}}}, the eth_calls missing from it
+being reverted. build_fixture seeds one from the CSV files stored by the fetcher.
+"""
+
+import bisect
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from eth_abi import encode_abi
+from eth_utils import encode_hex, event_abi_to_log_topic, to_checksum_address
+
+from config import *
+from tokemak_quant_project.decoder import parse_static_type
+from tokemak_quant_project.events import REGISTRY
+
+SECONDS_PER_BLOCK = 12
+
+# Error returned by Alchemy when a eth_getLogs request matches too many logs
+TOO_MANY_LOGS_ERROR = {
+    "code": -32005,
+    "message": "query returned more than 10000 results",
+}
+
+REVERTED_ERROR = {"code": 3, "message": "execution reverted", "data": "0x"}
+
+
+def _to_timestamp(block_date):
+    return int(
+        datetime.strptime(block_date, "%Y-%m-%d %H:%M:%S")
+        .replace(tzinfo=timezone.utc)
+        .timestamp()
+    )
+
+
+def _argument_value(abi_type, value):
+    base_type, _ = parse_static_type(abi_type)
+    if base_type == "address":
+        return value if isinstance(value, str) else "0x" + "00" * 20
+    if base_type == "bool":
+        return str(value) == "True"
+    if base_type.startswith("bytes"):
+        return bytes.fromhex(value[2:])
+    return int(value) if not pd.isna(value) else 0
+
+
+def spec_logs(spec, df):
+    """
+    Re-encodes the rows stored for an event into raw eth_getLogs entries.
+
+    :param spec: The EventSpec the rows were stored with.
+    :param df: The stored rows, read with dtype=str so that uint256 values stay exact.
+    :return: A list of raw logs.
+    """
+    topic0 = encode_hex(event_abi_to_log_topic(spec.event_abi))
+    arguments = {}
+    for column, argument, index in spec.fields:
+        # Columns missing from files stored with an older layout are replayed as zeros
+        values = df[column] if column in df else pd.Series([None] * len(df))
+        if index is None:
+            arguments[argument] = list(values)
+        else:
+            arguments.setdefault(argument, [[] for _ in range(len(df))])
+            for items, value in zip(arguments[argument], values):
+                items.append(value)
+    # Arguments which are not stored are replayed as zeros too
+    for entry in spec.event_abi["inputs"]:
+        _, length = parse_static_type(entry["type"])
+        empty = None if length is None else [None] * length
+        arguments.setdefault(entry["name"], [empty] * len(df))
+
+    logs = []
+    for i, row in enumerate(df.itertuples(index=False)):
+        row = row._asdict()
+        topics, data_types, data_values = [topic0], [], []
+        for entry in spec.event_abi["inputs"]:
+            raw = arguments[entry["name"]][i]
+            if isinstance(raw, list):
+                value = [_argument_value(entry["type"], item) for item in raw]
+            else:
+                value = _argument_value(entry["type"], raw)
+            if entry["indexed"]:
+                topics.append(encode_hex(encode_abi([entry["type"]], [value])))
+            else:
+                data_types.append(entry["type"])
+                data_values.append(value)
+        logs.append(
+            {
+                "address": row["address"].lower(),
+                "topics": topics,
+                "data": encode_hex(encode_abi(data_types, data_values)),
+                "blockNumber": hex(int(row["blockNumber"])),
+                "blockHash": row["blockHash"],
+                "transactionHash": row["transactionHash"],
+                "transactionIndex": hex(int(row["transactionIndex"])),
+                "logIndex": hex(int(row["logIndex"])),
+                "removed": False,
+            }
+        )
+    return logs
+
+
+def _random_value(rng, abi_type, max_bits):
+    base_type, _ = parse_static_type(abi_type)
+    if base_type == "address":
+        return to_checksum_address(rng.getrandbits(160).to_bytes(20, "big"))
+    if base_type == "bool":
+        return str(rng.random() < 0.5)
+    if base_type.startswith("bytes"):
+        return (
+            "0x"
+            + rng.getrandbits(8 * int(base_type[5:]))
+            .to_bytes(int(base_type[5:]), "big")
+            .hex()
+        )
+    if base_type.startswith("int"):
+        bits = min(int(base_type[3:] or 256), max_bits)
+        return str(rng.randrange(-(2 ** (bits - 1)), 2 ** (bits - 1)))
+    bits = min(int(base_type[4:] or 256), max_bits)
+    return str(rng.randrange(2**bits))
+
+
+def random_rows(spec, blocks, seed=0, max_bits=256):
+    """
+    Random rows of an event as stored in the CSV files (strings), one log per block of blocks, so
+    that they can be replayed by the mock node with spec_logs. Integers are drawn over the whole
+    range of their ABI type, at most max_bits wide: the event store holds at most 76 digits.
+    """
+    rng = random.Random(seed)
+    types = {entry["name"]: entry["type"] for entry in spec.event_abi["inputs"]}
+    rows = []
+    for i, block in enumerate(blocks):
+        row = {
+            column: _random_value(rng, types[argument], max_bits)
+            for column, argument, _ in spec.fields
+        }
+        row.update(
+            {
+                "event": spec.event,
+                "logIndex": str(i % 7),
+                "transactionIndex": str(i % 3),
+                "transactionHash": f"0x{rng.getrandbits(256):064x}",
+                "address": spec.contract,
+                "blockHash": f"0x{block:064x}",
+                "blockNumber": str(block),
+            }
+        )
+        rows.append(row)
+    return pd.DataFrame(rows, columns=spec.columns)
+
+
+def random_logs(spec, blocks, seed=0, max_bits=256):
+    """
+    :return: Raw eth_getLogs entries of an event, one per block of blocks, see random_rows.
+    """
+    return spec_logs(spec, random_rows(spec, blocks, seed, max_bits))
+
+
+def build_fixture(specs=REGISTRY, date_files=()):
+    """
+    Seeds a fixture from the consolidated CSV files of the given events.
+
+    :param specs: A list of EventSpec, events without a stored file are skipped.
+    :param date_files: Optional CSV files with blockNumber and block_date columns, e.g.
+    data/curve/blockNumberDates.csv, adding block timestamps to the ones found in the event files.
+    :return: A fixture dict.
+    """
+    logs, timestamps = [], {}
+    for spec in specs:
+        if not os.path.exists(spec.filename):
+            continue
+        df = pd.read_csv(spec.filename, dtype=str)
+        logs += spec_logs(spec, df)
+        if "block_date" in df:
+            timestamps.update(_block_timestamps(df))
+    for filename in date_files:
+        timestamps.update(_block_timestamps(pd.read_csv(filename, dtype=str)))
+
+    logs.sort(key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+    head = max([int(log["blockNumber"], 16) for log in logs[-1:]] + list(timestamps))
+    return {"logs": logs, "timestamps": timestamps, "head": head}
+
+
+def _block_timestamps(df):
+    df = df.dropna(subset=["blockNumber", "block_date"])
+    return {
+        int(block_number): _to_timestamp(block_date)
+        for block_number, block_date in zip(df["blockNumber"], df["block_date"])
+    }
+
+
+def save_fixture(fixture, path):
+    """
+    Writes a fixture as gzipped JSON.
+    """
+    with gzip.open(path, "wt") as fixture_file:
+        json.dump(fixture, fixture_file)
+
+
+def load_fixture(path):
+    """
+    Reads a fixture written by save_fixture.
+    """
+    with gzip.open(path, "rt") as fixture_file:
+        fixture = json.load(fixture_file)
+    fixture["timestamps"] = {
+        int(block): timestamp for block, timestamp in fixture["timestamps"].items()
+    }
+    return fixture
+
+
+def _block_number(tag, head):
+    if tag in ("latest", "pending", "safe", "finalized", None):
+        return head
+    if tag == "earliest":
+        return 0
+    return int(tag, 16)
+
+
+def _topic_matches(expected, topic):
+    if expected is None:
+        return True
+    if isinstance(expected, str):
+        return expected.lower() == topic
+    return topic in {item.lower() for item in expected}
+
+
+class MockNode:
+    """
+    Answers JSON-RPC calls from a fixture and counts them per method.
+    """
+
+    def __init__(self, fixture, max_logs=10000, latency=0.0):
+        """
+        :param fixture: A fixture dict, see build_fixture.
+        :param max_logs: Largest number of logs returned by a eth_getLogs call, larger results are
+        rejected with the error Alchemy returns.
+        :param latency: Seconds waited before answering each HTTP request.
+        """
+        self.logs = fixture["logs"]
+        self.log_blocks = [int(log["blockNumber"], 16) for log in self.logs]
+        self.head = fixture["head"]
+        self.known_blocks = sorted(fixture["timestamps"])
+        self.timestamps = fixture["timestamps"]
+        self.eth_calls = {
+            address.lower(): results
+            for address, results in fixture.get("calls", {}).items()
+        }
+        self.max_logs = max_logs
+        self.latency = latency
+        self.calls = Counter()
+        # The methods called by each HTTP request, in the order they were received
+        self.http_requests = []
+        self.lock = threading.Lock()
+
+    def timestamp(self, block_number):
+        """
+        :return: The timestamp of a block, extrapolated from the closest known block when the
+        fixture does not have it.
+        """
+        if block_number in self.timestamps:
+            return self.timestamps[block_number]
+        if not self.known_blocks:
+            return 1600000000 + SECONDS_PER_BLOCK * block_number
+        i = bisect.bisect_left(self.known_blocks, block_number)
+        closest = self.known_blocks[min(i, len(self.known_blocks) - 1)]
+        return self.timestamps[closest] + SECONDS_PER_BLOCK * (block_number - closest)
+
+    def get_logs(self, log_filter):
+        start_block = _block_number(log_filter.get("fromBlock"), self.head)
+        end_block = _block_number(log_filter.get("toBlock"), self.head)
+        addresses = log_filter.get("address")
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = {address.lower() for address in addresses} if addresses else None
+        topics = log_filter.get("topics") or []
+
+        matches = []
+        for i in range(
+            bisect.bisect_left(self.log_blocks, start_block),
+            bisect.bisect_right(self.log_blocks, end_block),
+        ):
+            log = self.logs[i]
+            if addresses is not None and log["address"] not in addresses:
+                continue
+            if len(topics) > len(log["topics"]) or not all(
+                _topic_matches(expected, topic)
+                for expected, topic in zip(topics, log["topics"])
+            ):
+                continue
+            matches.append(log)
+            if len(matches) > self.max_logs:
+                raise MockRPCError(TOO_MANY_LOGS_ERROR)
+        return matches
+
+    def get_block(self, block_number):
+        return {
+            "number": hex(block_number),
+            "hash": "0x%064x" % block_number,
+            "parentHash": "0x%064x" % (block_number - 1),
+            "timestamp": hex(self.timestamp(block_number)),
+            "transactions": [],
+        }
+
+    def eth_call(self, transaction, block_number):
+        results = self.eth_calls.get(transaction["to"].lower(), {})
+        result = results.get(transaction["data"], {}).get(block_number)
+        if result is None:
+            raise MockRPCError(REVERTED_ERROR)
+        return result
+
+    def call(self, method, params):
+        with self.lock:
+            self.calls[method] += 1
+        if method == "eth_chainId":
+            return "0x1"
+        if method == "eth_blockNumber":
+            return hex(self.head)
+        if method == "eth_getBlockByNumber":
+            return self.get_block(_block_number(params[0], self.head))
+        if method == "eth_getLogs":
+            return self.get_logs(params[0])
+        if method == "eth_call":
+            return self.eth_call(params[0], _block_number(params[1], self.head))
+        if method == "mock_calls":
+            # Lets a client running in another process read the call counts
+            with self.lock:
+                return dict(self.calls)
+        raise MockRPCError(
+            {"code": -32601, "message": f"the method {method} does not exist"}
+        )
+
+    def handle(self, request):
+        """
+        :param request: A JSON-RPC request dict.
+        :return: The JSON-RPC response dict.
+        """
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            response["result"] = self.call(request["method"], request.get("params", []))
+        except MockRPCError as e:
+            response["error"] = e.error
+        return response
+
+
+class MockRPCError(Exception):
+    def __init__(self, error):
+        super().__init__(error["message"])
+        self.error = error
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle's algorithm would delay every response
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        node = self.server.node
+        if node.latency:
+            time.sleep(node.latency)
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with node.lock:
+            node.http_requests.append(
+                [request["method"] for request in payload]
+                if isinstance(payload, list)
+                else [payload["method"]]
+            )
+            http_error = (
+                self.server.http_errors.pop(0) if self.server.http_errors else None
+            )
+        if http_error is not None:
+            self.send_response(http_error)
+            if self.server.retry_after is not None:
+                self.send_header("Retry-After", str(self.server.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if isinstance(payload, list):
+            body = [node.handle(request) for request in payload]
+        else:
+            body = node.handle(payload)
+        responses = body if isinstance(body, list) else [body]
+        failed = any("error" in response for response in responses)
+        status = self.server.error_status if failed else 200
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockRPCServer:
+    """
+    Serves a MockNode over HTTP on localhost, in a background thread.
+
+    with MockRPCServer(fixture) as server:
+        w3 = Web3(Web3.HTTPProvider(server.url))
+    """
+
+    def __init__(
+        self,
+        fixture,
+        max_logs=10000,
+        latency=0.0,
+        port=0,
+        error_status=200,
+        http_errors=(),
+        retry_after=None,
+    ):
+        """
+        :param fixture: A fixture dict, see build_fixture.
+        :param max_logs: Largest number of logs returned by a eth_getLogs call.
+        :param latency: Seconds waited before answering each HTTP request.
+        :param port: The port to listen on, a free one by default.
+        :param error_status: The HTTP status of the responses holding a JSON-RPC error, some
+        providers answer e.g. a too large eth_getLogs range with a 400.
+        :param http_errors: HTTP statuses answered, without a body, to the first requests, e.g.
+        [429, 503] for a node which is rate limiting or down.
+        :param retry_after: The Retry-After header of these responses, in seconds.
+        """
+        self.node = MockNode(fixture, max_logs=max_logs, latency=latency)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.node = self.node
+        self.httpd.error_status = error_status
+        self.httpd.http_errors = list(http_errors)
+        self.httpd.retry_after = retry_after
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
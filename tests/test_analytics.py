@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tokemak_quant_project.analytics import (
+    amounts_agg,
+    daily_fees,
+    daily_net_flow,
+    daily_price_volatility,
+    daily_volume,
+    prepare_liquidity_events,
+    swap_prices,
+)
+from utilities import calculate_amounts_agg
+
+E18 = 10**18
+DAYS = pd.to_datetime(["2023-09-05", "2023-09-06", "2023-09-07"])
+
+
+def test_amounts_agg_matches_the_row_wise_version():
+    df = pd.DataFrame(
+        {
+            "a": [0, 5, 10, 10, 0, 3, 12, 2**70],
+            "b": [5, 0, 10.5, 20, 0, 0.5, 11, 2**70 + 1],
+        }
+    )
+    expected = df.apply(calculate_amounts_agg, axis=1, args=("a", "b"))
+    assert amounts_agg(df, "a", "b").tolist() == expected.tolist()
+    assert amounts_agg(df, "a", "b").tolist() == [5, 5, 10.5, 10, 0, 3, 11, 2**70 + 1]
+
+
+def test_amounts_agg_keeps_raw_integers_exact():
+    df = pd.DataFrame({"a": [0, 3 * 10**30], "b": [10**30 + 1, 0]}, dtype=object)
+    assert amounts_agg(df, "a", "b").tolist() == [10**30 + 1, 3 * 10**30]
+
+
+def liquidity_events(rows):
+    """
+    Stored liquidity events from (date, token amount of ETH, of stETH, fee of ETH, fee of stETH)
+    tuples, the amounts in token units.
+    """
+    df = pd.DataFrame(
+        rows,
+        columns=[
+            "block_date",
+            "token_amounts_a",
+            "token_amounts_b",
+            "fees_a",
+            "fees_b",
+        ],
+    )
+    for column in df.columns[1:]:
+        df[column] = [int(value * E18) for value in df[column]]
+    return prepare_liquidity_events(df)
+
+
+@pytest.fixture
+def add_liquidity():
+    return liquidity_events(
+        [
+            ("2023-09-05 10:00:00", 1.0, 0.0, 0.1, 0.0),
+            ("2023-09-05 23:59:59", 0.0, 2.0, 0.0, 0.2),
+            ("2023-09-06 00:00:00", 3.0, 3.1, 0.3, 0.31),
+        ]
+    )
+
+
+@pytest.fixture
+def remove_liquidity():
+    return liquidity_events(
+        [
+            ("2023-09-06 12:00:00", 0.5, 0.0, 0.05, 0.0),
+            ("2023-09-07 12:00:00", 1.5, 4.0, 0.0, 0.0),
+        ]
+    )
+
+
+def test_prepare_liquidity_events(add_liquidity):
+    assert add_liquidity["date"].tolist() == [DAYS[0], DAYS[0], DAYS[1]]
+    # Close amounts count as the stETH amount
+    assert add_liquidity["token_amounts"].tolist() == [1.0, 2.0, 3.1]
+    assert add_liquidity["fee_amounts"].tolist() == [0.1, 0.2, 0.31]
+
+
+def test_daily_volume(add_liquidity, remove_liquidity):
+    volume = daily_volume(add_liquidity, remove_liquidity)
+    assert volume.index.tolist() == DAYS.tolist()
+    assert volume["volume"].tolist() == pytest.approx([3.0, 3.6, 1.5])
+    assert volume["cumulative_volume"].tolist() == pytest.approx([3.0, 6.6, 8.1])
+
+
+def test_daily_fees(add_liquidity, remove_liquidity):
+    fees = daily_fees(add_liquidity, remove_liquidity)
+    assert fees["fees"].tolist() == pytest.approx([0.3, 0.36, 0.0])
+    assert fees["cumulative_fees"].tolist() == pytest.approx([0.3, 0.66, 0.66])
+    assert daily_fees(add_liquidity)["fees"].tolist() == pytest.approx([0.3, 0.31])
+
+
+def test_daily_net_flow(add_liquidity, remove_liquidity):
+    flows = daily_net_flow(add_liquidity, remove_liquidity, initial_tvl=10.0)
+    assert flows.index.tolist() == DAYS.tolist()
+    assert flows["deposits"].tolist() == pytest.approx([3.0, 3.1, 0.0])
+    assert flows["withdrawals"].tolist() == pytest.approx([0.0, 0.5, 1.5])
+    assert flows["net_flow"].tolist() == pytest.approx([3.0, 2.6, -1.5])
+    assert flows["tvl"].tolist() == pytest.approx([13.0, 15.6, 14.1])
+
+
+@pytest.fixture
+def swaps():
+    # (date, sold_id, tokens_sold, tokens_bought), 1 is stETH
+    rows = [
+        ("2023-09-05", 1, 2.0, 1.98),
+        ("2023-09-05", 0, 1.0, 1 / 0.97),
+        ("2023-09-06", 1, 1.0, 1.0),
+        ("2023-09-07", 0, 0.99, 1.0),
+        ("2023-09-07", 1, 0.0, 1.0),
+    ]
+    df = pd.DataFrame(rows, columns=["date", "sold_id", "tokens_sold", "tokens_bought"])
+    df["date"] = pd.to_datetime(df["date"])
+    for column in ("tokens_sold", "tokens_bought"):
+        df[column] = [int(value * E18) for value in df[column]]
+    return df
+
+
+def test_swap_prices(swaps):
+    prices = swap_prices(swaps)
+    assert prices.iloc[:4].tolist() == pytest.approx([0.99, 0.97, 1.0, 0.99])
+    # Nothing sold, no price
+    assert np.isnan(prices.iloc[4])
+
+
+def test_daily_price_volatility(swaps):
+    volatility = daily_price_volatility(swaps, window=2)
+    assert volatility.index.tolist() == DAYS.tolist()
+    assert volatility["price"].tolist() == pytest.approx([0.98, 1.0, 0.99])
+    assert np.isnan(volatility["rolling_volatility"].iloc[0])
+    assert volatility["rolling_volatility"].iloc[1:].tolist() == pytest.approx(
+        [0.02 / np.sqrt(2), 0.01 / np.sqrt(2)]
+    )
@@ -0,0 +1,85 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from config import *
+from tokemak_quant_project.block_index import BlockTimeIndex, date_bounds
+from tokemak_quant_project.block_timestamps import BlockTimestampCache
+
+START = MERGE_BLOCK + 1000
+T0 = 1690000000
+# One missed slot at block START + 600, every other block SLOT_SECONDS after its parent
+MISSED = START + 600
+TIMESTAMPS = {
+    block: T0 + SLOT_SECONDS * (block - START + (block >= MISSED))
+    for block in range(START, START + 1001)
+}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return BlockTimestampCache(str(tmp_path / "timestamps.sqlite"))
+
+
+def test_on_grid_blocks_are_exact_without_node(cache):
+    cache.put({START: TIMESTAMPS[START], START + 500: TIMESTAMPS[START + 500]})
+    index = BlockTimeIndex(cache=cache)
+    blocks = np.arange(START, START + 501)
+    assert index.timestamps(blocks).tolist() == [TIMESTAMPS[b] for b in blocks]
+
+
+def test_off_grid_blocks_are_interpolated_without_node(cache):
+    cache.put({START: TIMESTAMPS[START], START + 1000: TIMESTAMPS[START + 1000]})
+    index = BlockTimeIndex(cache=cache)
+    (timestamp,) = index.timestamps([START + 500])
+    # Interpolated over the interval holding the missed slot
+    assert timestamp == round(T0 + (SLOT_SECONDS * 1001) / 2)
+
+
+def test_missed_slots_are_pinned_down_with_the_node(cache, mock_node):
+    w3, node = mock_node({"logs": [], "timestamps": TIMESTAMPS, "head": START + 1000})
+    cache.put({START: TIMESTAMPS[START], START + 1000: TIMESTAMPS[START + 1000]})
+    index = BlockTimeIndex(w3, cache=cache)
+    blocks = [START + 10, MISSED - 1, MISSED, MISSED + 1, START + 900]
+    assert index.timestamps(blocks).tolist() == [TIMESTAMPS[b] for b in blocks]
+    # Bisected, rather than fetching every block
+    assert node.calls["eth_getBlockByNumber"] < 40
+
+
+def test_block_at_and_ranges(cache):
+    cache.put({START: TIMESTAMPS[START], START + 500: TIMESTAMPS[START + 500]})
+    index = BlockTimeIndex(cache=cache)
+    assert index.block_at([T0 + 120, T0 + 125, T0 - 1]).tolist() == [
+        START + 10,
+        START + 10,
+        -1,
+    ]
+    assert index.block_range(T0 + 1, T0 + 24) == (START + 1, START + 2)
+    assert index.block_range(T0 + 1, T0 + 11) is None
+
+
+def test_date_block_range_holds_the_whole_day(cache):
+    # One block every 12 seconds, START produced at the first second of a local day
+    day = int(datetime(2023, 9, 5).timestamp())
+    cache.put({START - 100: day - 1200, START + 14400: day + 12 * 14400})
+    index = BlockTimeIndex(cache=cache)
+    assert index.date_block_range("2023-09-05", "2023-09-05") == (START, START + 7199)
+    assert index.dates([START + 7199, START + 7200]).tolist() == [
+        "2023-09-05 23:59:48",
+        "2023-09-06 00:00:00",
+    ]
+
+
+def test_date_bounds():
+    assert date_bounds("2023-06-01", "2023-06-30")[1] == np.datetime64(
+        "2023-06-30T23:59:59.999999999"
+    )
+    assert date_bounds("2023-06-01", "2023-06-30 12:00")[1] == np.datetime64(
+        "2023-06-30T12:00:00"
+    )
+
+
+def test_no_anchors_without_node(cache):
+    with pytest.raises(ValueError, match="no anchors"):
+        BlockTimeIndex(cache=cache).timestamps([START])
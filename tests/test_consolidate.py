@@ -0,0 +1,83 @@
+import os
+from datetime import datetime
+
+from tests.mock_rpc import random_rows
+from tokemak_quant_project.consolidate import (
+    consolidate_events,
+    fragment_paths,
+    merge_fragments,
+    read_events_csv,
+)
+from tokemak_quant_project.events import REGISTRY
+
+SPEC = next(spec for spec in REGISTRY if spec.event == "AddLiquidity")
+
+
+def write_fragment(directory, batch_n, df):
+    path = os.path.join(directory, f"{os.path.basename(SPEC.filename)}_{batch_n}")
+    df.to_csv(path, index=False)
+    return path
+
+
+def test_fragment_paths_sorted_by_batch_number(tmp_path):
+    df = random_rows(SPEC, [1])
+    for batch_n in (10, 2, 1):
+        write_fragment(tmp_path, batch_n, df)
+    (tmp_path / "other.csv_3").write_text("")
+    filename = os.path.join(tmp_path, os.path.basename(SPEC.filename))
+    assert [os.path.basename(path) for path in fragment_paths(filename)] == [
+        f"{os.path.basename(SPEC.filename)}_{batch_n}" for batch_n in (1, 2, 10)
+    ]
+
+
+def test_merge_fragments_dedupes_and_sorts(tmp_path):
+    rows = random_rows(SPEC, range(100, 130))
+    paths = [
+        # Newest window first, like the backfill writes them
+        write_fragment(tmp_path, 1, rows.iloc[20:]),
+        write_fragment(tmp_path, 2, rows.iloc[5:25]),
+        write_fragment(tmp_path, 3, rows.iloc[:10]),
+    ]
+    merged = merge_fragments(paths)
+    assert merged["blockNumber"].tolist() == list(range(100, 130))
+    assert merged["transactionHash"].tolist() == rows["transactionHash"].tolist()
+    # uint256 values are written back unchanged
+    assert merged["token_supply"].tolist() == rows["token_supply"].tolist()
+
+
+def test_merge_fragments_skips_empty_and_mixed_headers(tmp_path):
+    rows = random_rows(SPEC, range(100, 110))
+    dated = rows.iloc[5:].assign(block_date="2023-09-05 00:00:00")
+    paths = [
+        write_fragment(tmp_path, 1, rows.iloc[:5]),
+        write_fragment(tmp_path, 2, dated),
+        write_fragment(tmp_path, 3, rows.iloc[:0]),
+    ]
+    (tmp_path / "empty").write_text("")
+    merged = merge_fragments(paths + [str(tmp_path / "empty")])
+    assert merged["blockNumber"].tolist() == list(range(100, 110))
+    assert "block_date" not in merged
+
+
+def test_merge_fragments_without_rows(tmp_path):
+    (tmp_path / "empty").write_text("")
+    assert merge_fragments([str(tmp_path / "empty")]) is None
+
+
+def test_consolidate_events(in_tmp_dir, mock_node):
+    os.makedirs(os.path.dirname(SPEC.filename))
+    rows = random_rows(SPEC, range(18000000, 18000020))
+    write_fragment(os.path.dirname(SPEC.filename), 1, rows.iloc[10:])
+    write_fragment(os.path.dirname(SPEC.filename), 2, rows.iloc[:12])
+    timestamps = {18000000 + i: 1693872000 + 12 * i for i in range(20)}
+    w3, _ = mock_node({"logs": [], "timestamps": timestamps, "head": 18000100})
+
+    assert consolidate_events([SPEC], w3) == {SPEC: 20}
+    assert fragment_paths(SPEC.filename) == []
+    df = read_events_csv(SPEC.filename)
+    assert df["blockNumber"].tolist() == list(range(18000000, 18000020))
+    # Formatted in local time like the files of the backfill
+    assert df["block_date"].tolist() == [
+        datetime.fromtimestamp(timestamps[block]).strftime("%Y-%m-%d %H:%M:%S")
+        for block in df["blockNumber"]
+    ]
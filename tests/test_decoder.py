@@ -0,0 +1,149 @@
+import random
+
+import numpy as np
+import pytest
+from eth_abi import encode_abi
+from eth_utils import encode_hex, event_abi_to_log_topic, to_checksum_address
+from hexbytes import HexBytes
+from web3 import Web3
+from web3._utils.events import get_event_data
+
+from config import *
+from tokemak_quant_project.decoder import (
+    concat_columns,
+    decode_logs,
+    pack_logs,
+    parse_static_type,
+)
+from utilities import load_abi
+
+EVENTS = [
+    (CURVE_POOL_ABI_PATH, "AddLiquidity"),
+    (CURVE_POOL_ABI_PATH, "RemoveLiquidity"),
+    (CURVE_POOL_ABI_PATH, "RemoveLiquidityOne"),
+    (CURVE_POOL_ABI_PATH, "RemoveLiquidityImbalance"),
+    (CURVE_POOL_ABI_PATH, "TokenExchange"),
+    (CURVE_TOKEN_ABI_PATH, "Transfer"),
+    (MAVERICK_TOKEN_ABI_PATH, "ETHDepositReceived"),
+    (MAVERICK_TOKEN_ABI_PATH, "ETHWithdrawn"),
+    (MAVERICK_TOKEN_ABI_PATH, "Reprice"),
+    (MAVERICK_TOKEN_ABI_PATH, "Transfer"),
+]
+
+
+def event_abi(abi_path, event):
+    return next(
+        entry
+        for entry in load_abi(abi_path)
+        if entry.get("type") == "event" and entry["name"] == event
+    )
+
+
+def random_value(rng, abi_type):
+    base_type, length = parse_static_type(abi_type)
+    if length is not None:
+        return [random_value(rng, base_type) for _ in range(length)]
+    if base_type == "address":
+        return to_checksum_address(rng.getrandbits(160).to_bytes(20, "big"))
+    if base_type == "bool":
+        return rng.random() < 0.5
+    if base_type.startswith("bytes"):
+        size = int(base_type[5:])
+        return rng.getrandbits(8 * size).to_bytes(size, "big")
+    if base_type.startswith("int"):
+        bits = int(base_type[3:] or 256)
+        return rng.randrange(-(2 ** (bits - 1)), 2 ** (bits - 1))
+    # Small and large values, so that both the uint64 and the object paths are decoded
+    bits = rng.choice([8, 64, int(base_type[4:] or 256)])
+    return rng.randrange(2**bits)
+
+
+def random_logs(abi, blocks, seed=0):
+    """
+    Raw eth_getLogs entries of an event with random arguments, one per block of blocks.
+    """
+    rng = random.Random(seed)
+    logs = []
+    for i, block in enumerate(blocks):
+        topics = [encode_hex(event_abi_to_log_topic(abi))]
+        data_types, data_values = [], []
+        for entry in abi["inputs"]:
+            value = random_value(rng, entry["type"])
+            if entry["indexed"]:
+                topics.append(encode_hex(encode_abi([entry["type"]], [value])))
+            else:
+                data_types.append(entry["type"])
+                data_values.append(value)
+        logs.append(
+            {
+                "address": f"0x{rng.getrandbits(160):040x}",
+                "topics": topics,
+                "data": encode_hex(encode_abi(data_types, data_values)),
+                "blockNumber": hex(block),
+                "blockHash": f"0x{block:064x}",
+                "transactionHash": f"0x{rng.getrandbits(256):064x}",
+                "transactionIndex": hex(i % 3),
+                "logIndex": hex(i % 7),
+                "removed": False,
+            }
+        )
+    return logs
+
+
+def web3_decode(abi, log):
+    """
+    Decodes a raw log with web3's own log decoder.
+    """
+    log = dict(log)
+    log["topics"] = [HexBytes(topic) for topic in log["topics"]]
+    for field in ("logIndex", "transactionIndex", "blockNumber"):
+        log[field] = int(log[field], 16)
+    return get_event_data(Web3().codec, abi, log)
+
+
+def python_value(value):
+    if isinstance(value, np.ndarray):
+        return [python_value(item) for item in value]
+    return value.item() if hasattr(value, "item") else value
+
+
+@pytest.mark.parametrize("abi_path, event", EVENTS, ids=[e for _, e in EVENTS])
+@pytest.mark.parametrize("packed", [False, True], ids=["dicts", "packed"])
+def test_decode_logs_matches_web3(abi_path, event, packed):
+    abi = event_abi(abi_path, event)
+    logs = random_logs(abi, range(18000000, 18000050), seed=len(event))
+    columns = decode_logs(abi, pack_logs(abi, logs) if packed else logs)
+
+    for i, log in enumerate(logs):
+        expected = web3_decode(abi, log)
+        for entry in abi["inputs"]:
+            value = python_value(columns[entry["name"]][i])
+            expected_value = expected["args"][entry["name"]]
+            if isinstance(expected_value, bytes):
+                expected_value = "0x" + expected_value.hex()
+            if isinstance(value, list):
+                expected_value = list(expected_value)
+            assert value == expected_value, entry["name"]
+        assert columns["event"][i] == expected["event"]
+        assert columns["logIndex"][i] == expected["logIndex"]
+        assert columns["transactionIndex"][i] == expected["transactionIndex"]
+        assert columns["blockNumber"][i] == expected["blockNumber"]
+        assert columns["transactionHash"][i] == log["transactionHash"]
+        # web3 leaves the address of the log as the node returned it
+        assert columns["address"][i] == to_checksum_address(expected["address"])
+
+
+def test_decode_no_logs():
+    abi = event_abi(CURVE_POOL_ABI_PATH, "TokenExchange")
+    columns = decode_logs(abi, [])
+    assert all(len(values) == 0 for values in columns.values())
+
+
+def test_concat_columns():
+    abi = event_abi(CURVE_POOL_ABI_PATH, "AddLiquidity")
+    logs = random_logs(abi, range(100, 120))
+    columns = concat_columns([decode_logs(abi, logs[:5]), decode_logs(abi, logs[5:])])
+    expected = decode_logs(abi, logs)
+    assert columns.keys() == expected.keys()
+    for name, values in expected.items():
+        assert python_value(columns[name]) == python_value(values), name
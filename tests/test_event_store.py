@@ -0,0 +1,134 @@
+import pytest
+
+from tests.mock_rpc import random_logs
+from tokemak_quant_project.address_table import AddressTable
+from tokemak_quant_project.decoder import decode_logs
+from tokemak_quant_project.event_store import VERSION_FILENAME, EventStore
+from tokemak_quant_project.events import REGISTRY, EventSpec
+
+SPEC = next(spec for spec in REGISTRY if spec.event == "AddLiquidity")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EventStore(
+        root=str(tmp_path / "events"),
+        addresses=AddressTable(str(tmp_path / "addresses.sqlite")),
+    )
+
+
+def events_frame(blocks, seed=0):
+    # Wider than any numpy integer, within the 76 digits of the stored decimals
+    logs = random_logs(SPEC, blocks, seed, max_bits=200)
+    return SPEC.to_frame(decode_logs(SPEC.event_abi, logs))
+
+
+def test_round_trip(store):
+    frame = events_frame(range(100, 150))
+    store.write(SPEC, frame.iloc[25:], 125, 149)
+    store.write(SPEC, frame.iloc[:25], 100, 124)
+
+    read = store.read(SPEC.pool, SPEC.event, compact=False)
+    assert list(read.columns) == list(frame.columns)
+    for column in frame.columns:
+        assert read[column].tolist() == frame[column].tolist(), column
+    # uint256 values are exact, beyond any numpy integer
+    assert read["token_supply"].tolist() == [
+        int(value) for value in frame["token_supply"]
+    ]
+
+    compact = store.read(SPEC.pool, SPEC.event)
+    assert store.addresses.addresses(compact["provider"].to_numpy()).tolist() == (
+        frame["provider"].tolist()
+    )
+    assert (
+        compact["transactionHash"].iloc[0].hex() == frame["transactionHash"].iloc[0][2:]
+    )
+
+
+def test_read_slices_blocks_and_columns(store):
+    frame = events_frame(range(100, 150))
+    for start in range(100, 150, 10):
+        store.write(SPEC, frame.iloc[start - 100 : start - 90], start, start + 9)
+
+    assert [
+        path[:2] for path in store.partitions(SPEC.pool, SPEC.event, (115, 125))
+    ] == [
+        (110, 119),
+        (120, 129),
+    ]
+    read = store.read(
+        SPEC.pool, SPEC.event, columns=["blockNumber", "provider"], blocks=(115, 125)
+    )
+    assert list(read.columns) == ["blockNumber", "provider"]
+    assert read["blockNumber"].tolist() == list(range(115, 126))
+
+
+def test_overlapping_partitions_are_deduplicated(store):
+    frame = events_frame(range(100, 130))
+    store.write(SPEC, frame.iloc[:20], 100, 119)
+    store.write(SPEC, frame.iloc[10:], 110, 129)
+    read = store.read(SPEC.pool, SPEC.event, compact=False)
+    assert read["blockNumber"].tolist() == list(range(100, 130))
+    assert read["transactionHash"].tolist() == frame["transactionHash"].tolist()
+
+
+def test_drop_after_and_last_block(store):
+    frame = events_frame(range(100, 130))
+    assert store.last_block(SPEC.pool, SPEC.event) is None
+    for start in (100, 110, 120):
+        store.write(SPEC, frame.iloc[start - 100 : start - 90], start, start + 9)
+    assert store.last_block(SPEC.pool, SPEC.event) == 129
+
+    store.drop_after(SPEC.pool, SPEC.event, 115)
+    assert store.last_block(SPEC.pool, SPEC.event) == 119
+    read = store.read(SPEC.pool, SPEC.event)
+    assert read["blockNumber"].tolist() == list(range(100, 120))
+    assert store.block_numbers(SPEC.pool) == list(range(100, 120))
+
+
+def test_read_empty(store):
+    assert store.read(SPEC.pool, SPEC.event).empty
+    assert store.partitions(SPEC.pool, SPEC.event) == []
+
+
+def test_pools_of_a_project_sharing_an_event(store):
+    # A second pool of the same project emitting the same event
+    other = EventSpec(
+        SPEC.project,
+        "0x" + "33" * 20,
+        SPEC.abi_path,
+        SPEC.event,
+        SPEC.filename,
+        pool="other_pool",
+    )
+    store.write(SPEC, events_frame(range(100, 110)), 100, 109)
+    store.write(other, events_frame(range(200, 205), seed=1), 200, 204)
+    assert store.read(SPEC.pool, SPEC.event)["blockNumber"].tolist() == list(
+        range(100, 110)
+    )
+    assert store.read(other.pool, other.event)["blockNumber"].tolist() == list(
+        range(200, 205)
+    )
+
+
+def test_store_version_is_written_and_checked(store, tmp_path):
+    store.write(SPEC, events_frame(range(100, 110)), 100, 109)
+    reopened = EventStore(root=store.root, addresses=store.addresses)
+    assert reopened.last_block(SPEC.pool, SPEC.event) == 109
+
+    (tmp_path / "events" / VERSION_FILENAME).write_text('{"version": 0}')
+    with pytest.raises(ValueError, match="version 0, expected version"):
+        EventStore(root=store.root, addresses=store.addresses)
+
+
+def test_unversioned_store_is_refused(tmp_path):
+    # Written before the store was versioned, with partitions keyed by project
+    old = tmp_path / "events" / "pool=curve" / "event=AddLiquidity"
+    old.mkdir(parents=True)
+    (old / "blocks=0000000100-0000000109.parquet").write_bytes(b"")
+    with pytest.raises(ValueError, match="another layout \\(no version"):
+        EventStore(
+            root=str(tmp_path / "events"),
+            addresses=AddressTable(str(tmp_path / "addresses.sqlite")),
+        )
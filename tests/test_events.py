@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+import pytest
+
+from tokemak_quant_project.events import REGISTRY, EventSpec
+
+
+@pytest.mark.parametrize(
+    "spec", [spec for spec in REGISTRY if os.path.exists(spec.filename)], ids=repr
+)
+def test_columns_match_the_stored_files(spec):
+    header = pd.read_csv(spec.filename, nrows=0).columns
+    assert spec.columns == [column for column in header if column != "block_date"]
+
+
+def test_explicit_columns():
+    deposits = next(spec for spec in REGISTRY if spec.event == "ETHDepositReceived")
+    assert deposits.columns[:5] == [
+        "from",
+        "referral",
+        "amount",
+        "swETHMinted",
+        "newTotalETHDeposited",
+    ]
+    imbalance = next(
+        spec for spec in REGISTRY if spec.event == "RemoveLiquidityImbalance"
+    )
+    with pytest.raises(ValueError, match="no arguments stored as \\['fee'\\]"):
+        EventSpec(
+            imbalance.project,
+            imbalance.contract,
+            imbalance.abi_path,
+            imbalance.event,
+            imbalance.filename,
+            columns=["provider", "fee"],
+        )
@@ -0,0 +1,131 @@
+import pytest
+
+from tests.mock_rpc import random_logs
+from tokemak_quant_project.events import REGISTRY, EventSpec, group_by_abi
+from tokemak_quant_project.fetch_pool_data import (
+    PoolDataFetcher,
+    fetch_raw_events,
+    split_by_contract,
+)
+
+START = 18000000
+POOL = next(spec for spec in REGISTRY if spec.event == "TokenExchange").contract
+# A second pool sharing the ABI of the Curve stETH/ETH pool, and one not queried
+OTHER_POOL = "0x" + "12" * 20
+IGNORED_POOL = "0x" + "34" * 20
+TOKEN = next(spec for spec in REGISTRY if spec.pool == "curve_steth_lp_token")
+
+
+def pool_spec(contract, event):
+    template = next(
+        spec for spec in REGISTRY if spec.contract == POOL and spec.event == event
+    )
+    return EventSpec(
+        "curve",
+        contract,
+        template.abi_path,
+        event,
+        f"{template.filename}.{contract}",
+        pool=contract,
+    )
+
+
+SPECS = [
+    pool_spec(POOL, "TokenExchange"),
+    pool_spec(OTHER_POOL, "TokenExchange"),
+    TOKEN,
+    pool_spec(POOL, "AddLiquidity"),
+    pool_spec(OTHER_POOL, "AddLiquidity"),
+]
+# The blocks of the logs of each spec
+BLOCKS = [[0, 2, 4], [1, 3], [2], [1], [0, 5]]
+
+
+@pytest.fixture
+def node(mock_node):
+    logs = []
+    for seed, (spec, blocks) in enumerate(zip(SPECS, BLOCKS)):
+        logs.append(random_logs(spec, [START + block for block in blocks], seed=seed))
+    ignored = random_logs(pool_spec(IGNORED_POOL, "TokenExchange"), [START + 3])
+    fixture_logs = sorted(
+        sum(logs, ignored),
+        key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)),
+    )
+    w3, node = mock_node({"logs": fixture_logs, "timestamps": {}, "head": START + 9})
+    return w3, node, logs
+
+
+def transaction_hashes(logs):
+    return [log["transactionHash"] for log in logs]
+
+
+def test_group_by_abi():
+    groups = group_by_abi(SPECS)
+    assert [(contracts, specs) for contracts, _, specs in groups] == [
+        ([POOL, OTHER_POOL], [SPECS[0], SPECS[1], SPECS[3], SPECS[4]]),
+        ([TOKEN.contract], [TOKEN]),
+    ]
+    assert groups[0][1] == SPECS[0].abi
+    # At most max_addresses contracts per request
+    assert [contracts for contracts, _, _ in group_by_abi(SPECS, max_addresses=1)] == [
+        [POOL],
+        [OTHER_POOL],
+        [TOKEN.contract],
+    ]
+
+
+@pytest.mark.parametrize("multi_topic, requests", [(True, 1), (False, 3)])
+def test_multi_topic_routing(node, multi_topic, requests):
+    w3, mock, logs = node
+    fetcher = PoolDataFetcher(w3, POOL, SPECS[0].abi, multi_topic=multi_topic)
+    events = ["AddLiquidity", "RemoveLiquidity", "TokenExchange"]
+    decoded = fetcher.get_logs(events, START, START + 9)
+    # With a topic0 OR-list, a single request for the three events
+    assert mock.calls["eth_getLogs"] == requests
+    # Each log is decoded with the ABI entry of its topic0
+    assert [list(columns["transactionHash"]) for columns in decoded] == [
+        transaction_hashes(logs[3]),
+        [],
+        transaction_hashes(logs[0]),
+    ]
+    assert [set(columns["event"]) for columns in decoded] == [
+        {"AddLiquidity"},
+        set(),
+        {"TokenExchange"},
+    ]
+    assert decoded[0]["token_amounts"].shape == (1, 2)
+    assert list(decoded[2]["tokens_sold"]) == [
+        int(log["data"][66:130], 16) for log in logs[0]
+    ]
+
+
+def test_multi_topic_multi_address_routing(node):
+    w3, mock, logs = node
+    (contracts, abi, group_specs), _ = group_by_abi(SPECS)
+    fetcher = PoolDataFetcher(w3, contracts, abi)
+    raw_logs = fetcher.fetch_raw_logs(
+        ["TokenExchange", "AddLiquidity"], START, START + 9
+    )
+    # A single request for both events of both pools
+    assert mock.calls["eth_getLogs"] == 1
+    assert [len(event_logs) for event_logs in raw_logs] == [5, 3]
+
+    routed = split_by_contract(
+        group_specs, {"TokenExchange": raw_logs[0], "AddLiquidity": raw_logs[1]}
+    )
+    for spec, spec_logs in zip(group_specs, routed):
+        expected = logs[SPECS.index(spec)]
+        assert transaction_hashes(spec_logs) == transaction_hashes(expected)
+        assert {log["address"] for log in spec_logs} == {spec.contract.lower()}
+
+
+def test_fetch_raw_events(node):
+    w3, mock, logs = node
+    raw_logs = fetch_raw_events(w3, SPECS, START, START + 9)
+    assert mock.calls["eth_getLogs"] == 2
+    assert [transaction_hashes(spec_logs) for spec_logs in raw_logs] == [
+        transaction_hashes(spec_logs) for spec_logs in logs
+    ]
+    # In the order of the specs asked for
+    reordered = fetch_raw_events(w3, SPECS[::-1], START, START + 9)
+    assert reordered == raw_logs[::-1]
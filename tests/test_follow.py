@@ -0,0 +1,115 @@
+import pytest
+
+from tests.mock_rpc import random_logs
+from tokemak_quant_project import follow
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.events import REGISTRY
+from tokemak_quant_project.fetch_pool_data import PoolDataFetcher
+from tokemak_quant_project.follow import LiveFollower
+from tokemak_quant_project.sync import SyncManifest
+
+SPEC = next(spec for spec in REGISTRY if spec.event == "TokenExchange")
+STALE_HASH = "0x" + "ee" * 32
+
+
+def block_hash(block):
+    # The hashes of the canonical chain of the mock node
+    return "0x%064x" % block
+
+
+@pytest.fixture
+def follower(in_tmp_dir, mock_node):
+    """
+    A follower which stored the events up to block 100 and buffered blocks 101 to 110, of which
+    106 to 110 were then rolled back.
+    """
+    w3, _ = mock_node({"logs": [], "timestamps": {}, "head": 112})
+    follower = LiveFollower(
+        w3,
+        [SPEC],
+        SyncManifest(str(in_tmp_dir / "manifest.json")),
+        fetch=lambda start_block, end_block: [[]],
+        confirmations=12,
+    )
+    follower.final_block = 100
+    follower.final_hash = block_hash(100)
+    follower.tip = 110
+    follower.blocks = {
+        block: (block_hash(block) if block <= 105 else STALE_HASH, 0)
+        for block in range(101, 111)
+    }
+    follower.logs = [random_logs(SPEC, [103, 105, 107])]
+    follower.logs[0][-1]["blockHash"] = STALE_HASH
+    return follower
+
+
+def test_rewind_drops_the_blocks_after_the_fork(follower):
+    follower.rewind()
+    assert follower.tip == 105
+    assert sorted(follower.blocks) == list(range(101, 106))
+    assert [log["blockNumber"] for log in follower.logs[0]] == [hex(103), hex(105)]
+    assert follower.final_block == 100
+    assert follower.final_hash == block_hash(100)
+
+
+def test_rewind_past_the_stored_block(follower):
+    # The last stored block was rolled back too
+    follower.final_hash = STALE_HASH
+    follower.rewind()
+    assert follower.tip == 100
+    assert follower.blocks == {}
+    assert follower.logs == [[]]
+    assert follower.final_hash == block_hash(100)
+
+
+def test_step_detects_the_reorg_and_rewinds(follower):
+    assert follower.step() == 1
+    assert follower.tip == 105
+    # The next poll fetches the dropped blocks again, from the canonical chain
+    follower.poll()
+    assert follower.tip == 112
+    assert all(
+        follower.blocks[block][0] == block_hash(block) for block in follower.blocks
+    )
+
+
+def test_store_writes_are_buffered(in_tmp_dir, mock_node, monkeypatch):
+    monkeypatch.setattr(follow, "STORE_FORMAT", "parquet")
+    logs = random_logs(SPEC, range(101, 150), max_bits=200)
+    w3, _ = mock_node({"logs": logs, "timestamps": {}, "head": 150})
+    fetcher = PoolDataFetcher(w3, SPEC.contract, SPEC.abi)
+    manifest = SyncManifest(str(in_tmp_dir / "manifest.json"))
+    manifest.set(SPEC.contract, SPEC.event, 100)
+    follower = LiveFollower(
+        w3,
+        [SPEC],
+        manifest,
+        fetch=lambda start_block, end_block: fetcher.get_raw_logs(
+            [SPEC.event], start_block, end_block
+        ),
+        confirmations=2,
+        max_blocks=10,
+        flush_blocks=20,
+    )
+    while follower.poll():
+        pass
+
+    store = EventStore()
+    # One partition per 20 confirmed blocks, rather than one per poll
+    assert [p[:2] for p in store.partitions(SPEC.pool, SPEC.event)] == [
+        (101, 120),
+        (121, 140),
+    ]
+    assert manifest.get(SPEC.contract, SPEC.event) == 140
+    assert follower.pending()[SPEC]["blockNumber"].tolist() == list(range(141, 150))
+
+    follower.flush()
+    assert store.partitions(SPEC.pool, SPEC.event)[-1][:2] == (141, 148)
+    assert (
+        SyncManifest(str(in_tmp_dir / "manifest.json")).get(SPEC.contract, SPEC.event)
+        == 148
+    )
+    assert store.read(SPEC.pool, SPEC.event)["blockNumber"].tolist() == list(
+        range(101, 149)
+    )
+    assert follower.pending()[SPEC]["blockNumber"].tolist() == [149]
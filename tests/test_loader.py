@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tokemak_quant_project.loader import find_spec, load_events
+
+SPEC = find_spec("curve_steth_pool", "AddLiquidity")
+
+BLOCK_DATES = {
+    18000000: "2023-09-04 23:59:59",
+    18000001: "2023-09-05 00:00:00",
+    18000002: "2023-09-05 12:00:00",
+    18000003: "2023-09-05 23:59:59",
+    18000004: "2023-09-06 00:00:00",
+}
+
+
+def write_events(dated=True):
+    """
+    Writes one AddLiquidity event per block of BLOCK_DATES to the file of the event, like a
+    consolidated file.
+    """
+    n = len(BLOCK_DATES)
+    df = pd.DataFrame({column: ["0"] * n for column in SPEC.columns})
+    df["provider"] = "0x" + "11" * 20
+    df["address"] = "0x" + "22" * 20
+    df["event"] = SPEC.event
+    df["token_amounts_a"] = [str((i + 1) * 10**18) for i in range(n)]
+    df["transactionHash"] = [f"0x{i:064x}" for i in range(n)]
+    df["blockHash"] = [f"0x{i:064x}" for i in range(n)]
+    df["blockNumber"] = list(BLOCK_DATES)
+    if dated:
+        df["block_date"] = list(BLOCK_DATES.values())
+    df.to_csv(SPEC.filename, index=False)
+    return df
+
+
+@pytest.fixture(autouse=True)
+def data_dir(in_tmp_dir):
+    (in_tmp_dir / "data" / "curve").mkdir()
+
+
+def test_single_day_range_holds_the_whole_day():
+    write_events()
+    df = load_events("curve_steth_pool", "AddLiquidity", dates=("2023-09-05",) * 2)
+    assert df["blockNumber"].tolist() == [18000001, 18000002, 18000003]
+    assert (df["date"] == pd.Timestamp("2023-09-05")).all()
+
+
+def test_datetime_range_is_inclusive():
+    write_events()
+    df = load_events(
+        "curve_steth_pool",
+        "AddLiquidity",
+        dates=("2023-09-05 12:00:00", "2023-09-06 00:00:00"),
+    )
+    assert df["blockNumber"].tolist() == [18000002, 18000003, 18000004]
+
+
+def test_block_range_is_inclusive():
+    write_events()
+    df = load_events(
+        "curve_steth_pool",
+        "AddLiquidity",
+        columns=["blockNumber", "token_amounts_a"],
+        blocks=(18000001, 18000003),
+    )
+    assert list(df.columns) == ["blockNumber", "token_amounts_a"]
+    assert df["blockNumber"].tolist() == [18000001, 18000002, 18000003]
+    np.testing.assert_allclose(df["token_amounts_a"], [2.0, 3.0, 4.0])
+
+
+def test_cache_follows_the_file():
+    df = write_events()
+    assert len(load_events("curve_steth_pool", "AddLiquidity")) == len(df)
+    df.iloc[:2].to_csv(SPEC.filename, index=False)
+    assert len(load_events("curve_steth_pool", "AddLiquidity")) == 2
+
+
+def test_dates_of_an_undated_file_need_anchors():
+    write_events(dated=False)
+    with pytest.raises(ValueError, match="consolidate the events again"):
+        load_events("curve_steth_pool", "AddLiquidity", dates=("2023-09-05",) * 2)
@@ -0,0 +1,130 @@
+import logging
+
+import pandas as pd
+import pytest
+
+from tokemak_quant_project.lp_ledger import ZERO_ADDRESS, CurveLPLedger
+
+A = "0x" + "aa" * 20
+B = "0x" + "bb" * 20
+
+# A mints 10 LP tokens for 10 ETH at a virtual price of 1, sends 4 to B, B mints 10 more for 11 ETH
+# at 1.1, A burns its last 6 for 6.6 ETH and B burns 1 for 1.2 ETH at 1.2
+TRANSFERS = [
+    # (from, to, value, block, transaction)
+    (ZERO_ADDRESS, A, 10.0, 10, "0x01"),
+    (A, B, 4.0, 20, "0x02"),
+    (ZERO_ADDRESS, B, 10.0, 30, "0x03"),
+    (A, ZERO_ADDRESS, 6.0, 40, "0x04"),
+    (B, ZERO_ADDRESS, 1.0, 50, "0x05"),
+]
+
+
+def transfers(rows=TRANSFERS):
+    return pd.DataFrame(
+        [
+            {
+                "from": sender,
+                "to": receiver,
+                "vaue": value,
+                "blockNumber": block,
+                "logIndex": 0,
+                "transactionHash": transaction,
+            }
+            for sender, receiver, value, block, transaction in rows
+        ]
+    )
+
+
+def pool_events(rows, invariant=True):
+    # (ETH amount, invariant, token_supply, block, transaction), logged after the transfer
+    columns = ["token_amounts_a", "invariant", "token_supply", "blockNumber"]
+    df = pd.DataFrame([row[:4] for row in rows], columns=columns, dtype=float).astype(
+        {"blockNumber": "int64"}
+    )
+    df["token_amounts_b"] = 0.0
+    df["logIndex"] = 1
+    df["transactionHash"] = [row[4] for row in rows]
+    return df if invariant else df.drop(columns="invariant")
+
+
+def ledger(transfer_rows=TRANSFERS, opening=None):
+    return CurveLPLedger(
+        transfers(transfer_rows),
+        pool_events([(10.0, 10.0, 10.0, 10, "0x01"), (11.0, 22.0, 20.0, 30, "0x03")]),
+        pool_events([(6.6, None, 14.0, 40, "0x04")], invariant=False),
+        pd.DataFrame(
+            columns=["coin_amount", "blockNumber", "logIndex", "transactionHash"]
+        ),
+        pool_events([(1.2, 15.6, 13.0, 50, "0x05")]),
+        opening=opening,
+    )
+
+
+def test_balances_at():
+    lp = ledger()
+    assert lp.balances_at(5).empty
+    assert lp.balances_at(25).to_dict() == {A: 6.0, B: 4.0}
+    # Empty balances are left out
+    assert lp.balances_at(45).to_dict() == {B: 14.0}
+    assert lp.balances_at(60).to_dict() == {B: 13.0}
+
+
+def test_pool_fees():
+    # 10 tokens held while the virtual price goes from 1 to 1.1, 14 from 1.1 to 1.2
+    assert ledger().pool_fees(60) == pytest.approx(2.4)
+    assert ledger().pool_fees(45) == pytest.approx(1.0)
+
+
+def test_returns():
+    returns = ledger().returns(end_block=60)
+    assert returns.index.tolist() == [B, A]
+    a, b = returns.loc[A], returns.loc[B]
+
+    # A paid 10 ETH, got 4 for the transfer at 1 and 6.6 for the burn
+    assert a["balance"] == 0.0
+    assert a["cost_basis"] == pytest.approx(10.0)
+    assert a["proceeds"] == pytest.approx(10.6)
+    assert a["pnl"] == pytest.approx(0.6)
+    assert a["total_return"] == pytest.approx(0.06)
+    # 6 tokens held from 1 to 1.1
+    assert a["fees_earned"] == pytest.approx(0.6)
+    assert a["fee_share"] == pytest.approx(0.25)
+
+    # B paid 4 + 11 ETH, got 1.2 ETH, and holds 13 tokens worth 1.2
+    assert b["balance"] == pytest.approx(13.0)
+    assert b["value"] == pytest.approx(15.6)
+    assert b["cost_basis"] == pytest.approx(15.0)
+    assert b["proceeds"] == pytest.approx(1.2)
+    assert b["pnl"] == pytest.approx(1.8)
+    assert b["total_return"] == pytest.approx(0.12)
+    # 4 tokens held from 1 to 1.1, 14 from 1.1 to 1.2
+    assert b["fees_earned"] == pytest.approx(1.8)
+    assert b["fee_share"] == pytest.approx(0.75)
+    assert returns["transfers"].tolist() == [3, 3]
+
+
+def test_partial_history_warns(caplog):
+    # The first mint is before the stored transfers
+    with caplog.at_level(logging.WARNING):
+        lp = ledger(TRANSFERS[1:])
+    assert "1 holders have a negative LP balance" in caplog.text
+    assert lp.balances_at(45).to_dict() == {B: 14.0}
+    assert lp.balances.min() == pytest.approx(-10.0)
+
+
+def test_opening_balances(caplog):
+    with caplog.at_level(logging.WARNING):
+        lp = ledger(TRANSFERS[1:], opening=pd.Series({A: 10.0}))
+    assert "negative" not in caplog.text
+    assert lp.balances_at(19).to_dict() == {A: 10.0}
+    assert lp.balances_at(25).to_dict() == {A: 6.0, B: 4.0}
+
+    returns = lp.returns(end_block=60)
+    # Bought at the virtual price of block 19, like the mint
+    assert returns.loc[A, "cost_basis"] == pytest.approx(10.0)
+    assert returns.loc[A, "pnl"] == pytest.approx(0.6)
+    assert returns.loc[A, "transfers"] == 2
+    assert returns["fees_earned"].sum() == pytest.approx(2.4)
+    assert lp.pool_fees(60) == pytest.approx(2.4)
+    assert returns["fee_share"].sum() == pytest.approx(1.0)
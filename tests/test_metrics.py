@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+from tokemak_quant_project.metrics import (
+    Histogram,
+    Metrics,
+    construct_metrics_middleware,
+)
+
+
+def test_counters():
+    metrics = Metrics()
+    metrics.increment("retries", job="fetch_curve_window")
+    metrics.increment("retries", 2, job="fetch_curve_window")
+    metrics.increment("retries", job="get_block_date")
+    assert metrics.counter("retries", job="fetch_curve_window") == 3
+    assert metrics.counter("retries") == 4
+    assert metrics.counter("rows_written") == 0
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=[0.1, 1.0])
+    # A value on a bound counts in its bucket, like the le label
+    for value in (0.05, 0.1, 0.5, 1.0, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 1]
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(4.65)
+    assert histogram.quantile(0.4) == 0.1
+    assert histogram.quantile(0.8) == 1.0
+    assert histogram.quantile(0.99) == float("inf")
+    assert Histogram(buckets=[1.0]).quantile(0.5) is None
+
+
+def test_collect_and_merge():
+    worker, parent = Metrics(), Metrics()
+    worker.increment("logs_decoded", 5)
+    worker.record_stage("decode", 0.5, items=5)
+    parent.increment("logs_decoded", 1)
+    parent.record_stage("decode", 0.5, items=1)
+
+    parent.merge(worker.collect())
+    assert parent.counter("logs_decoded") == 6
+    assert parent.stages["decode"] == {"seconds": 1.0, "calls": 2, "items": 6}
+    # Collecting resets the worker
+    assert worker.counter("logs_decoded") == 0
+    assert worker.collect() == ({}, {})
+
+
+def test_prometheus_text():
+    metrics = Metrics(latency_buckets=[0.1, 1.0])
+    metrics.increment("rpc_calls", 2, method="eth_getLogs")
+    metrics.increment("rows_written", 10)
+    metrics.set("blocks_total", 100)
+    metrics.observe("rpc_latency_seconds", 0.05, method="eth_getLogs")
+    metrics.observe("rpc_latency_seconds", 0.5, method="eth_getLogs")
+    metrics.record_stage("decode", 2.0, items=8)
+    assert metrics.to_prometheus() == (
+        "tokemak_rows_written_total 10\n"
+        'tokemak_rpc_calls_total{method="eth_getLogs"} 2\n'
+        "tokemak_blocks_total 100\n"
+        'tokemak_rpc_latency_seconds_bucket{method="eth_getLogs",le="0.1"} 1\n'
+        'tokemak_rpc_latency_seconds_bucket{method="eth_getLogs",le="1.0"} 2\n'
+        'tokemak_rpc_latency_seconds_bucket{method="eth_getLogs",le="+Inf"} 2\n'
+        'tokemak_rpc_latency_seconds_sum{method="eth_getLogs"} 0.55\n'
+        'tokemak_rpc_latency_seconds_count{method="eth_getLogs"} 2\n'
+        'tokemak_stage_seconds_total{stage="decode"} 2.0\n'
+        'tokemak_stage_items_total{stage="decode"} 8\n'
+    )
+
+
+def test_save(tmp_path):
+    metrics = Metrics()
+    metrics.increment("rpc_calls", method="eth_chainId")
+    metrics.record_stage("write", 0.5, items=10)
+    path, prometheus_path = tmp_path / "metrics.json", tmp_path / "metrics.prom"
+    metrics.save(path, prometheus_path)
+
+    with open(path) as metrics_file:
+        summary = json.load(metrics_file)
+    assert summary["counters"] == [
+        {"name": "rpc_calls", "labels": {"method": "eth_chainId"}, "value": 1}
+    ]
+    assert summary["stages"]["write"]["items_per_second"] == 20.0
+    assert prometheus_path.read_text() == metrics.to_prometheus()
+
+
+def test_middleware():
+    metrics = Metrics()
+    middleware = construct_metrics_middleware(metrics)
+
+    def make_request(method, params):
+        if method == "eth_getLogs":
+            return {"error": {"code": -32005, "message": "too many"}}
+        if method == "eth_call":
+            raise ConnectionError
+        return {"result": "0x1"}
+
+    request = middleware(make_request, None)
+    request("eth_chainId", [])
+    request("eth_getLogs", [{}])
+    with pytest.raises(ConnectionError):
+        request("eth_call", [])
+    assert metrics.counter("rpc_calls") == 3
+    assert metrics.counter("rpc_errors", method="eth_getLogs") == 1
+    assert metrics.counter("rpc_errors", method="eth_call") == 1
+    assert metrics.counter("rpc_errors", method="eth_chainId") == 0
+    assert sum(histogram.count for histogram in metrics.histograms.values()) == 3
@@ -0,0 +1,127 @@
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+from tests.mock_rpc import random_logs
+from tokemak_quant_project.events import project_events
+from tokemak_quant_project.fetch_pool_data import (
+    construct_store_pipeline,
+    fetch_and_store_events,
+)
+from tokemak_quant_project.metrics import METRICS
+from tokemak_quant_project.pipeline import ProcessPipeline, StreamingPipeline
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPECS = project_events("curve")
+START = 18000000
+# (start_block, end_block, batch_n) of the fetched windows, newest first
+WINDOWS = [(START + 20, START + 39, 0), (START, START + 19, 1)]
+
+
+def test_streaming_pipeline_is_bounded():
+    release = threading.Event()
+    done = []
+
+    def wait(item):
+        release.wait()
+        return item
+
+    pipeline = StreamingPipeline([("wait", wait), ("done", done.append)], queue_size=1)
+    # The first item is held by the stage, the second one waits in the queue
+    pipeline.put(("task", 0), 0)
+    pipeline.put(("task", 1), 1)
+    producer = threading.Thread(target=pipeline.put, args=(("task", 2), 2))
+    producer.start()
+    producer.join(timeout=0.2)
+    assert producer.is_alive()
+    assert pipeline.queues[0].qsize() == 1
+
+    release.set()
+    producer.join()
+    assert pipeline.close() == []
+    assert done == [0, 1, 2]
+    assert not any(thread.is_alive() for thread in pipeline.threads)
+
+
+def test_streaming_pipeline_reports_the_failed_tasks():
+    written = []
+
+    def decode(item):
+        if item < 0:
+            raise ValueError("negative")
+        return item * 2
+
+    with StreamingPipeline([("decode", decode), ("write", written.append)]) as pipeline:
+        for item in (1, -1, 2):
+            pipeline.put(("window", item), item)
+        # The failed item never reaches the next stage
+        assert pipeline.drain() == [("window", -1)]
+        assert written == [2, 4]
+
+        pipeline.put(("window", -2), -2)
+        assert pipeline.close() == [("window", -2)]
+
+
+@pytest.fixture
+def node(in_tmp_dir, mock_node):
+    os.makedirs("data/curve")
+    logs = []
+    for seed, spec in enumerate(SPECS):
+        logs += random_logs(spec, range(START, START + 40, 3), seed=seed)
+    logs.sort(key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+    w3, _ = mock_node({"logs": logs, "timestamps": {}, "head": START + 39})
+    return w3
+
+
+def store(w3, pipeline=None):
+    """
+    Stores WINDOWS through the pipeline, and collects the CSV fragments it wrote.
+
+    :return: The fragments by path, and the tasks that failed.
+    """
+    for start_block, end_block, batch_n in WINDOWS:
+        fetch_and_store_events(w3, SPECS, start_block, end_block, batch_n, pipeline)
+    failed = [] if pipeline is None else pipeline.close()
+    fragments = {}
+    for spec in SPECS:
+        for _, _, batch_n in WINDOWS:
+            path = f"{spec.filename}_{batch_n}"
+            fragments[path] = pd.read_csv(path, dtype=str)
+            os.remove(path)
+    return fragments, failed
+
+
+def assert_same_fragments(fragments, expected):
+    assert fragments.keys() == expected.keys()
+    for path, df in expected.items():
+        pd.testing.assert_frame_equal(fragments[path], df)
+
+
+def test_store_pipeline_in_threads(node):
+    expected, _ = store(node)
+    assert sum(len(df) for df in expected.values()) == 14 * len(SPECS)
+
+    pipeline = construct_store_pipeline(workers=1)
+    assert isinstance(pipeline, StreamingPipeline)
+    fragments, failed = store(node, pipeline)
+    assert failed == []
+    assert_same_fragments(fragments, expected)
+
+
+def test_store_pipeline_in_processes(node):
+    # The spawned workers load the registry, whose ABI paths are relative to the project root
+    os.symlink(os.path.join(ROOT_DIR, "abis"), "abis")
+    expected, _ = store(node)
+    rows_written = METRICS.counter("rows_written")
+
+    pipeline = construct_store_pipeline(workers=2)
+    assert isinstance(pipeline, ProcessPipeline)
+    # Logs which cannot be decoded fail their window only
+    pipeline.put(("broken", START, START + 39, 2), (SPECS[:1], [None], START, START, 2))
+    fragments, failed = store(node, pipeline)
+    assert failed == [("broken", START, START + 39, 2)]
+    assert_same_fragments(fragments, expected)
+    # The rows written by the workers are merged into the metrics of this process
+    assert METRICS.counter("rows_written") - rows_written == 14 * len(SPECS)
@@ -0,0 +1,125 @@
+import os
+
+import pandas as pd
+
+from tokemak_quant_project.pool_state import (
+    CURVE_INTEGER_COLUMNS,
+    CurvePoolReplay,
+    CurvePoolState,
+)
+
+
+def pool_events(n_blocks):
+    """
+    A deposit of 10 ETH and 10 stETH per block, every third block also swapping 1 ETH for stETH.
+    """
+    rows = []
+    for block in range(100, 100 + n_blocks):
+        rows.append(
+            {
+                "event": "AddLiquidity",
+                "logIndex": 0,
+                "token_amounts_a": 10,
+                "token_amounts_b": 10,
+                "token_supply": 20 * (block - 99),
+            }
+        )
+        if block % 3 == 0:
+            rows.append(
+                {
+                    "event": "TokenExchange",
+                    "logIndex": 1,
+                    "sold_id": 0,
+                    "tokens_sold": 1,
+                    "bought_id": 1,
+                    "tokens_bought": 1,
+                }
+            )
+        for row in rows[-2:]:
+            row.setdefault("blockNumber", block)
+    events = pd.DataFrame(rows)
+    events["transactionHash"] = [f"0x{i:064x}" for i in range(len(events))]
+    for column in CURVE_INTEGER_COLUMNS:
+        values = events[column] if column in events else [None] * len(events)
+        # Python ints like load_curve_events
+        events[column] = pd.Series(
+            [None if pd.isna(value) else int(value) for value in values], dtype=object
+        )
+    return events
+
+
+class CountingLoader:
+    def __init__(self, events):
+        self.events = events
+        self.calls = []
+
+    def __call__(self, start_block, end_block):
+        self.calls.append((start_block, end_block))
+        blocks = self.events["blockNumber"]
+        mask = blocks >= (start_block or 0)
+        if end_block is not None:
+            mask &= blocks <= end_block
+        return self.events[mask].reset_index(drop=True)
+
+
+def replay_all(events, block_number):
+    state = CurvePoolState()
+    for event in events[events["blockNumber"] <= block_number].itertuples(index=False):
+        state.apply(event)
+    return state
+
+
+def test_state_at_reads_the_events_once(tmp_path):
+    events = pool_events(100)
+    loader = CountingLoader(events)
+    replay = CurvePoolReplay(
+        str(tmp_path / "snapshots.json"), interval=10, loader=loader
+    )
+    replay.update()
+    for block in (99, 100, 105, 131, 150, 198, 199, 250):
+        assert replay.state_at(block).to_dict() == replay_all(events, block).to_dict()
+    assert len(loader.calls) == 1
+
+
+def test_state_at_after_reopening(tmp_path):
+    events = pool_events(100)
+    CurvePoolReplay(
+        str(tmp_path / "snapshots.json"), interval=10, loader=CountingLoader(events)
+    ).update()
+
+    loader = CountingLoader(events)
+    replay = CurvePoolReplay(
+        str(tmp_path / "snapshots.json"), interval=10, loader=loader
+    )
+    for block in (105, 150, 170):
+        assert replay.state_at(block).to_dict() == replay_all(events, block).to_dict()
+    assert loader.calls == [(None, 199)]
+
+
+def test_update_appends_the_new_events(tmp_path):
+    events = pool_events(100)
+    loader = CountingLoader(events[events["blockNumber"] < 150])
+    replay = CurvePoolReplay(
+        str(tmp_path / "snapshots.json"), interval=10, loader=loader
+    )
+    replay.update()
+    loader.events = events
+    assert replay.update().to_dict() == replay_all(events, 199).to_dict()
+    assert len(replay.events) == len(events)
+    for block in (120, 149, 150, 180):
+        assert replay.state_at(block).to_dict() == replay_all(events, block).to_dict()
+    assert len(loader.calls) == 2
+
+
+def test_state_at_before_update(tmp_path):
+    events = pool_events(100)
+    loader = CountingLoader(events)
+    replay = CurvePoolReplay(
+        str(tmp_path / "snapshots.json"), interval=10, loader=loader
+    )
+    # Replayed on the first call instead of returning the empty initial state
+    for block in (150, 199, 120):
+        assert replay.state_at(block).to_dict() == replay_all(events, block).to_dict()
+    assert replay.head.to_dict() == replay_all(events, 199).to_dict()
+    assert os.path.exists(tmp_path / "snapshots.json")
+    assert len(loader.calls) == 1
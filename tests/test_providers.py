@@ -0,0 +1,144 @@
+import time
+
+import pytest
+import requests
+from web3 import Web3
+
+from config import ENDPOINT_COOLDOWN
+from tests.mock_rpc import MockRPCServer, random_logs
+from tokemak_quant_project.events import REGISTRY
+from tokemak_quant_project.fetch_pool_data import PoolDataFetcher
+from tokemak_quant_project.providers import (
+    Endpoint,
+    EndpointError,
+    MultiEndpointProvider,
+    is_rpc_error_response,
+)
+
+SPEC = next(spec for spec in REGISTRY if spec.event == "TokenExchange")
+HEAD = 18000000
+
+
+@pytest.fixture
+def nodes():
+    """
+    Starts mock nodes without logs: nodes(**kwargs) returns a started MockRPCServer.
+    """
+    servers = []
+
+    def start(**kwargs):
+        server = MockRPCServer(
+            {"logs": [], "timestamps": {}, "head": HEAD}, **kwargs
+        ).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def block_number_calls(server):
+    return server.node.calls["eth_blockNumber"]
+
+
+def http_response(status_code, content):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    return response
+
+
+@pytest.mark.parametrize(
+    "status_code, content, expected",
+    [
+        (400, b'{"jsonrpc": "2.0", "id": 1, "error": {"code": -32602}}', True),
+        (400, b'[{"id": 0, "result": "0x1"}, {"id": 1, "error": {}}]', True),
+        (400, b"Bad Request", False),
+        (404, b'{"message": "not found"}', False),
+        (200, b'{"jsonrpc": "2.0", "id": 1, "error": {"code": -32602}}', False),
+    ],
+)
+def test_is_rpc_error_response(status_code, content, expected):
+    assert is_rpc_error_response(http_response(status_code, content)) == expected
+
+
+def test_http_400_range_errors_are_bisected():
+    logs = random_logs(SPEC, range(18000000, 18000040))
+    fixture = {"logs": logs, "timestamps": {}, "head": 18000100}
+    with MockRPCServer(fixture, max_logs=5, error_status=400) as server:
+        w3 = Web3(MultiEndpointProvider([Endpoint(server.url)]))
+        fetcher = PoolDataFetcher(w3, SPEC.contract, SPEC.abi)
+        (fetched,) = fetcher.get_raw_logs([SPEC.event], 18000000, 18000039)
+        assert len(fetched) == len(logs)
+        assert server.node.calls["eth_getLogs"] > 1
+        # The endpoint answered, it is not put aside
+        assert w3.provider.endpoints[0].errors == 0
+
+
+@pytest.mark.parametrize("status", [429, 503, 401, 403])
+def test_failover_to_the_next_endpoint(nodes, status):
+    failing, healthy = nodes(http_errors=[status]), nodes()
+    provider = MultiEndpointProvider([Endpoint(failing.url), Endpoint(healthy.url)])
+    w3 = Web3(provider)
+    assert w3.eth.block_number == HEAD
+    first, second = provider.endpoints
+    assert (first.errors, second.errors) == (1, 0)
+    assert 0 < first.cooldown_until - time.monotonic() <= ENDPOINT_COOLDOWN
+    assert block_number_calls(healthy) == 1
+
+    # Skipped until its cooldown ends
+    for _ in range(3):
+        assert w3.eth.block_number == HEAD
+    assert block_number_calls(healthy) == 4
+    assert block_number_calls(failing) == 0
+    first.cooldown_until = time.monotonic()
+    assert w3.eth.block_number == HEAD
+    assert block_number_calls(failing) == 1
+    assert first.failures == 0
+
+
+def test_cooldown_grows_with_consecutive_failures(nodes):
+    failing, healthy = nodes(http_errors=[503, 503]), nodes()
+    provider = MultiEndpointProvider([Endpoint(failing.url), Endpoint(healthy.url)])
+    w3 = Web3(provider)
+    first = provider.endpoints[0]
+    w3.eth.block_number
+    first.cooldown_until = time.monotonic()
+    w3.eth.block_number
+    assert first.failures == 2
+    assert (
+        ENDPOINT_COOLDOWN
+        < first.cooldown_until - time.monotonic()
+        <= 2 * ENDPOINT_COOLDOWN
+    )
+    assert block_number_calls(healthy) == 2
+
+
+def test_retry_after_is_honored(nodes):
+    failing, healthy = nodes(http_errors=[429], retry_after=30), nodes()
+    provider = MultiEndpointProvider([Endpoint(failing.url), Endpoint(healthy.url)])
+    assert Web3(provider).eth.block_number == HEAD
+    assert 29 < provider.endpoints[0].cooldown_until - time.monotonic() <= 30
+
+
+def test_every_endpoint_failing_raises(nodes):
+    failing = nodes(http_errors=[503, 401], retry_after=0)
+    provider = MultiEndpointProvider([Endpoint(failing.url)], retries=1)
+    with pytest.raises(EndpointError, match="HTTP 401"):
+        Web3(provider).eth.block_number
+    assert provider.endpoints[0].errors == 2
+
+
+def test_endpoints_are_chosen_by_latency_and_weight(nodes):
+    slow, fast = Endpoint(nodes(latency=0.05).url), Endpoint(nodes().url)
+    w3 = Web3(MultiEndpointProvider([slow, fast]))
+    # Both are tried once, then the fastest one gets the requests
+    for _ in range(6):
+        w3.eth.block_number
+    assert (slow.requests, fast.requests) == (1, 5)
+
+    slow.weight = 10**4
+    for _ in range(3):
+        w3.eth.block_number
+    assert (slow.requests, fast.requests) == (4, 5)
@@ -0,0 +1,64 @@
+import pytest
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+from tokemak_quant_project.rpc import batch_request
+
+
+class BatchProvider(BaseProvider):
+    """
+    Answers eth_getBlockByNumber batches with the block numbers, passing the responses through
+    `tamper` first.
+    """
+
+    def __init__(self, tamper=lambda responses: responses):
+        self.tamper = tamper
+
+    def make_batch_request(self, calls):
+        return self.tamper(
+            [
+                {"jsonrpc": "2.0", "id": i, "result": params[0]}
+                for i, (_, params) in enumerate(calls)
+            ]
+        )
+
+
+def get_blocks(provider, blocks, **kwargs):
+    return batch_request(
+        Web3(provider),
+        "eth_getBlockByNumber",
+        [[hex(block), False] for block in blocks],
+        **kwargs,
+    )
+
+
+def test_responses_are_matched_by_id():
+    provider = BatchProvider(lambda responses: responses[::-1])
+    assert get_blocks(provider, range(10), batch_size=4) == [
+        hex(block) for block in range(10)
+    ]
+
+
+def test_missing_responses_raise():
+    provider = BatchProvider(lambda responses: responses[:2] + responses[3:])
+    with pytest.raises(
+        ValueError, match=r"got 3 responses, none for the params \[\['0x2'"
+    ):
+        get_blocks(provider, range(4))
+
+
+def test_duplicated_responses_raise():
+    provider = BatchProvider(lambda responses: responses + responses[:1])
+    with pytest.raises(ValueError, match="batch of 4 calls got 5 responses"):
+        get_blocks(provider, range(4))
+
+
+def test_failed_calls():
+    def fail_second(responses):
+        responses[1] = {"jsonrpc": "2.0", "id": 1, "error": {"message": "boom"}}
+        return responses
+
+    provider = BatchProvider(fail_second)
+    assert get_blocks(provider, range(3), raise_on_error=False) == ["0x0", None, "0x2"]
+    with pytest.raises(ValueError, match="eth_getBlockByNumber failed"):
+        get_blocks(provider, range(3))
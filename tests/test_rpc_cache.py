@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+import os
+
+import pytest
+
+from tokemak_quant_project import rpc_cache
+from tokemak_quant_project.rpc_cache import (
+    RPCResponseCache,
+    install_rpc_cache,
+    last_block,
+)
+
+HEAD = 1000
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rpc_cache.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return RPCResponseCache(root=str(tmp_path / "rpc_cache"), finality_depth=64)
+
+
+class Head:
+    """
+    A head_fn counting its calls.
+    """
+
+    def __init__(self, head=HEAD):
+        self.head = head
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.head
+
+
+@pytest.mark.parametrize(
+    "method, params, expected",
+    [
+        ("eth_getBlockByNumber", ["0x64", False], 100),
+        ("eth_getBlockByNumber", ["latest", False], None),
+        ("eth_getLogs", [{"fromBlock": "0x1", "toBlock": "0x64"}], 100),
+        ("eth_getLogs", [{"fromBlock": "0x1"}], None),
+        ("eth_getLogs", [{"fromBlock": "earliest", "toBlock": "0x64"}], None),
+        ("eth_getLogs", [{"blockHash": "0x" + "11" * 32}], None),
+        ("eth_getStorageAt", ["0x" + "11" * 20, "0x0", "0x64"], 100),
+        ("eth_getBalance", ["0x" + "11" * 20], None),
+        ("eth_chainId", [], None),
+    ],
+)
+def test_last_block(method, params, expected):
+    assert last_block(method, params) == expected
+
+
+def test_finality_depth_gate(cache, clock):
+    head = Head()
+    assert cache.cacheable("eth_getBlockByNumber", [hex(HEAD - 64), False], head)
+    assert not cache.cacheable("eth_getBlockByNumber", [hex(HEAD - 63), False], head)
+    assert not cache.cacheable("eth_getBlockByNumber", ["latest", False], head)
+    # Not cached, whatever the block
+    assert not cache.cacheable("eth_call", [{}, hex(1)], head)
+    assert head.calls == 1
+
+
+def test_head_ttl(cache, clock):
+    head = Head()
+    cache.cacheable("eth_getBlockByNumber", [hex(HEAD - 10), False], head)
+    clock.now += cache.head_ttl - 1
+    cache.cacheable("eth_getBlockByNumber", [hex(HEAD - 10), False], head)
+    assert head.calls == 1
+
+    # Past the TTL the head is requested again, for the blocks the old head cannot tell about
+    clock.now += 2
+    head.head = HEAD + 10
+    assert cache.cacheable("eth_getBlockByNumber", [hex(HEAD - 54), False], head)
+    assert head.calls == 2
+    # Final for the cached head, no request needed
+    clock.now += cache.head_ttl + 1
+    assert cache.cacheable("eth_getBlockByNumber", [hex(HEAD - 54), False], head)
+    assert head.calls == 2
+
+
+def test_key_hashing(cache):
+    params = [{"fromBlock": "0x1", "toBlock": "0x64", "address": "0xab"}]
+    reordered = [{"address": "0xab", "toBlock": "0x64", "fromBlock": "0x1"}]
+    key = cache.key("eth_getLogs", params)
+    assert key == cache.key("eth_getLogs", reordered)
+    assert (
+        key
+        == hashlib.sha256(
+            b'["eth_getLogs",[{"address":"0xab","fromBlock":"0x1","toBlock":"0x64"}]]'
+        ).hexdigest()
+    )
+    assert key != cache.key("eth_getLogs", [{"fromBlock": "0x1", "toBlock": "0x65"}])
+    assert key != cache.key("eth_getBlockByNumber", params)
+    assert cache.path("eth_getLogs", key) == os.path.join(
+        cache.root, "eth_getLogs", key[:2], f"{key}.json.gz"
+    )
+
+
+def test_gzip_round_trip(cache):
+    params = [{"fromBlock": "0x1", "toBlock": "0x64"}]
+    assert cache.get("eth_getLogs", params) is None
+    logs = [{"blockNumber": "0x5", "data": "0x" + "ab" * 64}]
+    cache.put("eth_getLogs", params, {"jsonrpc": "2.0", "id": 7, "result": logs})
+
+    path = cache.path("eth_getLogs", cache.key("eth_getLogs", params))
+    with gzip.open(path, "rt") as response_file:
+        assert json.load(response_file) == {"result": logs}
+    assert cache.get("eth_getLogs", params) == {"result": logs}
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+    # Errors are never stored
+    cache.put("eth_getLogs", [{}], {"error": {"code": -32005, "message": "too many"}})
+    assert cache.get("eth_getLogs", [{}]) is None
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "methods": {"eth_getLogs": {"hits": 1, "misses": 2}},
+    }
+
+
+def test_middleware(cache, mock_node):
+    w3, node = mock_node({"logs": [], "timestamps": {}, "head": HEAD})
+    install_rpc_cache(w3, cache)
+    for _ in range(2):
+        assert w3.eth.get_block(HEAD - 100)["number"] == HEAD - 100
+        assert w3.eth.get_block(HEAD - 1)["number"] == HEAD - 1
+    # Only the final block is answered from the cache, the head is requested once
+    assert node.calls["eth_getBlockByNumber"] == 3
+    assert node.calls["eth_blockNumber"] == 1
+    assert cache.stats()["hits"] == 1
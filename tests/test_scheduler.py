@@ -0,0 +1,166 @@
+import pytest
+
+from tests.mock_rpc import random_logs
+from tokemak_quant_project.events import REGISTRY
+from tokemak_quant_project.fetch_pool_data import PoolDataFetcher, is_log_range_error
+from tokemak_quant_project.scheduler import (
+    AdaptiveWindow,
+    TokenBucket,
+    retry_with_backoff,
+    run_windows,
+)
+
+SPEC = next(spec for spec in REGISTRY if spec.event == "TokenExchange")
+
+# Error returned by Alchemy when a eth_getLogs request matches too many logs
+TOO_MANY_LOGS = "{'code': -32005, 'message': 'query returned more than 10000 results'}"
+
+
+def assert_covers(windows, start_block, end_block):
+    """
+    Checks that windows, newest first, cover [start_block, end_block] without gaps nor overlaps.
+    """
+    assert windows[0][1] == end_block
+    assert windows[-1][0] == start_block
+    for (start, end), (_, previous_end) in zip(windows[:-1], windows[1:]):
+        assert start <= end
+        assert previous_end == start - 1
+
+
+def test_split_covers_the_range():
+    sizer = AdaptiveWindow(initial=100, min_size=10, max_size=1000)
+    windows = list(sizer.split(1000, 1549))
+    assert_covers(windows, 1000, 1549)
+    assert [end - start + 1 for start, end in windows] == [100] * 5 + [50]
+    assert sizer.windows == windows
+
+
+def test_split_single_block():
+    assert list(AdaptiveWindow(initial=100).split(5, 5)) == [(5, 5)]
+    assert list(AdaptiveWindow(initial=100).split(6, 5)) == []
+
+
+def test_split_follows_observed_density():
+    sizer = AdaptiveWindow(initial=100, min_size=10, max_size=1000, target_logs=50)
+    windows = []
+    for start, end in sizer.split(0, 9999):
+        windows.append((start, end))
+        # 1 log per block: the windows shrink to target_logs blocks right away
+        sizer.observe(end - start + 1, end - start + 1)
+    assert_covers(windows, 0, 9999)
+    assert {end - start + 1 for start, end in windows[1:-1]} == {50}
+
+
+def test_observe_grows_progressively_and_stays_in_bounds():
+    sizer = AdaptiveWindow(initial=100, min_size=10, max_size=1000, target_logs=50)
+    sizer.observe(100, 0)
+    assert sizer.size == 200
+    for _ in range(10):
+        sizer.observe(sizer.size, 0)
+    assert sizer.size == 1000
+    sizer.observe(1000, 100000)
+    assert sizer.size == 10
+
+
+def test_retry_with_backoff():
+    calls = []
+
+    def flaky(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise ValueError("timeout")
+        return value
+
+    assert retry_with_backoff(flaky, 7, retries=2, backoff=0) == 7
+    assert calls == [7, 7, 7]
+
+    calls.clear()
+    with pytest.raises(ValueError, match="timeout"):
+        retry_with_backoff(flaky, 7, retries=1, backoff=0)
+    assert calls == [7, 7]
+
+
+def test_run_windows_reports_the_failed_tasks():
+    fetched = []
+
+    def fetch(start_block, end_block, batch_n):
+        if batch_n == 1:
+            raise ValueError("rejected")
+        fetched.append((start_block, end_block, batch_n))
+        return 0
+
+    windows = [(20, 29), (10, 19), (0, 9)]
+    failed = run_windows([fetch], windows, max_workers=2, retries=0)
+    assert failed == [("fetch", 10, 19, 1)]
+    assert sorted(fetched) == [(0, 9, 2), (20, 29, 0)]
+
+
+def test_run_windows_sizes_the_next_windows():
+    sizer = AdaptiveWindow(initial=10, min_size=10, max_size=1000, target_logs=50)
+    # 5 logs per window, whatever its size: the windows double
+    run_windows(
+        [lambda start_block, end_block, batch_n: 5],
+        sizer.split(0, 309),
+        max_workers=1,
+        sizer=sizer,
+    )
+    assert [end - start + 1 for start, end in sizer.windows] == [10, 20, 40, 80, 160]
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    bucket.acquire(10)
+    assert bucket.tokens < 1
+    # More than the capacity waits for a full bucket only
+    bucket.acquire(50)
+    assert bucket.tokens < 1
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    [
+        (TOO_MANY_LOGS, True),
+        ("Log response size exceeded. You can make eth_getLogs requests", True),
+        ("execution reverted", False),
+    ],
+)
+def test_is_log_range_error(message, expected):
+    assert is_log_range_error(ValueError(message)) == expected
+
+
+def test_rejected_ranges_are_bisected(mock_node):
+    logs = random_logs(SPEC, range(18000000, 18000040))
+    w3, node = mock_node({"logs": logs, "timestamps": {}, "head": 18000100}, max_logs=5)
+    fetcher = PoolDataFetcher(w3, SPEC.contract, SPEC.abi)
+
+    (fetched,) = fetcher.get_raw_logs([SPEC.event], 18000000, 18000039)
+    assert [log["transactionHash"] for log in fetched] == [
+        log["transactionHash"] for log in logs
+    ]
+    assert node.calls["eth_getLogs"] > 1
+
+
+def test_rejected_single_block_raises(mock_node):
+    # More logs in a single block than the node returns, it cannot be split any further
+    logs = random_logs(SPEC, [18000000] * 10)
+    for i, log in enumerate(logs):
+        log["logIndex"] = hex(i)
+    w3, node = mock_node({"logs": logs, "timestamps": {}, "head": 18000100}, max_logs=5)
+    fetcher = PoolDataFetcher(w3, SPEC.contract, SPEC.abi)
+    with pytest.raises(ValueError, match="query returned more than"):
+        fetcher.get_raw_logs([SPEC.event], 18000000, 18000000)
+
+
+def test_other_errors_are_not_bisected(mock_node, monkeypatch):
+    w3, _ = mock_node({"logs": [], "timestamps": {}, "head": 18000100})
+    fetcher = PoolDataFetcher(w3, SPEC.contract, SPEC.abi)
+    calls = []
+
+    def fetch_raw_logs(event_names, start_block, end_block):
+        calls.append((start_block, end_block))
+        raise ValueError("execution reverted")
+
+    monkeypatch.setattr(fetcher, "fetch_raw_logs", fetch_raw_logs)
+    with pytest.raises(ValueError, match="execution reverted"):
+        fetcher.get_raw_logs([SPEC.event], 18000000, 18000039)
+    assert calls == [(18000000, 18000039)]
@@ -0,0 +1,95 @@
+import pytest
+from eth_abi import encode_abi
+
+from config import FINALITY_DEPTH
+from tokemak_quant_project.state_sampler import (
+    EthCallCache,
+    StateSampler,
+    curve_pool_calls,
+    sample_blocks,
+)
+
+CALLS = curve_pool_calls()
+HEAD = 18001000
+FINAL_BLOCK = HEAD - FINALITY_DEPTH
+BLOCKS = sample_blocks(HEAD - 100, HEAD, 10) + [FINAL_BLOCK, FINAL_BLOCK + 1]
+# Before the LP token was deployed
+LP_DEPLOYMENT = HEAD - 90
+
+
+def result(value):
+    return "0x" + encode_abi(["uint256"], [value]).hex()
+
+
+def expected(call, block):
+    if call.name == "lp_supply" and block < LP_DEPLOYMENT:
+        return None
+    return 10**30 * (CALLS.index(call) + 1) + block
+
+
+@pytest.fixture
+def archive_node(mock_node):
+    calls = {}
+    for call in CALLS:
+        calls.setdefault(call.address, {})[call.data] = {
+            block: result(expected(call, block))
+            for block in range(HEAD - 100, HEAD + 1)
+            if expected(call, block) is not None
+        }
+    return mock_node({"logs": [], "timestamps": {}, "head": HEAD, "calls": calls})
+
+
+@pytest.mark.parametrize(
+    "start_block, end_block, cadence, expected",
+    [
+        (100, 130, 10, [100, 110, 120, 130]),
+        (100, 125, 10, [100, 110, 120, 125]),
+        (100, 100, 10, [100]),
+        (101, 100, 10, []),
+    ],
+)
+def test_sample_blocks(start_block, end_block, cadence, expected):
+    assert sample_blocks(start_block, end_block, cadence) == expected
+
+
+def test_eth_call_cache(tmp_path):
+    cache = EthCallCache(str(tmp_path / "eth_calls.sqlite"))
+    address = "0x" + "Ab" * 20
+    cache.put([(address, "0x1234", block, hex(block)) for block in range(1000)])
+    assert cache.get(address.upper().replace("0X", "0x"), "0x1234", [5, 999, 1000]) == {
+        5: "0x5",
+        999: "0x3e7",
+    }
+    assert cache.get(address, "0x5678", [5]) == {}
+
+
+def test_sample(archive_node, tmp_path):
+    w3, node = archive_node
+    cache = EthCallCache(str(tmp_path / "eth_calls.sqlite"))
+    frame = StateSampler(w3, CALLS, cache=cache, batch_size=10).sample(BLOCKS[::-1])
+    assert frame.index.tolist() == sorted(BLOCKS)
+    assert list(frame.columns) == [call.name for call in CALLS]
+    for call in CALLS:
+        assert frame[call.name].tolist() == [
+            expected(call, block) for block in sorted(BLOCKS)
+        ]
+    # The reverted calls are None, the other calls of their batch are answered
+    assert frame["lp_supply"].isna().sum() == 1
+
+    calls = len(BLOCKS) * len(CALLS)
+    batches = [len(methods) for methods in node.http_requests if "eth_call" in methods]
+    assert batches == [10] * (calls // 10) + [calls % 10]
+    assert node.calls["eth_call"] == calls
+
+    # Only the results of the final blocks are cached, not the reverted call
+    for call in CALLS:
+        assert sorted(cache.get(call.address, call.data, BLOCKS)) == [
+            block
+            for block in sorted(BLOCKS)
+            if block <= FINAL_BLOCK and expected(call, block) is not None
+        ]
+
+    again = StateSampler(w3, CALLS, cache=cache, batch_size=10).sample(BLOCKS)
+    assert again.equals(frame)
+    recent = [block for block in BLOCKS if block > FINAL_BLOCK]
+    assert node.calls["eth_call"] == calls + len(recent) * len(CALLS) + 1
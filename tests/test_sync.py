@@ -0,0 +1,205 @@
+import json
+import os
+from datetime import datetime
+from functools import partial
+
+import pandas as pd
+import pytest
+
+from tokemak_quant_project import sync
+from tests.mock_rpc import random_logs
+from tokemak_quant_project.block_index import BlockTimeIndex
+from tokemak_quant_project.decoder import decode_logs
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.events import REGISTRY
+from tokemak_quant_project.scheduler import AdaptiveWindow, run_windows
+from tokemak_quant_project.sync import (
+    SyncManifest,
+    append_frame,
+    append_windows,
+    commit_store_windows,
+    sync_project,
+)
+
+SPEC = next(spec for spec in REGISTRY if spec.event == "TokenExchange")
+CONTRACT = SPEC.contract
+FILENAME = SPEC.filename
+TARGETS = [SPEC]
+START = 18000000
+TIMESTAMPS = {START + i: 1693872000 + 12 * i for i in range(200)}
+
+
+def block_date(block):
+    return datetime.fromtimestamp(TIMESTAMPS[block]).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@pytest.fixture
+def node(in_tmp_dir, mock_node):
+    os.makedirs(os.path.dirname(FILENAME))
+    w3, _ = mock_node({"logs": [], "timestamps": TIMESTAMPS, "head": START + 199})
+    return w3
+
+
+def rows(blocks, seed=0):
+    """
+    Stored rows of a swap per block, in the layout of the fragments.
+    """
+    return pd.DataFrame(
+        {
+            "buyer": [f"0x{seed:02x}{block:038x}" for block in blocks],
+            "tokens_sold": [str(10**20 * (seed + 1) + block) for block in blocks],
+            "logIndex": [str(i % 7) for i, _ in enumerate(blocks)],
+            "transactionHash": [f"0x{seed:02x}{block:062x}" for block in blocks],
+            "blockNumber": [str(block) for block in blocks],
+        }
+    )
+
+
+def write_fragment(batch_n, blocks, seed=0):
+    df = rows(blocks, seed)
+    df.to_csv(f"{FILENAME}_{batch_n}", index=False)
+    return df
+
+
+def test_manifest_round_trip(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = SyncManifest(path)
+    assert manifest.get(CONTRACT, "TokenExchange") is None
+    manifest.set(CONTRACT.upper(), "TokenExchange", 100)
+    manifest.save()
+
+    reopened = SyncManifest(path)
+    assert reopened.get(CONTRACT.lower(), "TokenExchange") == 100
+    assert reopened.get(CONTRACT, "AddLiquidity") is None
+    assert os.listdir(tmp_path) == ["manifest.json"]
+    with open(path) as manifest_file:
+        assert json.load(manifest_file) == {f"{CONTRACT.lower()}:TokenExchange": 100}
+
+
+def test_append_windows(node):
+    manifest = SyncManifest()
+    manifest.set(CONTRACT, "TokenExchange", START + 4)
+    # The first window overlaps the checkpoint, the last one has no fragment
+    first = write_fragment(0, range(START, START + 10))
+    second = write_fragment(1, range(START + 10, START + 20), seed=1)
+    windows = [
+        (START, START + 9, 0),
+        (START + 10, START + 19, 1),
+        (START + 20, START + 29, 2),
+    ]
+
+    append_windows(TARGETS, windows, manifest, node)
+    df = pd.read_csv(FILENAME, dtype=str)
+    assert df["transactionHash"].tolist() == (
+        first["transactionHash"].tolist()[5:] + second["transactionHash"].tolist()
+    )
+    assert df["block_date"].tolist() == [block_date(START + i) for i in range(5, 20)]
+    assert manifest.get(CONTRACT, "TokenExchange") == START + 29
+    assert SyncManifest().get(CONTRACT, "TokenExchange") == START + 29
+    assert not os.path.exists(f"{FILENAME}_0")
+    assert not os.path.exists(f"{FILENAME}_1")
+
+
+def test_append_windows_adds_the_missing_columns(node):
+    # Stored before the blocks were dated
+    stored = rows(range(START, START + 5))
+    stored.to_csv(FILENAME, index=False)
+    new = write_fragment(0, range(START + 5, START + 10), seed=1)
+
+    append_windows(TARGETS, [(START + 5, START + 9, 0)], SyncManifest(), node)
+    df = pd.read_csv(FILENAME, dtype=str)
+    assert list(df.columns) == list(stored.columns) + ["block_date"]
+    assert df["block_date"].tolist() == [block_date(START + i) for i in range(10)]
+    assert df["tokens_sold"].tolist() == (
+        stored["tokens_sold"].tolist() + new["tokens_sold"].tolist()
+    )
+
+
+def test_append_windows_keeps_the_stored_layout(node):
+    stored = rows(range(START, START + 5))
+    stored["block_date"] = [block_date(START + i) for i in range(5)]
+    columns = ["blockNumber", "block_date", "transactionHash", "tokens_sold", "buyer"]
+    # No logIndex column
+    stored[columns].to_csv(FILENAME, index=False)
+    new = write_fragment(0, range(START + 5, START + 10), seed=1)
+
+    append_windows(TARGETS, [(START + 5, START + 9, 0)], SyncManifest(), node)
+    df = pd.read_csv(FILENAME, dtype=str)
+    assert list(df.columns) == columns + ["logIndex"]
+    assert df["buyer"].tolist() == stored["buyer"].tolist() + new["buyer"].tolist()
+    assert df["logIndex"].isna().tolist() == [True] * 5 + [False] * 5
+
+
+def test_append_frame(node):
+    new = rows(range(START + 5, START + 10), seed=1)
+    append_frame(SPEC, new.iloc[::-1], BlockTimeIndex(node))
+    # Sorted by block, with the dates of the blocks
+    df = pd.read_csv(FILENAME, dtype=str)
+    assert list(df.columns) == list(new.columns) + ["block_date"]
+    assert df["buyer"].tolist() == new["buyer"].tolist()
+    assert df["block_date"].tolist() == [block_date(START + i) for i in range(5, 10)]
+
+    append_frame(SPEC, new.iloc[:0], BlockTimeIndex(node))
+    assert len(pd.read_csv(FILENAME)) == 5
+
+
+def test_append_frame_adds_the_missing_columns(node):
+    # Stored before the blocks were dated, like data/curve/curve_pool_TokenExchangeSwaps.csv
+    stored = rows(range(START, START + 5))
+    stored.drop(columns="logIndex").to_csv(FILENAME, index=False)
+    new = rows(range(START + 5, START + 10), seed=1)
+
+    append_frame(SPEC, new, BlockTimeIndex(node))
+    df = pd.read_csv(FILENAME, dtype=str)
+    assert list(df.columns) == [
+        "buyer",
+        "tokens_sold",
+        "transactionHash",
+        "blockNumber",
+        "logIndex",
+        "block_date",
+    ]
+    assert df["block_date"].tolist() == [block_date(START + i) for i in range(10)]
+    assert df["logIndex"].isna().tolist() == [True] * 5 + [False] * 5
+    assert df["tokens_sold"].tolist() == (
+        stored["tokens_sold"].tolist() + new["tokens_sold"].tolist()
+    )
+
+
+def test_commit_store_windows(node):
+    logs = random_logs(SPEC, range(START, START + 10), max_bits=200)
+    EventStore().write(
+        SPEC, SPEC.to_frame(decode_logs(SPEC.event_abi, logs)), START, START + 19
+    )
+    manifest = SyncManifest()
+
+    commit_store_windows([SPEC], [(START, START + 19, 0)], manifest, node)
+    assert SyncManifest().get(CONTRACT, "TokenExchange") == START + 19
+    # The dates of the stored blocks are resolved without the node from then on
+    assert BlockTimeIndex().dates([START, START + 9]).tolist() == [
+        block_date(START),
+        block_date(START + 9),
+    ]
+
+
+def test_sync_project_stops_at_the_first_failed_window(node, monkeypatch):
+    monkeypatch.setattr(
+        sync, "AdaptiveWindow", partial(AdaptiveWindow, 20, max_size=20)
+    )
+    monkeypatch.setattr(sync, "run_windows", partial(run_windows, retries=0))
+    manifest = SyncManifest()
+    manifest.set(CONTRACT, "TokenExchange", START - 1)
+    fetched = []
+
+    def fetch_window(start_block, end_block, batch_n):
+        fetched.append(batch_n)
+        if batch_n == 2:
+            raise ValueError("rejected")
+        write_fragment(batch_n, range(start_block, end_block + 1), seed=batch_n)
+
+    sync_project(fetch_window, TARGETS, manifest, node, START + 99)
+    assert sorted(fetched) == [0, 1, 2, 3, 4]
+    # The windows after the failed one are kept for the next run
+    assert manifest.get(CONTRACT, "TokenExchange") == START + 39
+    df = pd.read_csv(FILENAME)
+    assert df["blockNumber"].tolist() == list(range(START, START + 40))
@@ -0,0 +1,179 @@
+import os
+
+import pytest
+
+from tests.mock_rpc import random_rows
+from tokemak_quant_project import tx_index
+from tokemak_quant_project.loader import find_spec
+from tokemak_quant_project.tx_index import TransactionIndex
+
+SWAPS = find_spec("curve_steth_pool", "TokenExchange")
+TRANSFERS = find_spec("curve_steth_lp_token", "Transfer")
+SWAP_EVENT = ("curve_steth_pool", "TokenExchange")
+TRANSFER_EVENT = ("curve_steth_lp_token", "Transfer")
+BLOCKS = range(18000000, 18000010)
+
+
+@pytest.fixture
+def stored(in_tmp_dir):
+    """
+    One swap per block, and one transfer per block, the transfers of the first, third and fifth
+    blocks being in the transaction of the swap, with a second transfer in the third one.
+    """
+    (in_tmp_dir / "data" / "curve").mkdir()
+    swaps = random_rows(SWAPS, BLOCKS)
+    # Coin indexes, loaded as int64
+    swaps["sold_id"], swaps["bought_id"] = "0", "1"
+    transfers = random_rows(TRANSFERS, list(BLOCKS) + [BLOCKS[2]], seed=1)
+    transfers["logIndex"] = [str(10 + i) for i in range(len(transfers))]
+    for i, block in enumerate([0, 2, 4, 2]):
+        transfers.loc[[0, 2, 4, 10][i], "transactionHash"] = swaps.loc[
+            block, "transactionHash"
+        ]
+    transfers = transfers.sort_values(
+        ["blockNumber", "logIndex"], key=lambda column: column.astype(int)
+    )
+    swaps.to_csv(SWAPS.filename, index=False)
+    transfers.to_csv(TRANSFERS.filename, index=False)
+    return swaps, transfers.reset_index(drop=True)
+
+
+def index():
+    return TransactionIndex([SWAPS, TRANSFERS], path="data/cache/tx_index.arrow")
+
+
+def test_lookup_full_hash(stored):
+    swaps, _ = stored
+    logs = index().lookup(swaps.loc[2, "transactionHash"])
+    assert logs["transactionHash"].tolist() == [swaps.loc[2, "transactionHash"]] * 3
+    assert logs["event"].tolist() == ["TokenExchange", "Transfer", "Transfer"]
+    assert logs["pool"].tolist() == [
+        "curve_steth_pool",
+        "curve_steth_lp_token",
+        "curve_steth_lp_token",
+    ]
+    assert logs["blockNumber"].tolist() == [BLOCKS[2]] * 3
+    assert logs["logIndex"].tolist() == [2, 12, 20]
+    # Upper case, or a hash of no stored log
+    assert len(index().lookup(swaps.loc[2, "transactionHash"].upper()[2:])) == 3
+    assert index().lookup("0x" + "00" * 32).empty
+
+
+def test_lookup_prefix(stored):
+    swaps, _ = stored
+    transaction_hash = swaps.loc[5, "transactionHash"]
+    logs = index().lookup(transaction_hash[:12])
+    assert logs["transactionHash"].tolist() == [transaction_hash]
+    assert logs["event"].tolist() == ["TokenExchange"]
+    assert len(index().lookup("0x")) == 2 * len(BLOCKS) + 1
+
+
+def test_view(stored):
+    swaps, transfers = stored
+    view = index().view([SWAP_EVENT, TRANSFER_EVENT])
+    # Every swap, and only the transfers of their transactions
+    assert len(view) == len(BLOCKS) + 4
+    assert set(view["transactionHash"]) == set(swaps["transactionHash"])
+    assert view["blockNumber"].is_monotonic_increasing
+    assert view.groupby("pool").size().to_dict() == {
+        "curve_steth_lp_token": 4,
+        "curve_steth_pool": len(BLOCKS),
+    }
+
+    view = index().view(
+        [TRANSFER_EVENT, SWAP_EVENT],
+        blocks=(BLOCKS[1], BLOCKS[4]),
+        columns=["transactionHash", "vaue", "tokens_sold"],
+    )
+    assert list(view.columns) == ["transactionHash", "vaue", "tokens_sold"]
+    assert view["transactionHash"].tolist() == [
+        transfers.loc[1, "transactionHash"],
+        *[swaps.loc[2, "transactionHash"]] * 3,
+        transfers.loc[4, "transactionHash"],
+        *[swaps.loc[4, "transactionHash"]] * 2,
+    ]
+
+
+def test_join(stored):
+    swaps, transfers = stored
+    joined = index().join(
+        SWAP_EVENT,
+        TRANSFER_EVENT,
+        left_columns=["transactionHash", "tokens_sold", "logIndex"],
+        right_columns=["transactionHash", "vaue", "logIndex"],
+    )
+    assert list(joined.columns) == [
+        "transactionHash",
+        "tokens_sold",
+        "logIndex_x",
+        "vaue",
+        "logIndex_y",
+    ]
+    # In the order of the transaction hashes
+    joined = joined.sort_values("logIndex_y")
+    assert joined["logIndex_y"].tolist() == [10, 12, 14, 20]
+    assert joined["transactionHash"].tolist() == [
+        swaps.loc[block, "transactionHash"] for block in (0, 2, 4, 2)
+    ]
+    assert joined["logIndex_x"].tolist() == [0, 2, 4, 2]
+    expected = transfers.set_index("logIndex")["vaue"].astype(float) / 10**18
+    assert joined["vaue"].tolist() == pytest.approx(
+        [expected[str(i)] for i in (10, 12, 14, 20)]
+    )
+
+    one = index().join(
+        SWAP_EVENT, TRANSFER_EVENT, transaction_hash=swaps.loc[4, "transactionHash"]
+    )
+    assert len(one) == 1
+    assert index().join(SWAP_EVENT, TRANSFER_EVENT, blocks=(BLOCKS[6], BLOCKS[9])).empty
+
+
+def test_refresh_follows_the_stored_files(stored, monkeypatch):
+    swaps, _ = stored
+    index()
+    assert os.path.exists("data/cache/tx_index.arrow")
+
+    # Unchanged files: the cached index is memory-mapped, not built again
+    def build(self):
+        raise AssertionError("rebuilt")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(TransactionIndex, "_build", build)
+        assert len(index()) == 2 * len(BLOCKS) + 1
+
+    cached = index()
+    swaps.iloc[:5].to_csv(SWAPS.filename, index=False)
+    # Stale until refreshed
+    assert len(cached.lookup(swaps.loc[7, "transactionHash"])) == 1
+    cached.refresh()
+    assert cached.lookup(swaps.loc[7, "transactionHash"]).empty
+    assert len(cached) == len(BLOCKS) + 6
+
+    monkeypatch.setattr(tx_index, "INDEX_VERSION", "0")
+    calls = []
+    monkeypatch.setattr(
+        TransactionIndex, "_build", lambda self: calls.append(1) or build(self)
+    )
+    with pytest.raises(AssertionError, match="rebuilt"):
+        index()
+    assert calls == [1]
+
+
+@pytest.mark.parametrize("store_format", ["csv", "parquet"])
+def test_empty_store(in_tmp_dir, store_format):
+    empty = TransactionIndex(
+        [SWAPS, TRANSFERS], path="ix.arrow", store_format=store_format
+    )
+    assert len(empty) == 0
+    assert empty.lookup("0x" + "00" * 32).empty
+    assert empty.lookup("0x").empty
+    assert len(empty.block_entries(BLOCKS[0], BLOCKS[-1])) == 0
+    # Memory-mapped from the cached file
+    assert (
+        len(
+            TransactionIndex(
+                [SWAPS, TRANSFERS], path="ix.arrow", store_format=store_format
+            )
+        )
+        == 0
+    )
@@ -0,0 +1,132 @@
+import functools
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+from eth_utils import to_checksum_address
+
+from config import *
+
+# SQLite limits the number of host parameters per statement
+SQLITE_MAX_VARIABLES = 900
+
+
+def address_bytes(address):
+    """
+    :return: The 20 bytes of a hex address, checksummed or not.
+    """
+    return bytes.fromhex(address[2:])
+
+
+class AddressTable:
+    """
+    Persistent address <-> integer id dictionary shared by every partition of the event store, so
+    that addresses are stored and loaded as 4-byte ids instead of 42-character strings. Ids are
+    assigned in order of first appearance and never change, so they can be joined across events,
+    pools and runs.
+    """
+
+    def __init__(self, path=ADDRESS_TABLE_DB):
+        """
+        :param path: Path of the SQLite database, created if it does not exist.
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # A single connection, opening one per lookup would cost a WAL checkpoint every time.
+        # Several worker processes of the store pipeline may add addresses at the same time.
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # Every partition written may add addresses, a commit must not cost an fsync
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS addresses "
+                "(id INTEGER PRIMARY KEY, address BLOB UNIQUE NOT NULL)"
+            )
+        # Ids never change, both directions are kept in memory once looked up
+        self._ids = {}
+        self._addresses = {}
+
+    def _select(self, column, values):
+        """
+        Loads the rows of the given ids or addresses into the in-memory dictionaries.
+        """
+        for i in range(0, len(values), SQLITE_MAX_VARIABLES):
+            chunk = values[i : i + SQLITE_MAX_VARIABLES]
+            rows = self.conn.execute(
+                f"SELECT id, address FROM addresses WHERE {column} IN "
+                f"({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for address_id, address in rows:
+                self._ids[bytes(address)] = address_id
+                self._addresses[address_id] = bytes(address)
+
+    def ids(self, addresses):
+        """
+        Encodes addresses, adding the ones never seen before to the table.
+
+        :param addresses: An iterable of hex addresses, checksummed or not.
+        :return: An int32 array of address ids aligned with addresses.
+        """
+        # Converted once per distinct address rather than once per event
+        codes, unique = pd.factorize(np.asarray(addresses, dtype=object))
+        raw = [address_bytes(address) for address in unique]
+        missing = [
+            address for address in dict.fromkeys(raw) if address not in self._ids
+        ]
+        if missing:
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO addresses (address) VALUES (?)",
+                    [(address,) for address in missing],
+                )
+                self._select("address", missing)
+        ids = np.array([self._ids[address] for address in raw], dtype=np.int32)
+        return ids[codes]
+
+    def addresses(self, ids):
+        """
+        Decodes address ids.
+
+        :param ids: An iterable of address ids.
+        :return: An array of checksum addresses aligned with ids.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        unique, inverse = np.unique(ids, return_inverse=True)
+        missing = [int(i) for i in unique if int(i) not in self._addresses]
+        if missing:
+            with self.lock:
+                self._select("id", missing)
+        decoded = np.array(
+            [to_checksum_address(self._addresses[int(i)]) for i in unique], dtype=object
+        )
+        return decoded[inverse.reshape(-1)]
+
+    def frame(self):
+        """
+        :return: The whole table as a DataFrame with id and address columns, to join on the id
+        columns of the stored events.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, address FROM addresses ORDER BY id"
+            ).fetchall()
+        return pd.DataFrame(
+            {
+                "id": np.array([row[0] for row in rows], dtype=np.int32),
+                "address": [to_checksum_address(bytes(row[1])) for row in rows],
+            }
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def shared_address_table(path=ADDRESS_TABLE_DB):
+    """
+    :return: The AddressTable of a path shared by the whole process, so that the EventStore built
+    for every write reuses the ids already looked up.
+    """
+    return AddressTable(path)
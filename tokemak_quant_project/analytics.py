@@ -0,0 +1,171 @@
+"""
+Vectorized analytics over the stored pool events: every series is computed with numpy masks and
+grouped aggregations over whole columns, instead of a Python function applied to each row.
+"""
+
+import numpy as np
+import pandas as pd
+
+from config import *
+
+# Relative difference under which both token amounts are considered to be the same amount
+AMOUNTS_AGG_THRESHOLD = 0.1
+
+# Index of stETH in the coins of the Curve stETH/ETH pool, ETH being 0
+CURVE_STETH_INDEX = 1
+
+
+def to_units(values, decimals=18):
+    """
+    Converts raw token amounts, possibly stored as Python ints wider than 64 bits, to float units.
+
+    :param values: A Series or array of raw amounts.
+    :param decimals: The decimals of the token.
+    """
+    return np.asarray(values, dtype=float) / 10**decimals
+
+
+def amounts_agg(df, field1, field2, threshold=AMOUNTS_AGG_THRESHOLD):
+    """
+    Vectorized utilities.calculate_amounts_agg: picks a single amount out of the amounts of the two
+    coins of each row.
+
+    :param df: The DataFrame holding the two amount columns.
+    :param field1: The column of the first coin amount.
+    :param field2: The column of the second coin amount.
+    :param threshold: Relative difference under which both amounts are considered the same.
+    :return: A Series aligned with df.
+    """
+    token_amounts_a = df[field1].to_numpy()
+    token_amounts_b = df[field2].to_numpy()
+    a = np.asarray(token_amounts_a, dtype=float)
+    b = np.asarray(token_amounts_b, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        close = np.abs(a - b) / b < threshold
+    conditions = [
+        (a == 0) & (b > 0),
+        (a > 0) & (b == 0),
+        (a > 0) & (b > 0) & close,
+        (a == 0) & (b == 0),
+    ]
+    choices = [token_amounts_b, token_amounts_a, token_amounts_b, 0]
+    return pd.Series(
+        np.select(conditions, choices, default=token_amounts_a), index=df.index
+    )
+
+
+def add_dates(df, date_column="block_date"):
+    """
+    Parses the block dates of a DataFrame in place and adds a 'date' column with the day of each row.
+    """
+    df[date_column] = pd.to_datetime(df[date_column])
+    df["date"] = df[date_column].dt.normalize()
+    return df
+
+
+def prepare_liquidity_events(df, decimals=18):
+    """
+    Adds the dates and the aggregated 'token_amounts' and 'fee_amounts' columns, in token units, to
+    AddLiquidity or RemoveLiquidity events.
+
+    :param df: The stored events, with token_amounts_a/b and fees_a/b columns.
+    :param decimals: The decimals of the pool coins.
+    """
+    df = add_dates(df.copy())
+    for prefix, column in (("token_amounts", "token_amounts"), ("fees", "fee_amounts")):
+        amounts = pd.DataFrame(
+            {
+                "a": to_units(df[f"{prefix}_a"], decimals),
+                "b": to_units(df[f"{prefix}_b"], decimals),
+            },
+            index=df.index,
+        )
+        df[column] = amounts_agg(amounts, "a", "b").astype(float)
+    return df
+
+
+def daily_sum(frames, column, date_column="date"):
+    """
+    Sums a column per day over one or several DataFrames.
+
+    :return: A Series indexed by day, with the days without rows left out.
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    values = pd.concat([df[[date_column, column]] for df in frames], ignore_index=True)
+    return values.groupby(date_column)[column].sum()
+
+
+def daily_volume(add_liquidity, remove_liquidity):
+    """
+    Daily and cumulative liquidity volume (deposits plus withdrawals), from prepared events.
+
+    :return: A DataFrame indexed by day with volume and cumulative_volume columns.
+    """
+    volume = daily_sum([add_liquidity, remove_liquidity], "token_amounts")
+    return pd.DataFrame({"volume": volume, "cumulative_volume": volume.cumsum()})
+
+
+def daily_fees(add_liquidity, remove_liquidity=None):
+    """
+    Daily and cumulative fees paid on liquidity events, from prepared events.
+
+    :return: A DataFrame indexed by day with fees and cumulative_fees columns.
+    """
+    frames = [add_liquidity] + (
+        [remove_liquidity] if remove_liquidity is not None else []
+    )
+    fees = daily_sum(frames, "fee_amounts")
+    return pd.DataFrame({"fees": fees, "cumulative_fees": fees.cumsum()})
+
+
+def daily_net_flow(deposits, withdrawals, initial_tvl=0.0, column="token_amounts"):
+    """
+    Daily deposits, withdrawals, net flow and TVL, the TVL being the cumulated net flow on top of an
+    initial TVL.
+
+    :param deposits: The prepared deposit events.
+    :param withdrawals: The prepared withdrawal events.
+    :param initial_tvl: The TVL before the first stored event.
+    :param column: The amount column of both DataFrames.
+    :return: A DataFrame indexed by day with deposits, withdrawals, net_flow and tvl columns.
+    """
+    flows = pd.DataFrame(
+        {
+            "deposits": daily_sum(deposits, column),
+            "withdrawals": daily_sum(withdrawals, column),
+        }
+    ).fillna(0.0)
+    flows["net_flow"] = flows["deposits"] - flows["withdrawals"]
+    flows["tvl"] = initial_tvl + flows["net_flow"].cumsum()
+    return flows
+
+
+def swap_prices(swaps):
+    """
+    Price of stETH in ETH of each TokenExchange event of the Curve pool, whatever the swap direction.
+
+    :param swaps: The stored TokenExchange events.
+    :return: A Series aligned with swaps.
+    """
+    sold = to_units(swaps["tokens_sold"])
+    bought = to_units(swaps["tokens_bought"])
+    sold_steth = swaps["sold_id"].to_numpy() == CURVE_STETH_INDEX
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prices = np.where(sold_steth, bought / sold, sold / bought)
+    return pd.Series(prices, index=swaps.index).replace([np.inf, -np.inf], np.nan)
+
+
+def daily_price_volatility(swaps, window=5):
+    """
+    Daily average swap price and its rolling standard deviation.
+
+    :param swaps: The stored TokenExchange events, with a 'date' column (see add_dates).
+    :param window: The number of days of the rolling window.
+    :return: A DataFrame indexed by day with price and rolling_volatility columns.
+    """
+    prices = pd.DataFrame({"date": swaps["date"], "price": swap_prices(swaps)})
+    daily_prices = prices.groupby("date")[["price"]].mean()
+    daily_prices["rolling_volatility"] = daily_prices["price"].rolling(window).std()
+    return daily_prices
@@ -0,0 +1,302 @@
+"""
+Block number <-> timestamp index interpolating between a few anchor blocks.
+
+Since the merge, every block is proposed in a slot of SLOT_SECONDS seconds. Between two anchors whose
+timestamps are exactly SLOT_SECONDS apart per block, no slot was missed and the timestamp of every
+block in between is known without asking the node. Only the intervals hiding missed slots need more
+anchors, fetched by bisection until the requested blocks are pinned down exactly.
+"""
+
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from config import *
+from tokemak_quant_project.block_timestamps import BlockTimestampCache
+
+
+def date_bounds(start, end):
+    """
+    Converts an inclusive range of dates or datetimes into its first and last instants. An end given
+    as a day, e.g. "2023-06-30", covers the whole day.
+
+    :return: A (start, end) tuple of pandas Timestamps, both inclusive.
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if end == end.normalize():
+        end = end + pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+    return start, end
+
+
+def local_timestamp(date):
+    """
+    :return: The timestamp of a naive datetime read in local time, like the stored 'block_date'
+    columns, in whole seconds.
+    """
+    return int(pd.Timestamp(date).floor("s").to_pydatetime().timestamp())
+
+
+class BlockTimeIndex:
+    """
+    Resolves block timestamps and the blocks of timestamps in O(log n) with a binary search over
+    sorted NumPy arrays of anchor blocks, the anchors being the blocks of the BlockTimestampCache.
+    """
+
+    def __init__(self, w3=None, cache=None, batch_size=RPC_BATCH_SIZE, bucket=None):
+        """
+        :param w3: An optional Web3 instance used to fetch new anchors. Without it, the index only
+        interpolates between the stored anchors.
+        :param cache: The BlockTimestampCache holding the anchors, BLOCK_TIMESTAMPS_DB by default.
+        :param batch_size: Maximum number of blocks per HTTP request.
+        :param bucket: Optional TokenBucket used to rate limit the requests.
+        """
+        self.w3 = w3
+        self.cache = cache if cache is not None else BlockTimestampCache()
+        self.batch_size = batch_size
+        self.bucket = bucket
+        rows = self.cache.items()
+        self.anchor_blocks = np.array([row[0] for row in rows], dtype=np.int64)
+        self.anchor_timestamps = np.array([row[1] for row in rows], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.anchor_blocks)
+
+    def add_anchors(self, timestamps):
+        """
+        Adds known block timestamps to the index, without storing them.
+
+        :param timestamps: A dict block number -> timestamp.
+        """
+        if not timestamps:
+            return
+        blocks = np.concatenate(
+            [np.fromiter(timestamps.keys(), dtype=np.int64), self.anchor_blocks]
+        )
+        values = np.concatenate(
+            [np.fromiter(timestamps.values(), dtype=np.int64), self.anchor_timestamps]
+        )
+        self.anchor_blocks, first = np.unique(blocks, return_index=True)
+        self.anchor_timestamps = values[first]
+
+    def fetch_anchors(self, block_numbers):
+        """
+        Fetches the timestamps of the given blocks, storing them in the cache, and adds them as anchors.
+        """
+        if self.w3 is None:
+            raise ValueError("Fetching block anchors requires a Web3 instance")
+        self.add_anchors(
+            self.cache.fetch(
+                self.w3,
+                [int(block) for block in block_numbers],
+                batch_size=self.batch_size,
+                bucket=self.bucket,
+            )
+        )
+
+    def _locate(self, block_numbers):
+        """
+        :return: The interpolated timestamps of the blocks, the mask of the exact ones, and for
+        every block the index of the first anchor at or after it.
+        """
+        anchors, times = self.anchor_blocks, self.anchor_timestamps
+        n = len(anchors)
+        right = np.searchsorted(anchors, block_numbers, side="left")
+        left_i = np.clip(right - 1, 0, n - 1)
+        right_i = np.clip(right, 0, n - 1)
+        has_left, has_right = right > 0, right < n
+        b1, t1 = anchors[left_i], times[left_i]
+        b2, t2 = anchors[right_i], times[right_i]
+
+        hit = has_right & (b2 == block_numbers)
+        on_grid = (
+            has_left
+            & has_right
+            & (b1 >= MERGE_BLOCK)
+            & (t2 - t1 == SLOT_SECONDS * (b2 - b1))
+        )
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            between = t1 + (t2 - t1) * (block_numbers - b1) / np.maximum(b2 - b1, 1)
+        timestamps = np.where(
+            has_left & has_right,
+            np.round(between),
+            np.where(
+                has_left,
+                t1 + SLOT_SECONDS * (block_numbers - b1),
+                t2 - SLOT_SECONDS * (b2 - block_numbers),
+            ),
+        ).astype(np.int64)
+        timestamps = np.where(hit, t2, timestamps)
+        return timestamps, hit | on_grid, right
+
+    def _split_points(self, pending, right):
+        """
+        :return: The blocks to fetch so that every interval holding unresolved blocks is split.
+        """
+        anchors = self.anchor_blocks
+        n = len(anchors)
+        points = []
+        intervals, starts = np.unique(right, return_index=True)
+        for interval, group in zip(intervals, np.split(pending, starts[1:])):
+            if interval == 0:
+                points.append(group[0])
+            elif interval == n:
+                points.append(group[-1])
+            elif anchors[interval - 1] < MERGE_BLOCK:
+                # No slot grid before the merge, every block has to be fetched
+                points += [block for block in group if block < MERGE_BLOCK]
+                if group[-1] >= MERGE_BLOCK:
+                    points.append(MERGE_BLOCK)
+            else:
+                # The requested block closest to the middle both resolves itself and halves the interval
+                middle = (anchors[interval - 1] + anchors[interval]) // 2
+                points.append(group[np.argmin(np.abs(group - middle))])
+        return points
+
+    def timestamps(self, block_numbers):
+        """
+        Resolves the timestamps of blocks, fetching the anchors needed to pin them down exactly when
+        the index has a Web3 instance.
+
+        :param block_numbers: An iterable of block numbers.
+        :return: An int64 array of timestamps aligned with block_numbers.
+        """
+        block_numbers = np.asarray(block_numbers, dtype=np.int64)
+        if not len(block_numbers):
+            return np.array([], dtype=np.int64)
+        unique, inverse = np.unique(block_numbers, return_inverse=True)
+
+        if self.w3 is not None:
+            rounds = fetched = 0
+            while True:
+                if len(self):
+                    _, exact, right = self._locate(unique)
+                    pending = unique[~exact]
+                    right = right[~exact]
+                else:
+                    pending, right = unique, np.zeros(len(unique), dtype=np.int64)
+                if not len(pending):
+                    break
+                points = self._split_points(pending, right)
+                self.fetch_anchors(points)
+                rounds += 1
+                fetched += len(points)
+            logging.info(
+                f"Resolved {len(unique)} block timestamps with {fetched} new anchors in {rounds} rounds"
+            )
+        elif not len(self):
+            raise ValueError(
+                "The block index has no anchors, and no Web3 instance to fetch them"
+            )
+
+        timestamps, _, _ = self._locate(unique)
+        return timestamps[inverse.reshape(-1)]
+
+    def dates(self, block_numbers, date_format="%Y-%m-%d %H:%M:%S"):
+        """
+        :return: An array of the dates of the blocks, formatted in local time like the stored 'block_date' columns.
+        """
+        block_numbers = np.asarray(block_numbers, dtype=np.int64)
+        unique, inverse = np.unique(block_numbers, return_inverse=True)
+        dates = np.array(
+            [
+                datetime.fromtimestamp(int(timestamp)).strftime(date_format)
+                for timestamp in self.timestamps(unique)
+            ],
+            dtype=object,
+        )
+        return dates[inverse.reshape(-1)]
+
+    def block_at(self, timestamps):
+        """
+        Finds the last block produced at or before each timestamp.
+
+        Without a Web3 instance, blocks falling between two anchors of an interval with missed slots
+        are interpolated: this is still exact for filtering events whose blocks are all anchors, as no
+        event block lies strictly inside such an interval.
+
+        :param timestamps: An iterable of timestamps, in seconds since the epoch.
+        :return: An int64 array of block numbers aligned with timestamps, -1 before the first block.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        unique, inverse = np.unique(timestamps, return_inverse=True)
+
+        if self.w3 is not None:
+            edges = []
+            if not len(self) or unique[-1] > self.anchor_timestamps[-1]:
+                edges.append(self.w3.eth.block_number)
+            if not len(self) or unique[0] < self.anchor_timestamps[0]:
+                edges.append(0)
+            if edges:
+                self.fetch_anchors(edges)
+        elif not len(self):
+            raise ValueError(
+                "The block index has no anchors, and no Web3 instance to fetch them"
+            )
+
+        while True:
+            blocks, pending = self._block_guesses(unique)
+            if self.w3 is None or not pending:
+                break
+            self.fetch_anchors(pending)
+        return blocks[inverse.reshape(-1)]
+
+    def _block_guesses(self, timestamps):
+        """
+        :return: The block of each timestamp, interpolated where it is not exact yet, and the blocks
+        to fetch to narrow down the intervals of the inexact ones.
+        """
+        anchors, times = self.anchor_blocks, self.anchor_timestamps
+        n = len(anchors)
+        i = np.searchsorted(times, timestamps, side="right") - 1
+        left_i = np.clip(i, 0, n - 1)
+        right_i = np.clip(i + 1, 0, n - 1)
+        b1, t1 = anchors[left_i], times[left_i]
+        b2, t2 = anchors[right_i], times[right_i]
+        inside = (i >= 0) & (i < n - 1)
+
+        on_grid = (b1 >= MERGE_BLOCK) & (t2 - t1 == SLOT_SECONDS * (b2 - b1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            interpolated = b1 + (timestamps - t1) * (b2 - b1) // np.maximum(t2 - t1, 1)
+        guesses = np.where(
+            on_grid, b1 + (timestamps - t1) // SLOT_SECONDS, interpolated
+        )
+        blocks = np.where(inside, np.clip(guesses, b1, b2 - 1), b1)
+        blocks = np.where(i < 0, -1, blocks)
+
+        unresolved = inside & ~on_grid & (b2 - b1 > 1)
+        # Guess strictly inside the interval so that every fetch narrows it down
+        pending = np.unique(
+            np.clip(guesses[unresolved], b1[unresolved] + 1, b2[unresolved] - 1)
+        )
+        return blocks, pending.tolist()
+
+    def block_range(self, start_timestamp, end_timestamp):
+        """
+        Converts a time range into the range of blocks produced in it, e.g. to fetch the events of a
+        given period.
+
+        :param start_timestamp: The start of the range, in seconds since the epoch (inclusive).
+        :param end_timestamp: The end of the range, in seconds since the epoch (inclusive).
+        :return: A (first block, last block) tuple, or None if no block was produced in the range.
+        """
+        before, last_block = self.block_at([start_timestamp - 1, end_timestamp])
+        first_block = int(before) + 1
+        if first_block > last_block:
+            return None
+        return first_block, int(last_block)
+
+    def date_block_range(self, start, end):
+        """
+        Converts a range of dates into the range of blocks produced in it, like block_range. The
+        dates are in local time like the stored 'block_date' columns, and an end given as a day
+        covers the whole day, see date_bounds.
+
+        :param start: The first date or datetime (inclusive).
+        :param end: The last date or datetime (inclusive).
+        :return: A (first block, last block) tuple, or None if no block was produced in the range.
+        """
+        start, end = date_bounds(start, end)
+        return self.block_range(local_timestamp(start), local_timestamp(end))
@@ -0,0 +1,126 @@
+import logging
+import sqlite3
+from contextlib import closing
+
+from config import *
+from tokemak_quant_project.rpc import batch_request
+
+# SQLite limits the number of host parameters per statement
+SQLITE_MAX_VARIABLES = 900
+
+
+class BlockTimestampCache:
+    """
+    Persistent block number -> timestamp store, shared by every run and both projects, so that
+    only blocks never seen before cost a network request.
+    """
+
+    def __init__(self, path=BLOCK_TIMESTAMPS_DB):
+        """
+        :param path: Path of the SQLite database, created if it does not exist.
+        """
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS block_timestamps "
+                "(block_number INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def get(self, block_numbers):
+        """
+        Looks up the stored timestamps of the given blocks.
+
+        :param block_numbers: An iterable of block numbers.
+        :return: A dict block number -> timestamp for the blocks found in the store.
+        """
+        block_numbers = [int(block_number) for block_number in block_numbers]
+        timestamps = {}
+        with closing(self._connect()) as conn:
+            for i in range(0, len(block_numbers), SQLITE_MAX_VARIABLES):
+                chunk = block_numbers[i : i + SQLITE_MAX_VARIABLES]
+                rows = conn.execute(
+                    "SELECT block_number, timestamp FROM block_timestamps "
+                    f"WHERE block_number IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                timestamps.update(rows)
+        return timestamps
+
+    def put(self, timestamps):
+        """
+        Stores block timestamps.
+
+        :param timestamps: A dict block number -> timestamp.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO block_timestamps VALUES (?, ?)",
+                [(int(block), int(ts)) for block, ts in timestamps.items()],
+            )
+
+    def items(self):
+        """
+        :return: All the stored (block number, timestamp) pairs, sorted by block number.
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT block_number, timestamp FROM block_timestamps ORDER BY block_number"
+            ).fetchall()
+
+    def block_range(self, start_timestamp, end_timestamp):
+        """
+        Finds the stored blocks between two timestamps.
+
+        :param start_timestamp: The start of the range, in seconds since the epoch (inclusive).
+        :param end_timestamp: The end of the range, in seconds since the epoch (inclusive).
+        :return: A (first block, last block) tuple, or None if no stored block is in the range.
+        """
+        with closing(self._connect()) as conn:
+            first_block, last_block = conn.execute(
+                "SELECT MIN(block_number), MAX(block_number) FROM block_timestamps "
+                "WHERE timestamp BETWEEN ? AND ?",
+                (start_timestamp, end_timestamp),
+            ).fetchone()
+        if first_block is None:
+            return None
+        return first_block, last_block
+
+    def fetch(self, w3, block_numbers, batch_size=RPC_BATCH_SIZE, bucket=None):
+        """
+        Returns the timestamps of the given blocks, fetching the ones missing from the store with
+        batched eth_getBlockByNumber calls and storing them for later runs.
+
+        :param w3: A Web3 instance connected to an Ethereum node over HTTP.
+        :param block_numbers: An iterable of block numbers.
+        :param batch_size: Maximum number of blocks per HTTP request.
+        :param bucket: Optional TokenBucket used to rate limit the requests.
+        :return: A dict block number -> timestamp.
+        """
+        block_numbers = sorted({int(block_number) for block_number in block_numbers})
+        timestamps = self.get(block_numbers)
+        missing = [block for block in block_numbers if block not in timestamps]
+        logging.info(
+            f"{len(timestamps)} block timestamps found in {self.path}, fetching {len(missing)}"
+        )
+
+        for i in range(0, len(missing), batch_size):
+            chunk = missing[i : i + batch_size]
+            blocks = batch_request(
+                w3,
+                "eth_getBlockByNumber",
+                [[hex(block), False] for block in chunk],
+                batch_size=batch_size,
+                bucket=bucket,
+            )
+            fetched = {
+                int(block["number"], 16): int(block["timestamp"], 16)
+                for block in blocks
+            }
+            # Store every chunk right away so that an interrupted run keeps its progress
+            self.put(fetched)
+            timestamps.update(fetched)
+
+        return timestamps
@@ -0,0 +1,163 @@
+"""
+Consolidation of the CSV fragments written by a backfill into one file per event.
+
+Every window of a backfill writes one fragment per event, <filename>_<batch_n>. The fragments of an
+event are found by listing their directory and read exactly once: their rows are deduplicated on
+(transactionHash, logIndex), dated with a single lookup in the BlockTimeIndex and sorted by
+(blockNumber, logIndex) before the consolidated file is written, so that the I/O grows with the
+data rather than with the number of windows.
+"""
+
+import io
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from config import *
+from tokemak_quant_project.block_index import BlockTimeIndex
+from tokemak_quant_project.metrics import METRICS
+
+
+def fragment_paths(filename):
+    """
+    :param filename: The consolidated file of an event, e.g. spec.filename.
+    :return: The paths of its fragments, sorted by batch number.
+    """
+    directory = os.path.dirname(filename) or "."
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(rf"^{re.escape(os.path.basename(filename))}_(\d+)$")
+    fragments = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match is not None:
+            fragments.append((int(match.group(1)), os.path.join(directory, name)))
+    return [path for _, path in sorted(fragments)]
+
+
+def _typed(df):
+    for column in ("blockNumber", "logIndex"):
+        df[column] = df[column].astype(np.int64)
+    return df
+
+
+def read_events_csv(path):
+    """
+    Reads a stored event file as strings, so that uint256 values are written back unchanged, with
+    integer block numbers and log indexes.
+    """
+    return _typed(pd.read_csv(path, dtype=str))
+
+
+def read_fragments(paths):
+    """
+    Reads the rows of several fragments, like read_events_csv. The rows of the fragments sharing a
+    header are concatenated as text and parsed at once, rather than paying the setup of a parse for
+    every fragment, most of which hold a few rows or none.
+
+    :return: A DataFrame, or None if no fragment holds a header.
+    """
+    groups = {}
+    for path in paths:
+        with open(path, "rb") as fragment:
+            header = fragment.readline()
+            rows = fragment.read()
+        if not header.strip():
+            logging.error(f"{path} : empty fragment")
+            METRICS.increment("file_errors", stage="consolidate")
+            continue
+        if rows and not rows.endswith(b"\n"):
+            rows += b"\n"
+        groups.setdefault(header.rstrip(b"\r\n") + b"\n", []).append(rows)
+    frames = [
+        pd.read_csv(io.BytesIO(header + b"".join(chunks)), dtype=str)
+        for header, chunks in groups.items()
+    ]
+    if not frames:
+        return None
+    return _typed(pd.concat(frames, ignore_index=True))
+
+
+def write_events_csv(df, path):
+    """
+    Writes an event file, then renames it, so that readers never see a partial file.
+    """
+    df.to_csv(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def add_block_dates(df, index):
+    """
+    Sets the 'block_date' column of events, resolving the date of each distinct block once.
+    """
+    df["block_date"] = index.dates(df["blockNumber"].to_numpy())
+    return df
+
+
+def merge_fragments(paths):
+    """
+    Reads the fragments of an event once, dropping the rows stored twice and sorting the others.
+
+    :return: A DataFrame sorted by (blockNumber, logIndex), or None if no fragment holds a header.
+    """
+    with METRICS.stage("consolidate") as timing:
+        df = read_fragments(paths)
+        if df is None:
+            return None
+        # Dated again, fragments of an interrupted run may already have dates
+        df = df.drop(columns="block_date", errors="ignore")
+        # Windows retried or split after a partial write may have stored the same logs twice
+        df = df.drop_duplicates(subset=["transactionHash", "logIndex"])
+        df = df.sort_values(["blockNumber", "logIndex"], ignore_index=True)
+        timing["items"] = len(df)
+    return df
+
+
+def consolidate_events(specs, w3, bucket=None, remove_fragments=True):
+    """
+    Builds the consolidated file of every event from its fragments, replacing the files that exist.
+    The blocks of all the events are dated together, so that the fewest anchors are fetched.
+
+    :param specs: A list of EventSpec.
+    :param w3: A Web3 instance, used to fetch the anchors needed to date the blocks.
+    :param bucket: An optional TokenBucket used to rate limit the block requests.
+    :param remove_fragments: Remove the fragments once the consolidated files are written.
+    :return: A dict EventSpec -> number of rows written, for the events with fragments.
+    """
+    merged = {}
+    for spec in specs:
+        paths = fragment_paths(spec.filename)
+        df = merge_fragments(paths) if paths else None
+        if df is not None:
+            merged[spec] = (df, paths)
+    if not merged:
+        return {}
+
+    index = BlockTimeIndex(w3, bucket=bucket)
+    blocks = np.unique(
+        np.concatenate([df["blockNumber"].to_numpy() for df, _ in merged.values()])
+    )
+    with METRICS.stage("block_dates") as timing:
+        index.timestamps(blocks)
+        timing["items"] = len(blocks)
+
+    for spec, (df, paths) in merged.items():
+        write_events_csv(add_block_dates(df, index), spec.filename)
+        if remove_fragments:
+            for path in paths:
+                os.remove(path)
+        logging.info(
+            f"Consolidated {len(paths)} {spec.event} fragments into {len(df)} rows in "
+            f"{spec.filename}"
+        )
+    return {spec: len(df) for spec, (df, _) in merged.items()}
+
+
+def date_events_file(filename, index):
+    """
+    Adds or refreshes the 'block_date' column of a consolidated event file, in place.
+    """
+    write_events_csv(add_block_dates(read_events_csv(filename), index), filename)
@@ -0,0 +1,218 @@
+import re
+
+import numpy as np
+from eth_utils import to_checksum_address
+
+# Columns added to every decoded event, in the order they are stored
+METADATA_COLUMNS = [
+    "event",
+    "logIndex",
+    "transactionIndex",
+    "transactionHash",
+    "address",
+    "blockHash",
+    "blockNumber",
+]
+
+# Fields of the raw logs read by decode_logs, besides the topics
+LOG_FIELDS = [
+    "data",
+    "logIndex",
+    "transactionIndex",
+    "transactionHash",
+    "address",
+    "blockHash",
+    "blockNumber",
+]
+
+STATIC_TYPE_PATTERN = re.compile(r"^(u?int\d*|address|bool|bytes\d+)(?:\[(\d+)\])?$")
+
+
+def parse_static_type(abi_type):
+    """
+    Splits a static ABI type into its base type and fixed array length.
+
+    :param abi_type: An ABI type such as uint256, address or uint256[2].
+    :return: A (base type, array length or None) tuple.
+    """
+    match = STATIC_TYPE_PATTERN.match(abi_type)
+    if match is None:
+        raise ValueError(f"Only static ABI types can be decoded, got {abi_type}")
+    length = match.group(2)
+    return match.group(1), int(length) if length is not None else None
+
+
+def hex_to_bytes_array(values, width):
+    """
+    Converts a list of 0x-prefixed hex strings of the same size into a (len(values), width) uint8 array,
+    with a single bytes.fromhex call for the whole batch.
+    """
+    buffer = bytes.fromhex("".join(value[2:] for value in values))
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(len(values), width)
+
+
+def decode_uint_words(words):
+    """
+    Decodes (n, 32) big-endian words into unsigned integers: a uint64 array when every value fits,
+    an object array of Python ints otherwise.
+    """
+    limbs = np.ascontiguousarray(words).view(">u8").astype(np.uint64)
+    if not limbs[:, :3].any():
+        return limbs[:, 3]
+
+    values = limbs[:, 0].astype(object)
+    for i in range(1, 4):
+        values = (values << 64) | limbs[:, i].astype(object)
+    return values
+
+
+def decode_int_words(words):
+    """
+    Decodes (n, 32) big-endian two's complement words into signed integers: an int64 array when
+    every value fits, an object array of Python ints otherwise.
+    """
+    negative = words[:, 0] >= 0x80
+    values = decode_uint_words(words).astype(object)
+    values[negative] -= 2**256
+    if len(values) == 0 or (-(2**63) <= values.min() and values.max() < 2**63):
+        return values.astype(np.int64)
+    return values
+
+
+def decode_address_words(words):
+    """
+    Decodes (n, 32) words into checksum addresses, checksumming each distinct address only once.
+    """
+    raw = np.ascontiguousarray(words[:, 12:]).view(np.dtype((np.void, 20))).ravel()
+    unique, inverse = np.unique(raw, return_inverse=True)
+    checksummed = np.array(
+        [to_checksum_address(address.tobytes()) for address in unique], dtype=object
+    )
+    return checksummed[inverse.ravel()]
+
+
+def decode_words(base_type, words):
+    """
+    Decodes a column of (n, 32) ABI words of the given static base type.
+    """
+    if base_type == "address":
+        return decode_address_words(words)
+    if base_type == "bool":
+        return words[:, 31] != 0
+    if base_type.startswith("uint"):
+        return decode_uint_words(words)
+    if base_type.startswith("int"):
+        return decode_int_words(words)
+    # bytesN
+    size = int(base_type[5:])
+    return np.array(
+        ["0x" + word[:size].tobytes().hex() for word in words], dtype=object
+    )
+
+
+def decode_logs(event_abi, logs):
+    """
+    Decodes the raw eth_getLogs entries of a single event into column arrays, decoding the 32-byte
+    ABI words of the whole batch at once instead of one log at a time.
+
+    :param event_abi: The ABI entry of the event. Only events with static argument types are supported.
+    :param logs: Raw log entries as returned by the node (hex strings, not web3 AttributeDicts), or
+    the same logs packed by pack_logs.
+    :return: A dict column name -> numpy array with one column per event argument, fixed size array
+    arguments giving (n, length) arrays, followed by the METADATA_COLUMNS.
+    """
+    if isinstance(logs, dict):
+        n_logs = logs["n_logs"]
+
+        def field(name):
+            return logs[name].split("\n") if n_logs else []
+
+        def topic(position):
+            return logs["topics"][position].split("\n") if n_logs else []
+
+    else:
+        n_logs = len(logs)
+
+        def field(name):
+            return [log[name] for log in logs]
+
+        def topic(position):
+            return [log["topics"][position] for log in logs]
+
+    data_inputs = [entry for entry in event_abi["inputs"] if not entry["indexed"]]
+    data_types = [parse_static_type(entry["type"]) for entry in data_inputs]
+    n_words = sum(length or 1 for _, length in data_types)
+    data = hex_to_bytes_array(field("data"), n_words * 32).reshape(n_logs, n_words, 32)
+
+    columns = {}
+    word, position = 0, 1
+    for entry in event_abi["inputs"]:
+        base_type, length = parse_static_type(entry["type"])
+        if entry["indexed"]:
+            words = hex_to_bytes_array(topic(position), 32)
+            columns[entry["name"]] = decode_words(base_type, words)
+            position += 1
+        elif length is None:
+            columns[entry["name"]] = decode_words(base_type, data[:, word])
+            word += 1
+        else:
+            items = [decode_words(base_type, data[:, word + i]) for i in range(length)]
+            if any(item.dtype == object for item in items):
+                items = [item.astype(object) for item in items]
+            columns[entry["name"]] = np.stack(items, axis=1)
+            word += length
+
+    columns["event"] = np.full(n_logs, event_abi["name"], dtype=object)
+    columns["logIndex"] = np.array(
+        [int(value, 16) for value in field("logIndex")], dtype=np.int64
+    )
+    columns["transactionIndex"] = np.array(
+        [int(value, 16) for value in field("transactionIndex")], dtype=np.int64
+    )
+    columns["transactionHash"] = np.array(field("transactionHash"), dtype=object)
+    columns["address"] = decode_address_words(
+        hex_to_bytes_array(
+            ["0x" + "00" * 12 + address[2:] for address in field("address")], 32
+        )
+    )
+    columns["blockHash"] = np.array(field("blockHash"), dtype=object)
+    columns["blockNumber"] = np.array(
+        [int(value, 16) for value in field("blockNumber")], dtype=np.int64
+    )
+    return columns
+
+
+def pack_logs(event_abi, logs):
+    """
+    Packs the raw logs of an event column-wise, each field of all the logs joined into a single
+    string. A handful of strings are much cheaper to pickle to a worker process than thousands of
+    dicts, and decode_logs reads them back without rebuilding the dicts.
+
+    :param event_abi: The ABI entry of the event, which gives the number of topics.
+    :param logs: Raw log entries as returned by the node.
+    :return: A dict field -> newline separated values, "topics" giving one string per topic.
+    """
+    n_topics = 1 + sum(1 for entry in event_abi["inputs"] if entry["indexed"])
+    packed = {name: "\n".join([log[name] for log in logs]) for name in LOG_FIELDS}
+    packed["topics"] = [
+        "\n".join([log["topics"][position] for log in logs])
+        for position in range(n_topics)
+    ]
+    packed["n_logs"] = len(logs)
+    return packed
+
+
+def n_rows(columns):
+    """
+    :return: The number of logs in a dict of decoded columns.
+    """
+    return len(columns["blockNumber"])
+
+
+def concat_columns(batches):
+    """
+    Concatenates several dicts of decoded columns of the same event.
+    """
+    return {
+        name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]
+    }
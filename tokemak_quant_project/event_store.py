@@ -0,0 +1,356 @@
+import json
+import os
+import re
+import threading
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import *
+from tokemak_quant_project.address_table import shared_address_table
+from tokemak_quant_project.block_index import BlockTimeIndex
+from tokemak_quant_project.decoder import hex_to_bytes_array, parse_static_type
+
+PARTITION_PATTERN = re.compile(r"^blocks=(\d+)-(\d+)\.parquet$")
+
+# Version of the partition layout and schemas, bumped whenever a store written before can no longer
+# be read. Stores without a version file predate it: hex string columns, partitions keyed by project.
+STORE_VERSION = 1
+VERSION_FILENAME = "store_version.json"
+
+# Largest precision of the Arrow decimal types
+MAX_DECIMAL_PRECISION = 76
+
+# Field metadata marking the int32 columns holding ids of the AddressTable
+ADDRESS_METADATA = {b"encoding": b"address_id"}
+
+
+def arrow_type(abi_type):
+    """
+    Maps a static ABI base type to the Arrow type it is stored with: 64-bit integers when the ABI
+    type fits, exact decimals for wider integers such as uint256 and int128, fixed size binary for
+    bytesN and int32 ids of the address table for addresses.
+
+    :param abi_type: A static ABI base type, e.g. uint256, int128 or address.
+    """
+    if abi_type == "address":
+        return pa.int32()
+    if abi_type.startswith("bytes"):
+        return pa.binary(int(abi_type[5:]))
+    if abi_type == "bool":
+        return pa.bool_()
+    signed = abi_type.startswith("int")
+    bits = int(abi_type[3 if signed else 4 :] or 256)
+    if bits <= 64:
+        return pa.int64() if signed else pa.uint64()
+    precision = min(MAX_DECIMAL_PRECISION, len(str(2**bits)))
+    return pa.decimal256(precision, 0)
+
+
+def event_schema(spec):
+    """
+    Builds the Arrow schema of the stored columns of an event. Hashes are stored as 32-byte binary
+    and addresses as ids of the address table, marked with ADDRESS_METADATA.
+
+    :param spec: An EventSpec from the event registry.
+    """
+    types = {}
+    for entry in spec.event_abi["inputs"]:
+        types[entry["name"]] = parse_static_type(entry["type"])[0]
+
+    fields = [
+        pa.field(
+            column,
+            arrow_type(types[argument]),
+            metadata=ADDRESS_METADATA if types[argument] == "address" else None,
+        )
+        for column, argument, _ in spec.fields
+    ]
+    fields += [
+        pa.field("event", pa.string()),
+        pa.field("logIndex", pa.int64()),
+        pa.field("transactionIndex", pa.int64()),
+        pa.field("transactionHash", pa.binary(32)),
+        pa.field("address", pa.int32(), metadata=ADDRESS_METADATA),
+        pa.field("blockHash", pa.binary(32)),
+        pa.field("blockNumber", pa.int64()),
+    ]
+    return pa.schema(fields)
+
+
+def is_address_field(field):
+    return field.metadata == ADDRESS_METADATA
+
+
+class EventStore:
+    """
+    Columnar event store, partitioned by pool, event and block range:
+    <root>/pool=<pool>/event=<event>/blocks=<start>-<end>.parquet
+
+    Hashes are stored as 32-byte binary and addresses as integer ids of a shared AddressTable, which
+    makes the partitions and the frames read from them several times smaller than hex strings.
+    """
+
+    def __init__(
+        self, root=EVENT_STORE_DIR, compression=PARQUET_COMPRESSION, addresses=None
+    ):
+        """
+        :param root: The directory of the store.
+        :param compression: The Parquet compression codec.
+        :param addresses: The AddressTable encoding the addresses, ADDRESS_TABLE_DB by default.
+        """
+        self.root = root
+        self.compression = compression
+        self.addresses = addresses if addresses is not None else shared_address_table()
+        self.check_version()
+
+    def check_version(self):
+        """
+        Refuses to open a store written with another layout or schema, whose partitions would be
+        misread or silently skipped.
+        """
+        try:
+            with open(os.path.join(self.root, VERSION_FILENAME), "r") as version_file:
+                version = json.load(version_file)["version"]
+        except FileNotFoundError:
+            has_partitions = os.path.isdir(self.root) and any(
+                name.startswith("pool=") for name in os.listdir(self.root)
+            )
+            version = None if has_partitions else STORE_VERSION
+        if version != STORE_VERSION:
+            found = "no version" if version is None else f"version {version}"
+            raise ValueError(
+                f"The event store under {self.root} has another layout ({found}, expected "
+                f"version {STORE_VERSION}): move it away together with "
+                f"{SYNC_MANIFEST_FILENAME}, and run the backfill again to rebuild it"
+            )
+
+    def _write_version(self):
+        path = os.path.join(self.root, VERSION_FILENAME)
+        if not os.path.exists(path):
+            os.makedirs(self.root, exist_ok=True)
+            # Written by the first partition, possibly from several writer processes at once
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as version_file:
+                json.dump({"version": STORE_VERSION}, version_file)
+            os.replace(tmp_path, path)
+
+    def partition_dir(self, pool, event):
+        return os.path.join(self.root, f"pool={pool}", f"event={event}")
+
+    def write(self, spec, frame, start_block, end_block):
+        """
+        Writes the events of a block range as one partition, replacing any partition of the same range.
+
+        :param spec: The EventSpec of the event.
+        :param frame: The DataFrame built by spec.to_frame.
+        :param start_block: The first block of the range (inclusive).
+        :param end_block: The last block of the range (inclusive).
+        :return: The path of the partition.
+        """
+        self._write_version()
+        directory = self.partition_dir(spec.pool, spec.event)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"blocks={start_block:010d}-{end_block:010d}.parquet"
+        )
+
+        schema = event_schema(spec)
+        table = pa.Table.from_arrays(
+            [self.encode(frame[field.name], field) for field in schema],
+            schema=schema,
+        )
+        # Write then rename, so that readers never see a partial partition
+        pq.write_table(table, f"{path}.tmp", compression=self.compression)
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    def encode(self, values, field):
+        """
+        Converts a column of a frame built by spec.to_frame to the Arrow array of its stored field.
+        """
+        if is_address_field(field):
+            return pa.array(self.addresses.ids(values), type=field.type)
+        if pa.types.is_fixed_size_binary(field.type):
+            # Hashes are never null, all of them are converted with a single fromhex call
+            data = hex_to_bytes_array(list(values), field.type.byte_width)
+            return pa.FixedSizeBinaryArray.from_buffers(
+                field.type, len(values), [None, pa.py_buffer(data.tobytes())]
+            )
+        return to_arrow(values, field.type)
+
+    def decode(self, column, field, compact=True):
+        """
+        Converts a stored Arrow column to numpy, see decode_column. Unless compact, binary values
+        are converted back to hex strings and address ids to checksum addresses.
+        """
+        if compact:
+            if pa.types.is_fixed_size_binary(field.type):
+                # Kept in the Arrow buffer, 32 bytes per hash instead of a Python object each
+                return pd.arrays.ArrowExtensionArray(column)
+            return decode_column(column)
+        if is_address_field(field):
+            return self.addresses.addresses(column.to_numpy())
+        if pa.types.is_fixed_size_binary(field.type):
+            return np.array(
+                [
+                    None if value is None else "0x" + value.hex()
+                    for value in column.to_pylist()
+                ],
+                dtype=object,
+            )
+        return decode_column(column)
+
+    def partitions(self, pool, event, blocks=None):
+        """
+        Lists the partitions of an event, optionally only those overlapping a block range.
+
+        :param pool: The name of the POOLS entry emitting the event, e.g. curve_steth_pool.
+        :param event: The name of the event.
+        :param blocks: An optional (start_block, end_block) tuple, both inclusive.
+        :return: A list of (start_block, end_block, path) tuples sorted by block.
+        """
+        directory = self.partition_dir(pool, event)
+        if not os.path.isdir(directory):
+            return []
+
+        partitions = []
+        for name in os.listdir(directory):
+            match = PARTITION_PATTERN.match(name)
+            if match is None:
+                continue
+            start_block, end_block = int(match.group(1)), int(match.group(2))
+            if blocks is not None and (
+                end_block < blocks[0] or start_block > blocks[1]
+            ):
+                continue
+            partitions.append((start_block, end_block, os.path.join(directory, name)))
+        return sorted(partitions)
+
+    def last_block(self, pool, event):
+        """
+        :return: The last block covered by the partitions of an event, or None if there are none.
+        """
+        partitions = self.partitions(pool, event)
+        return max(end_block for _, end_block, _ in partitions) if partitions else None
+
+    def drop_after(self, pool, event, block_number):
+        """
+        Removes the partitions starting after a block, e.g. the leftovers of an interrupted sync.
+        """
+        for start_block, _, path in self.partitions(pool, event):
+            if start_block > block_number:
+                os.remove(path)
+
+    def read(self, pool, event, columns=None, blocks=None, dates=None, compact=True):
+        """
+        Reads the events of a pool, opening only the partitions overlapping the requested range and
+        only the requested columns.
+
+        :param pool: The name of the POOLS entry emitting the event, e.g. curve_steth_pool.
+        :param event: The name of the event.
+        :param columns: An optional list of columns to read.
+        :param blocks: An optional (start_block, end_block) tuple, both inclusive.
+        :param dates: An optional (start, end) tuple of dates or datetimes, both inclusive, resolved
+        to a block range with the anchors of the block timestamp store. An end given as a day covers
+        the whole day.
+        :param compact: Keep hashes as 32-byte binary (Arrow-backed) columns and addresses as int32
+        ids of self.addresses. If
+        False, they are converted back to hex strings and checksum addresses like in the CSV files.
+        :return: A DataFrame sorted by (blockNumber, logIndex), with uint256 values as exact Python ints.
+        """
+        if dates is not None:
+            date_blocks = BlockTimeIndex().date_block_range(*dates)
+            if date_blocks is None:
+                return pd.DataFrame(columns=columns)
+            blocks = (
+                date_blocks
+                if blocks is None
+                else (
+                    max(blocks[0], date_blocks[0]),
+                    min(blocks[1], date_blocks[1]),
+                )
+            )
+
+        paths = [path for _, _, path in self.partitions(pool, event, blocks)]
+        if not paths:
+            return pd.DataFrame(columns=columns)
+
+        read_columns = columns
+        if columns is not None:
+            read_columns = list(dict.fromkeys(columns + ["blockNumber", "logIndex"]))
+        filters = None
+        if blocks is not None:
+            filters = [
+                ("blockNumber", ">=", blocks[0]),
+                ("blockNumber", "<=", blocks[1]),
+            ]
+
+        tables = [
+            pq.read_table(path, columns=read_columns, filters=filters) for path in paths
+        ]
+        table = pa.concat_tables(tables).sort_by(
+            [("blockNumber", "ascending"), ("logIndex", "ascending")]
+        )
+        frame = pd.DataFrame(
+            {
+                field.name: self.decode(table.column(field.name), field, compact)
+                for field in table.schema
+            }
+        )
+        # Overlapping partitions, e.g. from two backfills, must not duplicate events
+        frame = frame.drop_duplicates(
+            subset=["blockNumber", "logIndex"], ignore_index=True
+        )
+        return frame[columns] if columns is not None else frame
+
+    def block_numbers(self, pool):
+        """
+        :param pool: The name of a POOLS entry, e.g. curve_steth_pool.
+        :return: The distinct block numbers of all the events stored for the pool.
+        """
+        pool_dir = os.path.join(self.root, f"pool={pool}")
+        if not os.path.isdir(pool_dir):
+            return []
+        blocks = set()
+        for event_dir in os.listdir(pool_dir):
+            event = event_dir.split("=", 1)[1]
+            for _, _, path in self.partitions(pool, event):
+                blocks.update(
+                    pq.read_table(path, columns=["blockNumber"]).column(0).to_pylist()
+                )
+        return sorted(blocks)
+
+
+def to_arrow(values, arrow_type):
+    """
+    Converts a DataFrame column to an Arrow array of the given type, going through Python ints for
+    decimals since uint256 columns may hold values wider than any numpy integer.
+    """
+    if pa.types.is_decimal(arrow_type):
+        return pa.array(
+            [None if value is None else Decimal(int(value)) for value in values],
+            type=arrow_type,
+        )
+    return pa.array(values.to_numpy(), type=arrow_type, from_pandas=True)
+
+
+def decode_column(column):
+    """
+    Converts an Arrow column to numpy, keeping integers exact: decimal columns become uint64 or int64
+    when every value fits, Python ints otherwise.
+    """
+    if pa.types.is_decimal(column.type):
+        for integer_type in (pa.uint64(), pa.int64()):
+            try:
+                return column.cast(integer_type).to_numpy()
+            except pa.ArrowInvalid:
+                pass
+        return np.array(
+            [None if value is None else int(value) for value in column.to_pylist()],
+            dtype=object,
+        )
+    return column.to_numpy()
@@ -0,0 +1,154 @@
+import string
+
+import pandas as pd
+
+from config import *
+from tokemak_quant_project.decoder import METADATA_COLUMNS, parse_static_type
+from utilities import load_abi
+
+
+class EventSpec:
+    """
+    Describes a stored event: the contract emitting it, its ABI and the columns written for it.
+    """
+
+    def __init__(
+        self,
+        project,
+        contract,
+        abi_path,
+        event,
+        filename,
+        renames=None,
+        pool=None,
+        protocol=None,
+        columns=None,
+    ):
+        """
+        :param project: The project the event belongs to, e.g. curve or maverick.
+        :param contract: The address of the contract emitting the event.
+        :param abi_path: The path of the contract ABI.
+        :param event: The name of the event in the ABI.
+        :param filename: The file the event is stored in.
+        :param renames: An optional dict argument name -> stored column name.
+        :param pool: The name of the POOLS entry of the contract.
+        :param protocol: The protocol type of the contract, e.g. curve_plain_pool.
+        :param columns: An optional list of the stored columns, in order, for files whose layout
+        differs from the ABI order. The arguments left out of it are not stored.
+        """
+        self.project = project
+        self.pool = pool
+        self.protocol = protocol
+        self.contract = contract
+        self.abi_path = abi_path
+        self.event = event
+        self.filename = filename
+        self.abi = load_abi(abi_path)
+        self.event_abi = next(
+            entry
+            for entry in self.abi
+            if entry.get("type") == "event" and entry["name"] == event
+        )
+
+        renames = renames or {}
+        # (stored column, event argument, array index or None)
+        self.fields = []
+        for entry in self.event_abi["inputs"]:
+            column = renames.get(entry["name"], entry["name"])
+            _, length = parse_static_type(entry["type"])
+            if length is None:
+                self.fields.append((column, entry["name"], None))
+            else:
+                for i in range(length):
+                    suffix = string.ascii_lowercase[i]
+                    self.fields.append((f"{column}_{suffix}", entry["name"], i))
+        if columns is not None:
+            by_column = {field[0]: field for field in self.fields}
+            missing = [column for column in columns if column not in by_column]
+            if missing:
+                raise ValueError(f"{event} has no arguments stored as {missing}")
+            self.fields = [by_column[column] for column in columns]
+
+    def __repr__(self):
+        return f"EventSpec({self.project}, {self.contract}, {self.event})"
+
+    @property
+    def columns(self):
+        """
+        :return: The names of the stored columns, in order.
+        """
+        return [column for column, _, _ in self.fields] + METADATA_COLUMNS
+
+    def to_frame(self, columns):
+        """
+        Builds the stored DataFrame from the decoded columns of the event, column-wise.
+
+        :param columns: The decoded columns of the event, as returned by decode_logs.
+        """
+        frame = {}
+        for column, argument, index in self.fields:
+            values = columns[argument]
+            frame[column] = values if index is None else values[:, index]
+        for column in METADATA_COLUMNS:
+            frame[column] = columns[column]
+        return pd.DataFrame(frame, columns=self.columns)
+
+
+def load_registry(entries=EVENTS):
+    """
+    Builds the event registry from the EVENTS entries of config.py.
+
+    :param entries: A list of dicts with the project, contract, abi, event, filename and optional
+    renames, pool, protocol and columns.
+    :return: A list of EventSpec.
+    """
+    return [
+        EventSpec(
+            entry["project"],
+            entry["contract"],
+            entry["abi"],
+            entry["event"],
+            entry["filename"],
+            entry.get("renames"),
+            entry.get("pool"),
+            entry.get("protocol"),
+            entry.get("columns"),
+        )
+        for entry in entries
+    ]
+
+
+REGISTRY = load_registry()
+
+
+def project_events(project, registry=REGISTRY):
+    """
+    :return: The EventSpec of the project, in registry order.
+    """
+    return [spec for spec in registry if spec.project == project]
+
+
+def group_by_abi(specs, max_addresses=MAX_ADDRESSES_PER_REQUEST):
+    """
+    Groups event specs by contract ABI, so that the contracts of a protocol are queried together with
+    an address list filter, at most max_addresses per request.
+
+    :param specs: A list of EventSpec.
+    :param max_addresses: Maximum number of contracts per group.
+    :return: A list of (contract addresses, ABI, list of EventSpec) tuples.
+    """
+    by_abi = {}
+    for spec in specs:
+        by_abi.setdefault(spec.abi_path, []).append(spec)
+
+    groups = []
+    for abi_specs in by_abi.values():
+        addresses = list(dict.fromkeys(spec.contract.lower() for spec in abi_specs))
+        for i in range(0, len(addresses), max_addresses):
+            chunk = set(addresses[i : i + max_addresses])
+            chunk_specs = [spec for spec in abi_specs if spec.contract.lower() in chunk]
+            contracts = list(
+                {spec.contract.lower(): spec.contract for spec in chunk_specs}.values()
+            )
+            groups.append((contracts, chunk_specs[0].abi, chunk_specs))
+    return groups
@@ -1,31 +1,47 @@
+"""
+Fetches the events of the Curve stETH/ETH and Maverick swETH/ETH pools and stores them as CSV files,
+or in the partitioned Parquet event store when STORE_FORMAT is "parquet".
+"""
+
+import argparse
 import json
 import logging
 import os
-import time
 from datetime import datetime
 
-import pandas as pd
 from dotenv import load_dotenv
+from eth_utils import encode_hex, event_abi_to_log_topic
 from web3 import Web3
 
 from config import *
-from utilities import load_abi
-
-curve_filenames = [
-    CURVE_TOKEN_TRANSFERS_FILENAME,
-    CURVE_POOL_ADDLIQUIDITY_FILENAME,
-    CURVE_POOL_REMOVELIQUIDITY_FILENAME,
-    CURVE_POOL_REMOVELIQUIDITYONE_FILENAME,
-    CURVE_POOL_REMOVELIQUIDITYIMBALANCE_FILENAME,
-    CURVE_POOL_TOKENSWAPS_FILENAME,
-]
+from tokemak_quant_project.block_index import BlockTimeIndex
+from tokemak_quant_project.consolidate import consolidate_events, date_events_file
+from tokemak_quant_project.decoder import decode_logs, n_rows, pack_logs
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.events import (
+    REGISTRY,
+    group_by_abi,
+    project_events,
+)
+from tokemak_quant_project.follow import LiveFollower
+from tokemak_quant_project.metrics import (
+    METRICS,
+    ProgressReporter,
+    construct_metrics_middleware,
+)
+from tokemak_quant_project.pipeline import (
+    ProcessPipeline,
+    StreamingPipeline,
+    available_cpus,
+)
+from tokemak_quant_project.providers import MultiEndpointProvider
+from tokemak_quant_project.rpc import make_raw_request
+from tokemak_quant_project.rpc_cache import install_rpc_cache
+from tokemak_quant_project.scheduler import AdaptiveWindow, run_windows
+from tokemak_quant_project.sync import SyncManifest, sync_project
 
-maverick_filenames = [
-    MAVERICK_TOKEN_DEPOSITS_FILENAME,
-    MAVERICK_TOKEN_WITHDRAWALS_FILENAME,
-    MAVERICK_TOKEN_REPRICE_FILENAME,
-    MAVERICK_TOKEN_TRANSFER_FILENAME,
-]
+curve_filenames = [spec.filename for spec in project_events("curve")]
+maverick_filenames = [spec.filename for spec in project_events("maverick")]
 
 
 logging.basicConfig(
@@ -33,596 +49,533 @@ logging.basicConfig(
 )
 
 
+def is_log_range_error(error):
+    """
+    Tells whether a provider error asks for a smaller eth_getLogs block range.
+
+    :param error: The exception raised by web3.
+    """
+    message = str(error).lower()
+    return any(pattern.lower() in message for pattern in LOG_RANGE_ERRORS)
+
+
 class PoolDataFetcher:
     """
-    This class is responsible for fetching and processing data from a given DeFi pool contract.
+    This class is responsible for fetching and processing data from a given DeFi pool contract, or
+    from several contracts sharing the same ABI with a single address list filter.
     """
 
-    def __init__(self, web3, pool_address, abi):
+    def __init__(self, web3, pool_address, abi, multi_topic=MULTI_TOPIC_GETLOGS):
         """
         Initializes the PoolDataFetcher with a Web3 instance, pool address, and ABI.
 
         :param web3: A Web3 instance connected to an Ethereum node.
-        :param pool_address: The Ethereum address of the DeFi pool contract.
+        :param pool_address: The Ethereum address of the DeFi pool contract, or a list of addresses
+        of contracts sharing the ABI.
         :param abi: The ABI of the DeFi pool contract.
+        :param multi_topic: Fetch all the events of a contract with a single eth_getLogs request
+        instead of one request per event.
         """
         self.w3 = web3
-        self.pool_address = web3.to_checksum_address(pool_address)
+        if isinstance(pool_address, str):
+            pool_address = [pool_address]
+        self.pool_addresses = [web3.to_checksum_address(a) for a in pool_address]
+        self.pool_address = self.pool_addresses[0]
         self.abi = abi
         self.contract = web3.eth.contract(address=self.pool_address, abi=self.abi)
+        self.multi_topic = multi_topic
+        self.event_abis = {
+            entry["name"]: entry for entry in abi if entry.get("type") == "event"
+        }
 
-    def fetch_curve_token_data(self, start_block, end_block):
+    def fetch_raw_logs(self, event_names, start_block, end_block):
         """
-        Fetches all Transfer events for the contract between the specified block range.
+        Fetches several events of the contract with eth_getLogs, using a topic0 OR-list built from
+        the ABI.
 
+        In multi topic mode a single request is sent for all the events, otherwise one per event.
+
+        :param event_names: The names of the events to fetch, as defined in the ABI.
         :param start_block: The starting block number for the query.
         :param end_block: The ending block number for the query.
-        :return: A list of Transfer event data.
+        :return: A list with the raw logs of each event, in the order of event_names.
         """
-        try:
-            logging.info(f"\t\tFetching token Transfers events from Curve pool")
-            transfers = self.contract.events.Transfer.getLogs(fromBlock=start_block)
-            return transfers
+        topics = {
+            encode_hex(event_abi_to_log_topic(self.event_abis[name])): index
+            for index, name in enumerate(event_names)
+        }
+        topic_groups = [list(topics)] if self.multi_topic else [[t] for t in topics]
+
+        raw_logs = [[] for _ in event_names]
+        for topic_group in topic_groups:
+            logs = make_raw_request(
+                self.w3,
+                "eth_getLogs",
+                [
+                    {
+                        "address": (
+                            self.pool_address
+                            if len(self.pool_addresses) == 1
+                            else self.pool_addresses
+                        ),
+                        "fromBlock": hex(start_block),
+                        "toBlock": hex(end_block),
+                        "topics": [topic_group],
+                    }
+                ],
+            )
+            for log in logs:
+                raw_logs[topics[log["topics"][0].lower()]].append(log)
 
-        except Exception as e:
-            logging.error(f"Error fetching Curve token data: {e}")
+        return raw_logs
+
+    def decode_events(self, event_names, raw_logs):
+        """
+        Decodes the raw logs of several events column-wise.
+
+        :param event_names: The names of the events, as defined in the ABI.
+        :param raw_logs: A list with the raw logs of each event, in the order of event_names.
+        :return: A list with the decoded columns of each event, in the order of event_names.
+        """
+        return [
+            decode_logs(self.event_abis[name], logs)
+            for name, logs in zip(event_names, raw_logs)
+        ]
 
-    def fetch_curve_pool_data(self, start_block, end_block):
+    def get_raw_logs(self, event_names, start_block, end_block):
         """
-        Fetches various metrics from the pool contract over a specified range of blocks.
+        Fetches the raw logs of several events over the block range. When the provider rejects the
+        range for returning too many results, the range is bisected until it goes through.
 
+        :param event_names: The names of the events to fetch, as defined in the ABI.
         :param start_block: The starting block number for the query.
         :param end_block: The ending block number for the query.
-        :return: A dictionary of pool metrics such as TVL, volume, etc.
+        :return: A list with the raw logs of each event, in the order of event_names.
         """
         try:
-            logging.info(f"\t\tFetching Add liquidity events from Curve pool")
-            add_liquidity = self.contract.events.AddLiquidity.getLogs(
-                fromBlock=start_block
-            )
-
-            logging.info(f"\t\tFetching Remove liquidity events from Curve pool")
-            remove_liquidity = self.contract.events.RemoveLiquidity.getLogs(
-                fromBlock=start_block
-            )
-
-            logging.info(f"\t\tFetching Remove liquidity One events from Curve pool")
-            remove_liquidity_one = self.contract.events.RemoveLiquidityOne.getLogs(
-                fromBlock=start_block
-            )
+            return self.fetch_raw_logs(event_names, start_block, end_block)
 
+        except ValueError as e:
+            if start_block >= end_block or not is_log_range_error(e):
+                raise
+            middle_block = (start_block + end_block) // 2
+            METRICS.increment("log_range_splits")
             logging.info(
-                f"\t\tFetching Remove liquidity Imbalance events from Curve pool"
-            )
-            remove_liquidity_imbalance = (
-                self.contract.events.RemoveLiquidityImbalance.getLogs(
-                    fromBlock=start_block
-                )
+                f"\t\tRange {start_block}-{end_block} rejected by the provider, bisecting at {middle_block}"
             )
-
-            logging.info(f"\t\tFetching Token Exchange swap events from Curve pool")
-            token_exchange = self.contract.events.TokenExchange.getLogs(
-                fromBlock=start_block
-            )
-            # print(f"virtual prices: {self.contract.functions.get_virtual_price().call()}")
-            curve_contract_data = [
-                add_liquidity,
-                remove_liquidity,
-                remove_liquidity_one,
-                remove_liquidity_imbalance,
-                token_exchange,
+            lower = self.get_raw_logs(event_names, start_block, middle_block)
+            upper = self.get_raw_logs(event_names, middle_block + 1, end_block)
+            return [
+                lower_logs + upper_logs for lower_logs, upper_logs in zip(lower, upper)
             ]
-            return curve_contract_data
 
-        except Exception as e:
-            logging.error(f"Error fetching Curve pool data: {e}")
-
-    def fetch_maverick_token_data(self, start_block, end_block):
+    def get_logs(self, event_names, start_block, end_block):
         """
-        Fetches all Transfer events for the contract between the specified block range.
+        Fetches and decodes the logs of several events over the block range.
 
+        :param event_names: The names of the events to fetch, as defined in the ABI.
         :param start_block: The starting block number for the query.
         :param end_block: The ending block number for the query.
-        :return: A list of Transfer event data.
+        :return: A list with the decoded columns of each event, in the order of event_names.
         """
-        try:
-            deposits = self.contract.events.ETHDepositReceived.getLogs(
-                fromBlock=start_block
-            )
-            withdrawals = self.contract.events.ETHWithdrawn.getLogs(
-                fromBlock=start_block
-            )
-            reprice = self.contract.events.Reprice.getLogs(fromBlock=start_block)
-            transfers = self.contract.events.Transfer.getLogs(fromBlock=start_block)
-            maverick_token_data = [deposits, withdrawals, reprice, transfers]
-            return maverick_token_data
+        return self.decode_events(
+            event_names, self.get_raw_logs(event_names, start_block, end_block)
+        )
 
-        except Exception as e:
-            logging.error(f"Error fetching Maverick pool data: {e}")
 
-    def fetch_maverick_pool_data(self, start_block, end_block):
-        """
-        Fetches various metrics from the pool contract over a specified range of blocks.
+def split_by_contract(specs, raw_logs):
+    """
+    Routes the logs fetched for several contracts to the event specs of their contract.
 
-        :param start_block: The starting block number for the query.
-        :param end_block: The ending block number for the query.
-        :return: A dictionary of pool metrics such as TVL, volume, etc.
-        """
-        try:
-            pass
-        except Exception as e:
-            logging.error(f"Error fetching Maverick pool data: {e}")
+    :param specs: A list of EventSpec.
+    :param raw_logs: A dict event name -> raw logs of that event, from all the contracts.
+    :return: A list with the raw logs of each spec, in the order of specs.
+    """
+    by_contract = {}
+    for event, logs in raw_logs.items():
+        for log in logs:
+            by_contract.setdefault((log["address"].lower(), event), []).append(log)
+    return [by_contract.get((spec.contract.lower(), spec.event), []) for spec in specs]
 
 
-def fetch_and_store_curve_data(w3, start_block, current_block, query_round):
+def fetch_raw_events(w3, specs, start_block, end_block):
     """
-    Fetches and stores data for the Curve stETH/ETH pool.
+    Fetches the raw logs of the given events over the block range, the contracts sharing an ABI
+    together, without decoding nor storing them.
 
     :param w3: A Web3 instance connected to an Ethereum node.
-    :param start_block: The starting block number.
-    :param current_block: The current block number.
-    :param Sending queries to Alchemy in batches to not get rejected
+    :param specs: A list of EventSpec from the event registry.
+    :param start_block: The first block of the range (inclusive).
+    :param end_block: The last block of the range (inclusive).
+    :return: A list with the raw logs of each spec, in the order of specs.
     """
+    raw_logs_by_spec = {}
+    for contracts, abi, group_specs in group_by_abi(specs):
+        fetcher = PoolDataFetcher(w3, contracts, abi)
+        event_names = list(dict.fromkeys(spec.event for spec in group_specs))
+        raw_logs = fetcher.get_raw_logs(event_names, start_block, end_block)
+        logs_by_spec = split_by_contract(group_specs, dict(zip(event_names, raw_logs)))
+        raw_logs_by_spec.update(zip(group_specs, logs_by_spec))
+    return [raw_logs_by_spec[spec] for spec in specs]
+
+
+def store_events(
+    specs, events, start_block, end_block, batch_n, store_format=STORE_FORMAT
+):
+    """
+    Stores the decoded columns of several events: one CSV fragment per event and batch, or one
+    partition of the event store per event and block range in parquet format.
+
+    :param specs: A list of EventSpec describing the stored columns of each event.
+    :param events: A list with the decoded columns of each event, in the order of specs.
+    :param start_block: The first block of the range the events were fetched over.
+    :param end_block: The last block of the range the events were fetched over.
+    :param batch_n: Identifier number of the Alchemy batch
+    :param store_format: "csv" or "parquet".
+    """
+    for spec, columns in zip(specs, events):
+        with METRICS.stage("write") as timing:
+            if store_format == "parquet":
+                path = EventStore().write(
+                    spec, spec.to_frame(columns), start_block, end_block
+                )
+            else:
+                path = f"{spec.filename}_{batch_n}"
+                spec.to_frame(columns).to_csv(path, index=False)
+            timing["items"] = n_rows(columns)
+        METRICS.increment("rows_written", n_rows(columns), event=spec.event)
+        logging.info(f"\t\t{n_rows(columns)} {spec.event} events stored in {path}.")
 
-    curve_token_fetcher = PoolDataFetcher(
-        w3,
-        CURVE_TOKEN_ADDRESS,
-        load_abi(CURVE_TOKEN_ABI_PATH),
-    )
-
-    curve_pool_fetcher = PoolDataFetcher(
-        w3,
-        CURVE_POOL_ADDRESS,
-        load_abi(CURVE_POOL_ABI_PATH),
-    )
-
-    logging.info("\tGetting Curve steCRV token data")
-    curve_token_data = curve_token_fetcher.fetch_curve_token_data(
-        start_block, current_block
-    )
 
-    logging.info("\tGetting Curve stETH/ETH pool data")
-    curve_contract_data = curve_pool_fetcher.fetch_curve_pool_data(
-        start_block, current_block
-    )
+def decode_batch(batch):
+    """
+    Decode stage of the store pipeline.
 
-    logging.info(f"\tStoring data for Curve stETH/ETH pool for batch {query_round}")
-    store_data_curve(curve_token_data, curve_contract_data, query_round)
+    :param batch: A (specs, raw logs, start_block, end_block, batch_n) tuple, the raw logs of each
+    spec being a list or packed by pack_logs.
+    :return: The arguments of store_events.
+    """
+    specs, raw_logs, start_block, end_block, batch_n = batch
+    with METRICS.stage("decode") as timing:
+        events = [
+            decode_logs(spec.event_abi, logs) for spec, logs in zip(specs, raw_logs)
+        ]
+        timing["items"] = sum(n_rows(columns) for columns in events)
+    return specs, events, start_block, end_block, batch_n
 
 
-def fetch_and_store_maverick_data(w3, start_block, current_block, query_round):
+def write_batch(batch):
     """
-    Fetches and stores data for the Maverick swETH/ETH Pool.
+    Write stage of the store pipeline.
 
-    :param w3: A Web3 instance connected to an Ethereum node.
-    :param start_block: The starting block number.
-    :param current_block: The current block number.
+    :param batch: The arguments of store_events, as returned by decode_batch.
     """
+    store_events(*batch)
 
-    maverick_token_fetcher = PoolDataFetcher(
-        w3,
-        MAVERICK_TOKEN_ADDRESS,  # Proxy contract
-        load_abi(MAVERICK_TOKEN_ABI_PATH),  # Implementation contract ABI
-    )
-    maverick_pool_fetcher = PoolDataFetcher(
-        w3,
-        MAVERICK_POOL_ADDRESS,
-        load_abi(MAVERICK_CONTRACT_ABI_PATH),
-    )
 
-    # Fetch data for Maverick pools
-    logging.info("\tGetting Maverick swETH token data")
-    maverick_token_data = maverick_token_fetcher.fetch_maverick_token_data(
-        start_block, current_block
-    )
-    logging.info("\tGetting Maverick swETH-ETH pool data")
-    maverick_contract_data = maverick_pool_fetcher.fetch_maverick_pool_data(
-        start_block, current_block
-    )
+def process_batch(batch):
+    """
+    Decodes and writes a batch in a worker process of the store pipeline.
 
-    # Store the fetched data for later analysis
-    logging.info(f"\tStoring data for Maverick swETH/ETH pool for batch {query_round}")
-    store_data_maverick(maverick_token_data, maverick_contract_data, query_round)
+    :param batch: The input of decode_batch.
+    :return: The metrics recorded by the worker, merged into METRICS by the parent.
+    """
+    write_batch(decode_batch(batch))
+    return METRICS.collect()
 
 
-def store_data_curve(token_data, contract_data, batch_n):
+def construct_store_pipeline(queue_size=PIPELINE_QUEUE_SIZE, workers=DECODE_WORKERS):
     """
-    Stores the fetched data into a JSON file for later analysis.
+    Builds the pipeline decoding and storing the logs handed over by fetch_and_store_events, so that
+    the fetch workers move on to the next window while the current one is decoded and written.
 
-    :param token_data: Data related to the pools.
-    :param contract_data: Data related to the Curve pool contract.
-    :param identifier number of the Alchemy batch
+    Decoding, building the frames and writing them is CPU-bound, so it runs in worker processes,
+    one per available core by default. Every batch is written to its own CSV fragment or parquet
+    partition, so the output does not depend on the order the workers finish in.
+
+    :param queue_size: Maximum number of fetched batches waiting to be decoded.
+    :param workers: Number of worker processes, 1 to decode and write in threads of this process.
     """
-    if token_data is not None:
-        processed_data = []
-        # Add tokken transfers
-        for data in token_data:
-            event_data = {
-                "from": data.args._from,
-                "to": data.args._to,
-                "vaue": data.args._value,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{CURVE_TOKEN_TRANSFERS_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tData for Curve pool tokens stored in {CURVE_TOKEN_TRANSFERS_FILENAME}_{batch_n}."
-        )
-    else:
-        logging.warning(f"No data to store on {CURVE_TOKEN_TRANSFERS_FILENAME}")
-
-    if contract_data is not None:
-        ## Add Liquidity Data
-        processed_data = []
-        for data in contract_data[0]:
-            event_data = {
-                "provider": data.args.provider,
-                "token_amounts_a": data.args.token_amounts[0],
-                "token_amounts_b": data.args.token_amounts[1],
-                "fees_a": data.args.fees[0],
-                "fees_b": data.args.fees[1],
-                "invariant": data.args.invariant,
-                "token_supply": data.args.token_supply,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{CURVE_POOL_ADDLIQUIDITY_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tAdd Liquidity Data for Curve pool contract stored in {CURVE_POOL_ADDLIQUIDITY_FILENAME}_{batch_n}."
+    workers = workers or available_cpus()
+    if workers == 1:
+        return StreamingPipeline(
+            [("decode", decode_batch), ("write", write_batch)], queue_size=queue_size
         )
+    logging.info(f"Decoding and storing the fetched logs in {workers} processes")
+    return ProcessPipeline(
+        "store",
+        process_batch,
+        workers=workers,
+        queue_size=queue_size,
+        on_result=METRICS.merge,
+    )
 
-        ## Remove Liquidity Data
-        processed_data = []
-        for data in contract_data[1]:
-            event_data = {
-                "provider": data.args.provider,
-                "token_amounts_a": data.args.token_amounts[0],
-                "token_amounts_b": data.args.token_amounts[1],
-                "fees_a": data.args.fees[0],
-                "fees_b": data.args.fees[1],
-                "token_supply": data.args.token_supply,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{CURVE_POOL_REMOVELIQUIDITY_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tRemove Liquidity Data for Curve pool contract stored in {CURVE_POOL_REMOVELIQUIDITY_FILENAME}."
-        )
 
-        ## Remove Liquidity One
-        processed_data = []
-        for data in contract_data[2]:
-            event_data = {
-                "provider": data.args.provider,
-                "token_amount": data.args.token_amount,
-                "coin_amount": data.args.coin_amount,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{CURVE_POOL_REMOVELIQUIDITYONE_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tRemove Liquidity One Data for Curve pool contract stored in {CURVE_POOL_REMOVELIQUIDITYONE_FILENAME}_{batch_n}."
-        )
+def fetch_and_store_events(
+    w3, specs, start_block, current_block, query_round, pipeline=None
+):
+    """
+    Fetches the given events over the block range and stores them. The contracts sharing an ABI are
+    fetched together, with one eth_getLogs request per group of up to MAX_ADDRESSES_PER_REQUEST
+    addresses, so that the number of requests does not grow with the number of pools.
 
-        ## Remove Liquidity Imbalance
-        processed_data = []
-        for data in contract_data[3]:
-            event_data = {
-                "provider": data.args.provider,
-                "token_amounts_a": data.args.token_amounts[0],
-                "token_amounts_b": data.args.token_amounts[1],
-                "invariant": data.args.invariant,
-                "token_supply": data.args.token_supply,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{CURVE_POOL_REMOVELIQUIDITYIMBALANCE_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tRemove Liquidity Imbalance Data for Curve pool contract stored in {CURVE_POOL_REMOVELIQUIDITYIMBALANCE_FILENAME}_{batch_n}."
-        )
+    :param w3: A Web3 instance connected to an Ethereum node.
+    :param specs: A list of EventSpec from the event registry.
+    :param start_block: The starting block number.
+    :param current_block: The current block number.
+    :param query_round: Identifier number of the Alchemy batch
+    :param pipeline: An optional pipeline from construct_store_pipeline. The packed raw logs are
+    handed over to it instead of being decoded and stored before returning.
+    :return: The largest number of logs returned by a single request, used to size the next windows.
+    """
+    max_logs = 0
+    for contracts, abi, group_specs in group_by_abi(specs):
+        fetcher = PoolDataFetcher(w3, contracts, abi)
+        event_names = list(dict.fromkeys(spec.event for spec in group_specs))
+        try:
+            logging.info(
+                f"\t\tFetching {', '.join(event_names)} events from {', '.join(contracts)}"
+            )
+            with METRICS.stage("fetch") as timing:
+                raw_logs = fetcher.get_raw_logs(event_names, start_block, current_block)
+                timing["items"] = sum(len(logs) for logs in raw_logs)
+        except Exception as e:
+            logging.error(f"Error fetching events from {', '.join(contracts)}: {e}")
+            METRICS.increment("fetch_errors", abi=group_specs[0].abi_path)
+            raise
+        METRICS.increment("logs_fetched", timing["items"])
+
+        logs_by_spec = split_by_contract(group_specs, dict(zip(event_names, raw_logs)))
+        if pipeline is None:
+            write_batch(
+                decode_batch(
+                    (group_specs, logs_by_spec, start_block, current_block, query_round)
+                )
+            )
+        else:
+            # Packed, the logs are cheap to hand over to a worker process
+            batch = (
+                group_specs,
+                [
+                    pack_logs(spec.event_abi, logs)
+                    for spec, logs in zip(group_specs, logs_by_spec)
+                ],
+                start_block,
+                current_block,
+                query_round,
+            )
+            # Blocks while the decode queue is full, which bounds the logs held in memory
+            with METRICS.stage("pipeline_wait"):
+                pipeline.put(
+                    (group_specs[0].abi_path, start_block, current_block, query_round),
+                    batch,
+                )
+        max_logs = max(max_logs, timing["items"])
 
-        ## Token Exchange swaps
-        processed_data = []
-        for data in contract_data[4]:
-            event_data = {
-                "buyer": data.args.buyer,
-                "sold_id": data.args.sold_id,
-                "tokens_sold": data.args.tokens_sold,
-                "bought_id": data.args.bought_id,
-                "tokens_bought": data.args.tokens_bought,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(CURVE_POOL_TOKENSWAPS_FILENAME, index=False)
-        logging.info(
-            f"\t\tToken Exchange Swaps Data for Curve pool contract stored in {CURVE_POOL_TOKENSWAPS_FILENAME}_{batch_n}."
-        )
-    else:
-        logging.warning(f"No data to store for Curve")
+    METRICS.increment("blocks_fetched", current_block - start_block + 1)
+    return max_logs
 
 
-def store_data_maverick(token_data, contract_data, batch_n):
+def fetch_and_store_curve_data(
+    w3, start_block, current_block, query_round, pipeline=None
+):
     """
-    Stores the fetched data into a JSON file for later analysis.
+    Fetches and stores data for the Curve stETH/ETH pool.
 
-    :param token_data: Data related to the pools.
-    :param contract_data: Data related to the Curve pool contract.
+    :param w3: A Web3 instance connected to an Ethereum node.
+    :param start_block: The starting block number.
+    :param current_block: The current block number.
+    :param query_round: Identifier number of the Alchemy batch
+    :param pipeline: An optional pipeline from construct_store_pipeline.
+    :return: The largest number of logs returned by a single request, used to size the next windows.
     """
-    if token_data is not None:
-        # Add ETHDepositReceived events
-        processed_data = []
-        for data in token_data[0]:
-            event_data = {
-                "from": data.args["from"],
-                "referral": data.args.referral,
-                "amount": data.args.amount,
-                "swETHMinted": data.args.swETHMinted,
-                "newTotalETHDeposited": data.args.newTotalETHDeposited,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{MAVERICK_TOKEN_DEPOSITS_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tDeposit Data for Maverick tokens stored in {MAVERICK_TOKEN_DEPOSITS_FILENAME}_{batch_n}."
-        )
-        # Add ETHWithdrawn events
-        processed_data = []
-        for data in token_data[1]:
-            event_data = {
-                "to": data.args.to,
-                "swETHBurned": data.args.swETHBurned,
-                "ethReturned": data.args.ethReturned,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{MAVERICK_TOKEN_WITHDRAWALS_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tWithdrawal Data for Maverick tokens stored in {MAVERICK_TOKEN_WITHDRAWALS_FILENAME}_{batch_n}."
-        )
-        # Add Reprice events
-        processed_data = []
-        for data in token_data[2]:
-            event_data = {
-                "newEthReserves": data.args.newEthReserves,
-                "newSwETHToETHRate": data.args.newSwETHToETHRate,
-                "nodeOperatorRewards": data.args.nodeOperatorRewards,
-                "swellTreasuryRewards": data.args.swellTreasuryRewards,
-                "totalETHDeposited": data.args.totalETHDeposited,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{MAVERICK_TOKEN_REPRICE_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tWithdrawal Data for Maverick tokens stored in {MAVERICK_TOKEN_REPRICE_FILENAME}_{batch_n}."
-        )
-        # Add Transfer events
-        processed_data = []
-        for data in token_data[3]:
-            event_data = {
-                "from": data.args["from"],
-                "to": data.args["to"],
-                "value": data.args.value,
-                "event": data.event,
-                "logIndex": data.logIndex,
-                "transactionIndex": data.transactionIndex,
-                "transactionHash": data.transactionHash.hex(),
-                "address": data.address,
-                "blockHash": data.blockHash.hex(),
-                "blockNumber": data.blockNumber,
-            }
-            processed_data.append(event_data)
-
-        pd.DataFrame(processed_data).to_csv(
-            f"{MAVERICK_TOKEN_TRANSFER_FILENAME}_{batch_n}", index=False
-        )
-        logging.info(
-            f"\t\tWithdrawal Data for Maverick tokens stored in {MAVERICK_TOKEN_TRANSFER_FILENAME}_{batch_n}."
-        )
-    else:
-        logging.warning(f"No data to store for Maverick tokens")
+    logging.info(f"\tGetting Curve stETH/ETH pool data for batch {query_round}")
+    return fetch_and_store_events(
+        w3,
+        project_events("curve"),
+        start_block,
+        current_block,
+        query_round,
+        pipeline=pipeline,
+    )
 
-    if contract_data is not None:
-        processed_data = []
-        #### TBD ....
-    else:
-        logging.warning(f"No data to store for Maverick pool ")
+
+def fetch_and_store_maverick_data(
+    w3, start_block, current_block, query_round, pipeline=None
+):
+    """
+    Fetches and stores data for the Maverick swETH/ETH Pool.
+
+    :param w3: A Web3 instance connected to an Ethereum node.
+    :param start_block: The starting block number.
+    :param current_block: The current block number.
+    :param query_round: Identifier number of the Alchemy batch
+    :param pipeline: An optional pipeline from construct_store_pipeline.
+    :return: The largest number of logs returned by a single request, used to size the next windows.
+    """
+    logging.info(f"\tGetting Maverick swETH/ETH pool data for batch {query_round}")
+    return fetch_and_store_events(
+        w3,
+        project_events("maverick"),
+        start_block,
+        current_block,
+        query_round,
+        pipeline=pipeline,
+    )
 
 
-def getBlockDate(filenames, w3, project, merge=False, max_files=MAX_BATCH):
+def getBlockDate(filenames, w3, project, merge=False, bucket=None):
     """
      Parameters:
-    :param filenames (list of str): A list of file paths to CSV files. Each CSV file must have a 'blockNumber' column.
+    :param filenames (list of str): The consolidated CSV files of the events of the project, e.g. curve_filenames.
     :param w3(Web3): An instance of Web3 connected to an Ethereum node. This is used to fetch block timestamps.
-    :param merge: A boolean indicating if Alchemy requests have been split in 2k blocks batches
-    :param max_files: The number of files to process
+    :param merge: A boolean indicating if Alchemy requests have been split in 2k blocks batches, whose fragments <filename>_<i> are consolidated into the files
+    :param bucket: An optional TokenBucket used to rate limit the batched block requests
 
     Returns:
-    None: The function does not return any value. Instead, it updates the original CSV files and creates a new file.
+    None: The function does not return any value. Instead, it writes the consolidated files, or updates the files in place if merge is False.
 
     Note:
-    - This function can be time-consuming for a large number of unique block numbers, as it makes a network request for each block.
+    - The fragments are consolidated by consolidate.consolidate_events: each one is read once, the rows are deduplicated on (transactionHash, logIndex), sorted by (blockNumber, logIndex) and the fragments removed.
+    - Block timestamps are resolved with a BlockTimeIndex: after the merge, blocks between two anchors of the BLOCK_TIMESTAMPS_DB store without a missed slot between them are interpolated exactly, only the anchors needed to pin down the other blocks are fetched, with batched JSON-RPC requests of RPC_BATCH_SIZE blocks.
     - Ensure that the Web3 instance is correctly configured and connected to an Ethereum node.
     - The new 'block_date' column in the updated CSV files will contain the date and time of the block in 'YYYY-MM-DD HH:MM:SS' format.
 
     """
-    all_block_numbers = pd.Series(dtype=int)
-    for filename in filenames:
-        if merge:
-            for i in range(maverick):
-                try:
-                    df = pd.read_csv(f"{filename}_{i}")
-                    all_block_numbers = pd.concat(
-                        [all_block_numbers, df["blockNumber"]], ignore_index=True
-                    )
-                except Exception as e:
-                    logging.error(f"{filename}_{i} : {e}")
-        else:
-            df = pd.read_csv(filename)
-            all_block_numbers = pd.concat(
-                [all_block_numbers, df["blockNumber"]], ignore_index=True
-            )
-
-    unique_blocks = all_block_numbers.unique()
-
-    logging.info("Fetch timestamps for each unique block number")
-    block_dates = {}
-    for block_number in unique_blocks:
-        try:
-            timestamp = w3.eth.get_block(int(block_number))["timestamp"]
-            block_dates[block_number] = datetime.fromtimestamp(timestamp).strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
-        except Exception as e:
-            logging.error(
-                f"Error fetching block data for block number {block_number}: {e}"
-            )
-
-    block_date_df = pd.DataFrame(
-        list(block_dates.items()), columns=["blockNumber", "block_date"]
-    )
-    block_date_df.to_csv(f"blockNumberDates_{project}.csv", index=False)
-
-    logging.info("Storing block and date results")
-    for filename in filenames:
-        if merge:
-            for i in range(MAX_BATCH):
-                try:
-                    df = pd.read_csv(f"{filename}_{i}")
-                    df["block_date"] = df["blockNumber"].map(block_dates)
-                    df.to_csv(f"{filename}_{i}", index=False)
-                except Exception as e:
-                    logging.error(f"{filename}_{i} : {e}")
-        else:
-            df = pd.read_csv(f"{filename}_{i}")
-            df["block_date"] = df["blockNumber"].map(block_dates)
-            df.to_csv(filename, index=False)
-
-    if project == "curve":
-        filenames = curve_filenames
-    elif project == "maverick":
-        filenames = maverick_filenames
+    if merge:
+        specs = [spec for spec in project_events(project) if spec.filename in filenames]
+        consolidate_events(specs, w3, bucket=bucket)
+        return
 
-    dataframes = []
+    index = BlockTimeIndex(w3, bucket=bucket)
     for filename in filenames:
-        if merge:
-            for i in range(max_files):
-                try:
-                    df = pd.read_csv(f"{filename}_{i}")
-                    dataframes.append(df)
-                except Exception as e:
-                    print(f"File not found: {e}")
-            concatenated_df = pd.concat(dataframes, ignore_index=True)
-            concatenated_df.to_csv(filename, index=False)
+        if os.path.exists(filename):
+            date_events_file(filename, index)
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only fetch the blocks after the checkpoints of the sync manifest and append them",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Keep polling the chain head and store the events of every block once "
+        f"{FOLLOW_CONFIRMATIONS} blocks deep, until interrupted",
+    )
+    parser.add_argument(
+        "--since",
+        help="Backfill the blocks produced since this date (YYYY-MM-DD) instead of the last MAX_BATCH windows",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help=f"Print a progress line every {PROGRESS_INTERVAL} seconds",
+    )
+    args = parser.parse_args()
+
     load_dotenv()
 
-    w3 = Web3(Web3.HTTPProvider(os.getenv("PROVIDER_URL")))
+    # Every endpoint rate limits its own requests, raw and batched ones included
+    provider = MultiEndpointProvider.from_config()
+    w3 = Web3(provider)
+    w3.provider.middlewares = (
+        construct_metrics_middleware(),
+        *w3.provider.middlewares,
+    )
+    # In front of the metrics middleware, which only sees the requests reaching the node
+    rpc_cache = install_rpc_cache(w3)
+    progress = ProgressReporter(METRICS).start() if args.progress else None
+
+    def finish(message):
+        if progress is not None:
+            progress.stop()
+        METRICS.save()
+        logging.info(f"RPC cache: {rpc_cache.stats()}, endpoints: {provider.stats()}")
+        logging.info(f"Stages: {METRICS.summary()['stages']}")
+        logging.info(f"Metrics saved to {METRICS_FILENAME} and {PROMETHEUS_FILENAME}")
+        logging.info(message)
+
+    if args.follow:
+        follower = LiveFollower(
+            w3,
+            REGISTRY,
+            SyncManifest(),
+            lambda start_block, end_block: fetch_raw_events(
+                w3, REGISTRY, start_block, end_block
+            ),
+        )
+        try:
+            follower.run()
+        except KeyboardInterrupt:
+            logging.info("Stopping, the unconfirmed blocks will be fetched again")
+        follower.flush()
+        finish("DONE following the chain.")
+        return
 
     current_block = w3.eth.block_number
+    pipeline = construct_store_pipeline()
 
-    for i in range(MAX_BATCH):
-        # Alchemy accepts up to 2000 blocks per request
-        start_block = current_block - 2000
-
+    def fetch_pools_window(start_block, end_block, query_round):
         logging.info(
-            f"Getting data for Curve stETH/ETH pool - Block {start_block} to {current_block} - Run {i}"
+            f"Getting data for {len(POOLS)} pools - Block {start_block} to {end_block} - Run {query_round}"
         )
-        fetch_and_store_curve_data(w3, start_block, current_block, i)
-
-        logging.info(
-            f"Getting data for Maverick swETH/ETH pool - Block {start_block} to {current_block} - Run {i}"
+        # A single job, so that the contracts of every project sharing an ABI share requests
+        return fetch_and_store_events(
+            w3, REGISTRY, start_block, end_block, query_round, pipeline=pipeline
         )
-        fetch_and_store_maverick_data(w3, start_block, current_block, i)
 
-        current_block = start_block
-        time.sleep(5)
+    if args.sync:
+        sync_project(
+            fetch_pools_window,
+            REGISTRY,
+            SyncManifest(),
+            w3,
+            current_block,
+            pipeline=pipeline,
+        )
+        pipeline.close()
+        finish("DONE syncing data.")
+        return
+
+    start_block = current_block - MAX_BATCH * BLOCK_WINDOW + 1
+    if args.since:
+        since = datetime.strptime(args.since, "%Y-%m-%d").timestamp()
+        block_range = BlockTimeIndex(w3).block_range(
+            int(since), w3.eth.get_block(current_block)["timestamp"]
+        )
+        if block_range is None:
+            parser.error(f"no block was produced since {args.since}")
+        start_block, _ = block_range
+    sizer = AdaptiveWindow()
+    windows = sizer.split(start_block, current_block)
+    METRICS.set("blocks_total", current_block - start_block + 1)
+
+    failed = run_windows(
+        [fetch_pools_window],
+        windows,
+        max_workers=MAX_WORKERS,
+        sizer=sizer,
+    )
+    failed += pipeline.close()
+    if failed:
+        logging.error(f"{len(failed)} windows could not be fetched: {failed}")
 
     logging.info("Getting corresponding dates for all blocks stored")
-    getBlockDate(curve_filenames, w3, "Curve", merge=True)
-    getBlockDate(maverick_filenames, w3, "Maverick", merge=True)
+    if STORE_FORMAT == "parquet":
+        # The store keeps raw events, dates are looked up from the block timestamp store
+        store = EventStore()
+        for pool in dict.fromkeys(spec.pool for spec in REGISTRY):
+            BlockTimeIndex(w3).timestamps(store.block_numbers(pool))
+        finish("DONE fetching data.")
+        return
+
+    consolidate_events(REGISTRY, w3)
 
-    logging.info("DONE fetching data.")
+    finish("DONE fetching data.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,354 @@
+"""
+Follow mode: polls the chain head every few seconds and fetches the events of the new blocks.
+
+The blocks less than FOLLOW_CONFIRMATIONS deep are kept in memory with their hash. When the parent
+hash of a new block, or the block hash of a fetched log, no longer matches the buffered hashes, the
+chain was reorganized: the buffered blocks past the fork are dropped and fetched again. The events
+of a block are appended to the stored events, and the checkpoints of the sync manifest moved, only
+once the block is confirmed, so the stored data never holds rolled back logs. With the event store,
+the confirmed events are written every FOLLOW_FLUSH_BLOCKS blocks, so that the partitions do not
+hold a single poll each.
+"""
+
+import logging
+import threading
+
+import pandas as pd
+
+from config import *
+from tokemak_quant_project.block_index import BlockTimeIndex
+from tokemak_quant_project.decoder import decode_logs
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.metrics import METRICS
+from tokemak_quant_project.rpc import batch_request
+from tokemak_quant_project.sync import append_frame, bootstrap_checkpoints
+
+
+class ReorgDetected(Exception):
+    """
+    Raised when the buffered blocks no longer belong to the canonical chain.
+    """
+
+
+def _block_number(log):
+    return int(log["blockNumber"], 16)
+
+
+class LiveFollower:
+    """
+    Tails the chain head, buffering the events of the unconfirmed blocks and appending those of the
+    confirmed ones to the CSV files or the event store, like the --sync mode does.
+    """
+
+    def __init__(
+        self,
+        w3,
+        targets,
+        manifest,
+        fetch,
+        confirmations=FOLLOW_CONFIRMATIONS,
+        poll_interval=FOLLOW_POLL_INTERVAL,
+        max_blocks=BLOCK_WINDOW,
+        bucket=None,
+        flush_blocks=FOLLOW_FLUSH_BLOCKS,
+    ):
+        """
+        :param w3: A Web3 instance connected to an Ethereum node.
+        :param targets: A list of EventSpec.
+        :param manifest: The SyncManifest holding the checkpoints, moved as blocks are confirmed.
+        :param fetch: A callable fetch(start_block, end_block) returning the raw logs of each
+        target, in the order of targets, e.g. built on fetch_pool_data.fetch_raw_events.
+        :param confirmations: Blocks a block must be buried under before its events are stored.
+        :param poll_interval: Seconds between two polls once the follower caught up with the head.
+        :param max_blocks: Maximum number of blocks fetched per poll, when catching up.
+        :param bucket: An optional TokenBucket used to rate limit the block requests.
+        :param flush_blocks: Confirmed blocks buffered before their events are written to the event
+        store, as one partition per event.
+        """
+        self.w3 = w3
+        self.targets = targets
+        self.manifest = manifest
+        self.fetch = fetch
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.max_blocks = max_blocks
+        self.bucket = bucket
+        self.flush_blocks = flush_blocks
+        self.stopped = threading.Event()
+        # Kept for the whole run, rather than reloading its anchors at every poll
+        self.index = BlockTimeIndex(w3, bucket=bucket)
+
+        # Last stored block and its hash, and last fetched block
+        self.final_block = None
+        self.final_hash = None
+        self.tip = None
+        # Block number -> (hash, timestamp) of the fetched blocks not stored yet
+        self.blocks = {}
+        # The raw logs of the blocks not stored yet, for each target
+        self.logs = [[] for _ in targets]
+        # Last block written to the event store, and the frames of the confirmed events buffered
+        # since then for each target
+        self.written_block = None
+        self.unwritten = [[] for _ in targets]
+
+    def _start(self, head):
+        bootstrap_checkpoints(self.manifest, self.targets)
+        checkpoints = [
+            self.manifest.get(spec.contract, spec.event) for spec in self.targets
+        ]
+        # Events never stored before are followed from the current head, run a backfill for the past
+        self.final_block = min(
+            head - self.confirmations if checkpoint is None else checkpoint
+            for checkpoint in checkpoints
+        )
+        self.tip = self.final_block
+        self.written_block = self.final_block
+        if STORE_FORMAT == "parquet":
+            # Partitions past a checkpoint were left by an interrupted flush and are fetched again
+            for spec, checkpoint in zip(self.targets, checkpoints):
+                if checkpoint is not None:
+                    EventStore().drop_after(spec.pool, spec.event, checkpoint)
+        logging.info(
+            f"Following the chain from block {self.final_block + 1}, storing blocks "
+            f"{self.confirmations} blocks deep"
+        )
+
+    def _headers(self, block_numbers):
+        """
+        :return: A dict block number -> block of the given blocks, without their transactions.
+        """
+        blocks = batch_request(
+            self.w3,
+            "eth_getBlockByNumber",
+            [[hex(block), False] for block in block_numbers],
+            bucket=self.bucket,
+        )
+        if any(block is None for block in blocks):
+            # The node serving the request is behind the one which gave the head
+            raise ValueError("Block not found on the node, retrying")
+        return {int(block["number"], 16): block for block in blocks}
+
+    def poll(self):
+        """
+        Fetches the blocks after the last fetched one, up to the head or max_blocks blocks, then
+        stores the events of the blocks now confirmed.
+
+        :return: The number of blocks the follower is still behind the head.
+        """
+        head = self.w3.eth.block_number
+        if self.tip is None:
+            self._start(head)
+        if head <= self.tip:
+            return 0
+
+        start_block = self.tip + 1
+        end_block = min(head, self.tip + self.max_blocks)
+        # Only the blocks that may still be rolled back are tracked
+        first_tracked = max(start_block, head - self.confirmations + 1)
+        headers = {}
+        if first_tracked <= end_block:
+            headers = self._headers(range(first_tracked, end_block + 1))
+            parent_hash = self._hash(first_tracked - 1)
+            for block in range(first_tracked, end_block + 1):
+                if (
+                    parent_hash is not None
+                    and headers[block]["parentHash"] != parent_hash
+                ):
+                    raise ReorgDetected(f"Block {block} has a new parent")
+                parent_hash = headers[block]["hash"]
+
+        logs = self.fetch(start_block, end_block)
+        for spec_logs in logs:
+            for log in spec_logs:
+                header = headers.get(_block_number(log))
+                if header is not None and log["blockHash"] != header["hash"]:
+                    raise ReorgDetected(
+                        f"Log of block {_block_number(log)} from another fork"
+                    )
+
+        for block, header in headers.items():
+            self.blocks[block] = (header["hash"], int(header["timestamp"], 16))
+        for buffered, spec_logs in zip(self.logs, logs):
+            buffered.extend(spec_logs)
+        self.tip = end_block
+        METRICS.increment("blocks_fetched", end_block - start_block + 1)
+        METRICS.increment("logs_fetched", sum(len(spec_logs) for spec_logs in logs))
+        METRICS.set("follow_head", head)
+
+        self._store(min(self.tip, head - self.confirmations))
+        return head - self.tip
+
+    def _hash(self, block):
+        """
+        :return: The hash of a buffered block or of the last stored block, None if it is unknown.
+        """
+        if block in self.blocks:
+            return self.blocks[block][0]
+        if block == self.final_block:
+            return self.final_hash
+        return None
+
+    def rewind(self):
+        """
+        Finds the last buffered block still on the canonical chain, and drops the blocks and logs
+        after it so that the next poll fetches them again.
+        """
+        numbers = sorted(self.blocks)
+        if self.final_hash is not None:
+            numbers.insert(0, self.final_block)
+        headers = self._headers(numbers) if numbers else {}
+
+        fork = self.final_block
+        if self.final_hash is not None and (
+            headers[self.final_block]["hash"] != self.final_hash
+        ):
+            # The stored events cannot be rolled back, only the buffered ones are dropped
+            logging.error(
+                f"Reorg deeper than {self.confirmations} confirmations, the events stored up "
+                f"to block {self.final_block} may include rolled back logs"
+            )
+            METRICS.increment("deep_reorgs")
+            self.final_hash = headers[self.final_block]["hash"]
+        else:
+            for block in sorted(self.blocks):
+                if headers[block]["hash"] != self.blocks[block][0]:
+                    break
+                fork = block
+
+        dropped = [block for block in self.blocks if block > fork]
+        for block in dropped:
+            del self.blocks[block]
+        self.logs = [
+            [log for log in spec_logs if _block_number(log) <= fork]
+            for spec_logs in self.logs
+        ]
+        self.tip = fork
+        METRICS.increment("reorgs")
+        logging.warning(
+            f"Chain reorganized after block {fork}, dropped {len(dropped)} unconfirmed blocks"
+        )
+
+    def _store(self, final_block):
+        """
+        Stores the events of the blocks up to final_block and moves the checkpoints there. With the
+        event store, the events are buffered until flush_blocks blocks are confirmed.
+        """
+        if final_block <= self.final_block:
+            return
+        # The headers fetched to track the reorgs give the dates of the confirmed blocks
+        timestamps = {
+            block: timestamp
+            for block, (_, timestamp) in self.blocks.items()
+            if block <= final_block
+        }
+        self.index.cache.put(timestamps)
+        self.index.add_anchors(timestamps)
+
+        for i, spec in enumerate(self.targets):
+            confirmed = [
+                log for log in self.logs[i] if _block_number(log) <= final_block
+            ]
+            self.logs[i] = self.logs[i][len(confirmed) :]
+            checkpoint = self.manifest.get(spec.contract, spec.event)
+            if checkpoint is not None:
+                confirmed = [
+                    log for log in confirmed if _block_number(log) > checkpoint
+                ]
+            if confirmed:
+                frame = spec.to_frame(decode_logs(spec.event_abi, confirmed))
+                if STORE_FORMAT == "parquet":
+                    self.unwritten[i].append(frame)
+                else:
+                    append_frame(spec, frame, self.index)
+                    METRICS.increment("rows_written", len(frame), event=spec.event)
+            if STORE_FORMAT != "parquet" and (
+                checkpoint is None or checkpoint < final_block
+            ):
+                self.manifest.set(spec.contract, spec.event, final_block)
+        if STORE_FORMAT != "parquet":
+            self.manifest.save()
+
+        self.final_hash = self._hash(final_block)
+        for block in [block for block in self.blocks if block <= final_block]:
+            del self.blocks[block]
+        self.final_block = final_block
+        METRICS.set("follow_stored_block", final_block)
+
+        if (
+            STORE_FORMAT == "parquet"
+            and final_block - self.written_block >= self.flush_blocks
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the confirmed events buffered for the event store, as one partition per event from
+        the last written block to the last confirmed block, and moves the checkpoints there.
+        """
+        if self.written_block is None or self.final_block <= self.written_block:
+            return
+        stored_blocks = set()
+        for i, spec in enumerate(self.targets):
+            if self.unwritten[i]:
+                frame = pd.concat(self.unwritten[i], ignore_index=True)
+                EventStore().write(
+                    spec, frame, self.written_block + 1, self.final_block
+                )
+                stored_blocks.update(frame["blockNumber"].tolist())
+                METRICS.increment("rows_written", len(frame), event=spec.event)
+                self.unwritten[i] = []
+            checkpoint = self.manifest.get(spec.contract, spec.event)
+            if checkpoint is None or checkpoint < self.final_block:
+                self.manifest.set(spec.contract, spec.event, self.final_block)
+        if stored_blocks:
+            # The event store keeps no dates, they are looked up in the block timestamp store
+            self.index.timestamps(sorted(stored_blocks))
+        self.manifest.save()
+        self.written_block = self.final_block
+        logging.info(f"Wrote the events up to block {self.final_block} to the store")
+
+    def pending(self):
+        """
+        :return: A dict EventSpec -> DataFrame of the events not stored yet, e.g. to show the latest
+        activity on a dashboard: those of the unconfirmed blocks, after those of the confirmed
+        blocks buffered for the event store.
+        """
+        return {
+            spec: pd.concat(
+                unwritten + [spec.to_frame(decode_logs(spec.event_abi, spec_logs))],
+                ignore_index=True,
+            )
+            for spec, unwritten, spec_logs in zip(
+                self.targets, self.unwritten, self.logs
+            )
+        }
+
+    def step(self):
+        """
+        Polls the head once, rewinding the buffered blocks when a reorg is detected.
+
+        :return: The number of blocks the follower is still behind the head.
+        """
+        try:
+            return self.poll()
+        except ReorgDetected as e:
+            logging.warning(f"{e}, rewinding")
+            self.rewind()
+            return 1
+
+    def run(self):
+        """
+        Polls the head until stop is called, without waiting while catching up.
+        """
+        while not self.stopped.is_set():
+            try:
+                behind = self.step()
+            except Exception as e:
+                logging.error(f"Follow poll failed, retrying: {e}")
+                METRICS.increment("follow_errors")
+                behind = 0
+            if not behind:
+                self.stopped.wait(self.poll_interval)
+
+    def stop(self):
+        self.stopped.set()
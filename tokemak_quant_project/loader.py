@@ -0,0 +1,312 @@
+"""
+Typed loading of the stored events for the analysis notebooks.
+
+load_events returns the events of a pool already typed: amounts as floats in token units, block
+dates as datetimes, and only the requested columns and block or date range. Parsing a consolidated
+CSV file is done once: the typed table is cached as an uncompressed Arrow IPC file, invalidated when
+the CSV file changes, and later loads memory-map it instead of parsing the CSV again.
+"""
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+
+from config import *
+from tokemak_quant_project.analytics import to_units
+from tokemak_quant_project.block_index import BlockTimeIndex, date_bounds
+from tokemak_quant_project.decoder import parse_static_type
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.events import REGISTRY
+
+# Bumped when the typing of the cached tables changes, to invalidate the caches already written
+CACHE_VERSION = b"1"
+
+# String columns stay in the Arrow buffers instead of becoming one Python object per value
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+
+def find_spec(pool, event, registry=REGISTRY):
+    """
+    :param pool: A project, e.g. curve, or the name of a POOLS entry, e.g. curve_steth_pool.
+    :param event: The name of the event.
+    :return: The EventSpec of the event.
+    """
+    specs = [
+        spec
+        for spec in registry
+        if pool in (spec.pool, spec.project) and spec.event == event
+    ]
+    if not specs:
+        raise ValueError(f"No {event} event stored for {pool}")
+    if len(specs) > 1:
+        raise ValueError(
+            f"Several pools of {pool} emit {event}, use one of "
+            f"{', '.join(spec.pool for spec in specs)}"
+        )
+    return specs[0]
+
+
+def column_types(spec):
+    """
+    Maps the stored columns of an event to the Arrow type they are loaded as. Unsigned integers
+    wider than 64 bits are token amounts, loaded as floats; narrower integers, and the wider signed
+    integers such as the int128 coin indexes of Curve, as int64.
+
+    :param spec: An EventSpec from the event registry.
+    :return: A dict column -> Arrow type, and the list of amount columns.
+    """
+    abi_types = {
+        entry["name"]: parse_static_type(entry["type"])[0]
+        for entry in spec.event_abi["inputs"]
+    }
+    types = {}
+    amounts = []
+    for column, argument, _ in spec.fields:
+        abi_type = abi_types[argument]
+        if abi_type == "bool":
+            types[column] = pa.bool_()
+        elif abi_type.startswith(("uint", "int")):
+            signed = abi_type.startswith("int")
+            bits = int(abi_type[3 if signed else 4 :] or 256)
+            if bits > 64 and not signed:
+                types[column] = pa.float64()
+                amounts.append(column)
+            else:
+                types[column] = pa.int64()
+        else:
+            types[column] = pa.string()
+    types.update(
+        {
+            "event": pa.string(),
+            "logIndex": pa.int64(),
+            "transactionIndex": pa.int64(),
+            "transactionHash": pa.string(),
+            "address": pa.string(),
+            "blockHash": pa.string(),
+            "blockNumber": pa.int64(),
+            "block_date": pa.timestamp("ns"),
+        }
+    )
+    return types, amounts
+
+
+def cache_path(filename, cache_dir=LOADER_CACHE_DIR):
+    """
+    :return: The path of the cached table of a CSV file.
+    """
+    key = hashlib.sha256(os.path.abspath(filename).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(filename)}.{key}.arrow")
+
+
+def _source_metadata(filename):
+    stat = os.stat(filename)
+    return {
+        b"source": os.path.abspath(filename).encode("utf-8"),
+        b"mtime_ns": str(stat.st_mtime_ns).encode("utf-8"),
+        b"size": str(stat.st_size).encode("utf-8"),
+        b"version": CACHE_VERSION,
+    }
+
+
+def _read_cache(path, metadata):
+    """
+    :return: The memory-mapped table of a cache file, or None if it is missing or stale.
+    """
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    if reader.schema.metadata != metadata:
+        return None
+    return reader.read_all()
+
+
+def parse_csv(spec, filename=None):
+    """
+    Parses the consolidated CSV file of an event into a typed Arrow table, sorted by
+    (blockNumber, logIndex).
+
+    :param spec: The EventSpec of the event.
+    :param filename: The CSV file, spec.filename by default.
+    """
+    filename = filename or spec.filename
+    types, _ = column_types(spec)
+    table = pv.read_csv(filename, convert_options=pv.ConvertOptions(column_types=types))
+    return table.sort_by([("blockNumber", "ascending"), ("logIndex", "ascending")])
+
+
+def cached_table(spec, filename=None, cache_dir=LOADER_CACHE_DIR):
+    """
+    Returns the typed table of a CSV file, memory-mapped from its cache when the cache was written
+    from the current version of the file, parsed and cached again otherwise.
+
+    :param spec: The EventSpec of the event.
+    :param filename: The CSV file, spec.filename by default.
+    :param cache_dir: The directory of the cached tables.
+    """
+    filename = filename or spec.filename
+    path = cache_path(filename, cache_dir)
+    metadata = _source_metadata(filename)
+    table = _read_cache(path, metadata)
+    if table is not None:
+        return table
+
+    table = parse_csv(spec, filename).combine_chunks()
+    table = table.replace_schema_metadata(metadata)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Uncompressed, so that the cache is memory-mapped without copying the buffers
+    with pa.OSFile(f"{path}.tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(f"{path}.tmp", path)
+    logging.info(f"Cached {table.num_rows} {spec.event} rows of {filename} in {path}")
+    return _read_cache(path, metadata)
+
+
+def _slice(table, column, start, end):
+    """
+    Slices a table sorted by column to the rows with start <= column <= end, without copying.
+    """
+    values = table.column(column).to_numpy()
+    first = 0 if start is None else np.searchsorted(values, start, side="left")
+    last = len(values) if end is None else np.searchsorted(values, end, side="right")
+    return table.slice(first, max(last - first, 0))
+
+
+def _stored_dates_index(spec):
+    """
+    :return: The BlockTimeIndex of the stored anchors, dating the events of a file stored without
+    'block_date' column.
+    """
+    index = BlockTimeIndex()
+    if not len(index):
+        raise ValueError(
+            f"{spec.filename} has no block_date column, and the block timestamp store has no "
+            f"anchors to date its blocks: consolidate the events again to add their dates"
+        )
+    return index
+
+
+def _read_csv_events(spec, columns, blocks, dates, cache_dir):
+    table = cached_table(spec, cache_dir=cache_dir)
+    dated = "block_date" in table.schema.names
+    if blocks is not None:
+        table = _slice(table, "blockNumber", *blocks)
+    if dates is not None:
+        if dated:
+            start, end = (bound.to_datetime64() for bound in date_bounds(*dates))
+            table = _slice(table, "block_date", start, end)
+        else:
+            date_blocks = _stored_dates_index(spec).date_block_range(*dates)
+            if date_blocks is None:
+                table = table.slice(0, 0)
+            else:
+                table = _slice(table, "blockNumber", *date_blocks)
+
+    add_dates = (
+        not dated
+        and columns is not None
+        and bool({"block_date", "date"} & set(columns))
+    )
+    if columns is not None:
+        read_columns = [column for column in columns if column in table.schema.names]
+        if "date" in columns and dated and "block_date" not in read_columns:
+            read_columns.append("block_date")
+        if add_dates and "blockNumber" not in read_columns:
+            read_columns.append("blockNumber")
+        table = table.select(read_columns)
+    df = table.to_pandas(
+        types_mapper={pa.string(): STRING_DTYPE}.get, split_blocks=True
+    )
+    if add_dates:
+        df["block_date"] = pd.to_datetime(
+            _stored_dates_index(spec).dates(df["blockNumber"].to_numpy())
+        )
+    return df
+
+
+def _read_store_events(spec, columns, blocks, dates, compact):
+    read_columns = None
+    if columns is not None:
+        read_columns = [
+            column for column in columns if column not in ("block_date", "date")
+        ]
+        read_columns = list(dict.fromkeys(read_columns + ["blockNumber"]))
+    df = EventStore().read(
+        spec.pool,
+        spec.event,
+        columns=read_columns,
+        blocks=blocks,
+        dates=dates,
+        compact=compact,
+    )
+    if "blockNumber" not in df:
+        # Nothing stored for the event
+        return pd.DataFrame(columns=columns or spec.columns + ["block_date"])
+
+    types, _ = column_types(spec)
+    for column in df.columns:
+        if types.get(column) == pa.float64():
+            df[column] = np.asarray(df[column], dtype=float)
+        elif types.get(column) == pa.int64():
+            df[column] = np.asarray(df[column], dtype=np.int64)
+    if columns is None or {"block_date", "date"} & set(columns):
+        # The event store keeps no dates, they come from the anchors of the block timestamp store
+        df["block_date"] = pd.to_datetime(
+            BlockTimeIndex().dates(df["blockNumber"].to_numpy())
+        )
+    return df
+
+
+def load_events(
+    pool,
+    event,
+    columns=None,
+    blocks=None,
+    dates=None,
+    decimals=TOKEN_DECIMALS,
+    store_format=STORE_FORMAT,
+    compact=False,
+    cache_dir=LOADER_CACHE_DIR,
+):
+    """
+    Loads the stored events of a pool, typed for analysis: token amounts (uint256 columns) as floats
+    divided by 10**decimals, block_date as datetime64 with a 'date' column holding its day, indexes
+    and block numbers as int64, and the strings of the CSV files Arrow-backed.
+
+    The consolidated CSV file is parsed once and cached under cache_dir; later loads memory-map the
+    cache and only convert the requested columns and rows. Parquet partitions are already typed and
+    read directly, opening only the partitions and columns needed.
+
+    :param pool: A project, e.g. maverick, or the name of a POOLS entry when several pools of the
+    project emit the event, e.g. curve_steth_pool.
+    :param event: The name of the event, e.g. ETHDepositReceived.
+    :param columns: An optional list of columns to load, 'date' included.
+    :param blocks: An optional (start_block, end_block) tuple, both inclusive.
+    :param dates: An optional (start, end) tuple of dates or datetimes, both inclusive. An end given
+    as a day, e.g. "2023-06-30", covers the whole day. Events stored without dates are dated with
+    the anchors of the block timestamp store.
+    :param decimals: The decimals of the token amounts, None to keep them unscaled.
+    :param store_format: "csv" to read the consolidated CSV files, "parquet" to read the event store.
+    :param compact: For the event store, keep hashes as binary and addresses as ids, see EventStore.read.
+    :param cache_dir: The directory of the cached tables of the CSV files.
+    :return: A DataFrame sorted by (blockNumber, logIndex).
+    """
+    spec = find_spec(pool, event)
+    if store_format == "parquet":
+        df = _read_store_events(spec, columns, blocks, dates, compact)
+    else:
+        df = _read_csv_events(spec, columns, blocks, dates, cache_dir)
+
+    if decimals is not None:
+        for column in column_types(spec)[1]:
+            if column in df:
+                df[column] = to_units(df[column], decimals)
+    if "block_date" in df and (columns is None or "date" in columns):
+        df["date"] = df["block_date"].dt.normalize()
+    return df[columns] if columns is not None else df
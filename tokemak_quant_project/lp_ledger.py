@@ -0,0 +1,493 @@
+"""
+Per-LP position ledger of the Curve stETH/ETH pool: the steCRV balance of every holder over time,
+its cost basis, the fees it earned and its total return.
+
+Every transfer of the LP token gives one ledger row per holder it moves tokens for. The rows are
+sorted once by (holder, blockNumber, logIndex) over integer address ids, so that the balances, costs,
+proceeds and fee income of all the holders are cumulative sums and bincounts over sorted arrays
+rather than a Python loop per address.
+
+Values are in ETH. LP tokens are marked at the virtual price of the pool (invariant / token_supply,
+as logged by AddLiquidity and RemoveLiquidityImbalance), stETH at the price of the last swap.
+
+The balances only add up from the deployment of the token. When the transfers start later, e.g. on
+the stored data, the tokens held before the first transfer must be given as opening balances (see
+opening_balances), or the holders selling them end up with negative balances.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from config import *
+from tokemak_quant_project.analytics import swap_prices
+from tokemak_quant_project.loader import load_events
+from tokemak_quant_project.state_sampler import StateSampler, ViewCall
+from utilities import load_abi
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# The value argument of the LP token Transfer events is stored under this (misspelled) column
+CURVE_TRANSFER_VALUE_COLUMN = "vaue"
+
+# Balances left under this many LP tokens by float rounding are considered empty
+BALANCE_DUST = 1e-9
+
+# Kinds of the ledger rows, OPENING being the balance held before the first transfer
+MINT, BURN, TRANSFER_IN, TRANSFER_OUT, OPENING = range(5)
+KIND_NAMES = ["mint", "burn", "in", "out", "open"]
+
+
+def asof(blocks, values, at, default=np.nan):
+    """
+    Looks up a series at given blocks.
+
+    :param blocks: The sorted blocks of the series.
+    :param values: The values of the series, aligned with blocks.
+    :param at: An array of blocks.
+    :return: The value of the last point at or before each block of at, default before the first.
+    """
+    at = np.asarray(at)
+    if not len(blocks):
+        return np.full(at.shape, default, dtype=float)
+    i = np.searchsorted(blocks, at, side="right") - 1
+    return np.where(i >= 0, values[np.clip(i, 0, None)], default)
+
+
+def _series(blocks, values):
+    """
+    :return: The blocks and values sorted by block, without the missing values.
+    """
+    blocks = np.asarray(blocks, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    keep = ~np.isnan(values)
+    order = np.argsort(blocks[keep], kind="stable")
+    return blocks[keep][order], values[keep][order]
+
+
+def virtual_prices(liquidity_events):
+    """
+    Virtual price of the pool (ETH value of one LP token) after the events logging the invariant.
+
+    :param liquidity_events: AddLiquidity and RemoveLiquidityImbalance events, with invariant and
+    token_supply columns.
+    :return: The sorted blocks and the virtual prices.
+    """
+    events = pd.concat(
+        [df[["blockNumber", "invariant", "token_supply"]] for df in liquidity_events],
+        ignore_index=True,
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prices = np.asarray(events["invariant"], dtype=float) / np.asarray(
+            events["token_supply"], dtype=float
+        )
+    prices[~np.isfinite(prices)] = np.nan
+    return _series(events["blockNumber"], prices)
+
+
+def _per_transaction(hashes, values):
+    """
+    :return: A Series transactionHash -> sum of values.
+    """
+    return (
+        pd.Series(np.asarray(values, dtype=float), index=np.asarray(hashes))
+        .groupby(level=0)
+        .sum()
+    )
+
+
+def opening_balances(w3, transfers, bucket=None):
+    """
+    Reads the LP token balance of every address of the transfers before the first of them, with
+    balanceOf calls batched and cached by a StateSampler.
+
+    :param w3: A Web3 instance connected to an archive node over HTTP.
+    :param transfers: The Transfer events of the LP token, as returned by loader.load_events.
+    :param bucket: Optional TokenBucket used to rate limit the requests.
+    :return: A Series address -> LP balance in token units, for the addresses with a balance.
+    """
+    if not len(transfers):
+        return pd.Series(dtype=float)
+    block = int(transfers["blockNumber"].min()) - 1
+    addresses = pd.unique(
+        np.concatenate(
+            [
+                np.asarray(transfers["from"], dtype=object),
+                np.asarray(transfers["to"], dtype=object),
+            ]
+        )
+    )
+    addresses = [address for address in addresses if address != ZERO_ADDRESS]
+    abi = load_abi(CURVE_TOKEN_ABI_PATH)
+    calls = [
+        ViewCall(address, CURVE_TOKEN_ADDRESS, abi, "balanceOf", [address])
+        for address in addresses
+    ]
+    row = StateSampler(w3, calls, bucket=bucket).sample([block]).iloc[0]
+    balances = pd.Series(
+        [(value or 0) / 10**TOKEN_DECIMALS for value in row], index=addresses
+    )
+    return balances[balances > 0]
+
+
+class CurveLPLedger:
+    """
+    Ledger of the LP token movements of every holder, valued with the coins deposited or withdrawn
+    in the same transaction for mints and burns, and at the virtual price for transfers.
+    """
+
+    def __init__(
+        self,
+        transfers,
+        add_liquidity,
+        remove_liquidity,
+        remove_liquidity_one,
+        remove_liquidity_imbalance,
+        swaps=None,
+        opening=None,
+    ):
+        """
+        All the events are typed as returned by loader.load_events, amounts in token units.
+
+        :param transfers: The Transfer events of the LP token.
+        :param add_liquidity: The AddLiquidity events of the pool.
+        :param remove_liquidity: The RemoveLiquidity events of the pool.
+        :param remove_liquidity_one: The RemoveLiquidityOne events of the pool.
+        :param remove_liquidity_imbalance: The RemoveLiquidityImbalance events of the pool.
+        :param swaps: The optional TokenExchange events of the pool, pricing stETH. stETH is valued
+        at par without them.
+        :param opening: An optional Series address -> LP balance held before the first transfer,
+        see opening_balances. The opening balances are bought at the virtual price of the block
+        before the first transfer.
+        """
+        self.vp_blocks, self.vp = virtual_prices(
+            [add_liquidity, remove_liquidity_imbalance]
+        )
+        # Total supply of the LP token logged by the pool, anchoring the supply rebuilt from the
+        # mints and burns when the transfers do not start at the deployment of the token
+        supply_events = pd.concat(
+            [
+                df[["blockNumber", "logIndex", "token_supply"]]
+                for df in (add_liquidity, remove_liquidity, remove_liquidity_imbalance)
+            ],
+            ignore_index=True,
+        ).sort_values(["blockNumber", "logIndex"])
+        self.supply_anchor = None
+        if len(supply_events):
+            first = supply_events.iloc[0]
+            self.supply_anchor = (
+                int(first["blockNumber"]),
+                int(first["logIndex"]),
+                float(first["token_supply"]),
+            )
+        self.price_blocks, self.prices = _series([], [])
+        if swaps is not None and len(swaps):
+            self.price_blocks, self.prices = _series(
+                swaps["blockNumber"], swap_prices(swaps)
+            )
+
+        self._build(transfers, opening)
+        self._value_flows(
+            add_liquidity,
+            remove_liquidity,
+            remove_liquidity_one,
+            remove_liquidity_imbalance,
+        )
+
+    @classmethod
+    def load(cls, blocks=None, store_format=STORE_FORMAT, w3=None):
+        """
+        Builds the ledger from the stored events.
+
+        :param blocks: An optional (start_block, end_block) tuple.
+        :param store_format: "csv" or "parquet", see loader.load_events.
+        :param w3: An optional Web3 instance connected to an archive node, reading the opening
+        balances. Without it, the balances only add up if the transfers start at the deployment of
+        the LP token.
+        """
+
+        def load(pool, event):
+            return load_events(pool, event, blocks=blocks, store_format=store_format)
+
+        transfers = load("curve_steth_lp_token", "Transfer")
+        return cls(
+            transfers,
+            load("curve_steth_pool", "AddLiquidity"),
+            load("curve_steth_pool", "RemoveLiquidity"),
+            load("curve_steth_pool", "RemoveLiquidityOne"),
+            load("curve_steth_pool", "RemoveLiquidityImbalance"),
+            load("curve_steth_pool", "TokenExchange"),
+            opening_balances(w3, transfers) if w3 is not None else None,
+        )
+
+    def _build(self, transfers, opening=None):
+        """
+        Splits the transfers into one row per holder, sorted by (holder, blockNumber, logIndex),
+        with the balance of the holder after each row. The opening balances are rows of the block
+        before the first transfer.
+        """
+        n = len(transfers)
+        values = np.asarray(transfers[CURVE_TRANSFER_VALUE_COLUMN], dtype=float)
+        # Receivers then senders, interned once so that the rest only compares integer ids
+        ids, addresses = pd.factorize(
+            np.concatenate(
+                [
+                    np.asarray(transfers["to"], dtype=object),
+                    np.asarray(transfers["from"], dtype=object),
+                ]
+            )
+        )
+        zero = np.flatnonzero(np.asarray(addresses, dtype=object) == ZERO_ADDRESS)
+        zero = zero[0] if len(zero) else -1
+        kinds = np.concatenate(
+            [
+                np.where(ids[n:] == zero, MINT, TRANSFER_IN),
+                np.where(ids[:n] == zero, BURN, TRANSFER_OUT),
+            ]
+        ).astype(np.int8)
+        # The zero address only stands for the mints and burns
+        keep = np.flatnonzero(ids != zero)
+        ids = ids[keep]
+        if zero >= 0:
+            ids = ids - (ids > zero)
+            addresses = np.delete(np.asarray(addresses, dtype=object), zero)
+        addresses = np.asarray(addresses, dtype=object)
+        # Index of the transfer of each kept row
+        rows = keep % n
+
+        blocks = np.asarray(transfers["blockNumber"], dtype=np.int64)[rows]
+        log_indexes = np.asarray(transfers["logIndex"], dtype=np.int64)[rows]
+        hashes = np.asarray(transfers["transactionHash"], dtype=object)[rows]
+        kinds = kinds[keep]
+        amounts = np.where(keep < n, 1.0, -1.0) * values[rows]
+
+        if opening is not None and len(opening) and n:
+            opening = opening[opening > 0]
+            opening_ids = pd.Index(addresses).get_indexer(opening.index)
+            new = opening_ids < 0
+            opening_ids[new] = len(addresses) + np.arange(new.sum())
+            addresses = np.concatenate(
+                [addresses, np.asarray(opening.index[new], dtype=object)]
+            )
+            ids = np.concatenate([ids, opening_ids])
+            blocks = np.concatenate(
+                [blocks, np.full(len(opening), blocks.min() - 1, dtype=np.int64)]
+            )
+            log_indexes = np.concatenate(
+                [log_indexes, np.full(len(opening), -1, dtype=np.int64)]
+            )
+            hashes = np.concatenate([hashes, np.full(len(opening), None)])
+            kinds = np.concatenate(
+                [kinds, np.full(len(opening), OPENING, dtype=np.int8)]
+            )
+            amounts = np.concatenate([amounts, opening.to_numpy(dtype=float)])
+
+        self.addresses = addresses
+        order = np.lexsort((log_indexes, blocks, ids))
+        self.ids = ids[order]
+        self.blocks = blocks[order]
+        self.log_indexes = log_indexes[order]
+        self.hashes = hashes[order]
+        self.kinds = kinds[order]
+        self.amounts = amounts[order]
+        # Running sums restarting at every holder, the rows of a holder being contiguous
+        balances = pd.Series(self.amounts).groupby(self.ids).cumsum().to_numpy()
+        self.balances = np.where(np.abs(balances) < BALANCE_DUST, 0.0, balances)
+
+        # First and last row of every holder
+        self.starts = np.flatnonzero(np.r_[True, self.ids[1:] != self.ids[:-1]])
+        self.ends = np.r_[self.starts[1:], len(self.ids)] - 1
+
+        negative = np.unique(self.ids[self.balances < 0])
+        if len(negative):
+            logging.warning(
+                f"{len(negative)} holders have a negative LP balance: the transfers start at "
+                f"block {self.blocks.min()}, after the deployment of the token, and no opening "
+                "balances were given for the tokens held before (see opening_balances)"
+            )
+
+    def steth_prices(self, blocks):
+        """
+        :return: The stETH price in ETH of the last swap at or before each block, 1 before the first.
+        """
+        return asof(self.price_blocks, self.prices, blocks, default=1.0)
+
+    def virtual_price(self, blocks):
+        """
+        :return: The virtual price at each block, the first known one before it is first logged.
+        """
+        default = self.vp[0] if len(self.vp) else 1.0
+        return asof(self.vp_blocks, self.vp, blocks, default=default)
+
+    def _value_flows(
+        self,
+        add_liquidity,
+        remove_liquidity,
+        remove_liquidity_one,
+        remove_liquidity_imbalance,
+    ):
+        """
+        Values the LP tokens moved by every row: mints at the coins deposited in the transaction,
+        burns at the coins withdrawn, split between the mints or burns of a transaction in proportion
+        of their amounts, and transfers at the virtual price.
+        """
+        self.values = np.abs(self.amounts) * self.virtual_price(self.blocks)
+
+        def coins(events):
+            return np.asarray(events["token_amounts_a"], dtype=float) + np.asarray(
+                events["token_amounts_b"], dtype=float
+            ) * self.steth_prices(events["blockNumber"].to_numpy())
+
+        deposits = _per_transaction(
+            add_liquidity["transactionHash"], coins(add_liquidity)
+        )
+        withdrawals = _per_transaction(
+            np.concatenate(
+                [
+                    np.asarray(df["transactionHash"], dtype=object)
+                    for df in (
+                        remove_liquidity,
+                        remove_liquidity_imbalance,
+                        remove_liquidity_one,
+                    )
+                ]
+            ),
+            np.concatenate(
+                [
+                    coins(remove_liquidity),
+                    coins(remove_liquidity_imbalance),
+                    # The coin withdrawn is not logged, both coins are close to par
+                    np.asarray(remove_liquidity_one["coin_amount"], dtype=float),
+                ]
+            ),
+        )
+
+        for kind, coin_values in ((MINT, deposits), (BURN, withdrawals)):
+            rows = np.flatnonzero(self.kinds == kind)
+            if not len(rows) or coin_values.empty:
+                continue
+            hashes = pd.Index(self.hashes[rows])
+            moved = _per_transaction(hashes, np.abs(self.amounts[rows]))
+            transaction_value = coin_values.reindex(hashes).to_numpy()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                share = np.abs(self.amounts[rows]) / moved.reindex(hashes).to_numpy()
+            valued = ~np.isnan(transaction_value) & ~np.isnan(share)
+            self.values[rows[valued]] = (transaction_value * share)[valued]
+
+    def to_frame(self):
+        """
+        :return: The ledger as a DataFrame sorted by (address, blockNumber, logIndex), with the kind,
+        the signed LP amount, the ETH value moved and the balance after each row.
+        """
+        return pd.DataFrame(
+            {
+                "address": pd.Categorical.from_codes(self.ids, self.addresses),
+                "blockNumber": self.blocks,
+                "logIndex": self.log_indexes,
+                "transactionHash": self.hashes,
+                "kind": pd.Categorical.from_codes(self.kinds, KIND_NAMES),
+                "amount": self.amounts,
+                "value": self.values,
+                "balance": self.balances,
+            }
+        )
+
+    def balances_at(self, block_number):
+        """
+        :return: A Series address -> LP balance after the given block, for the holders with a
+        balance.
+        """
+        # Last row of every holder at or before the block, the rows of a holder being sorted
+        keys = self.ids.astype(np.int64) * (2**40) + self.blocks
+        last = (
+            np.searchsorted(
+                keys,
+                np.arange(len(self.addresses), dtype=np.int64) * (2**40) + block_number,
+                side="right",
+            )
+            - 1
+        )
+        held = last >= self.starts
+        balances = np.where(held, self.balances[np.clip(last, 0, None)], 0.0)
+        return pd.Series(balances, index=self.addresses)[balances > 0]
+
+    def pool_fees(self, end_block):
+        """
+        :return: The fee income of all the LP tokens up to end_block: the growth of the virtual price
+        weighted by the supply over time.
+        """
+        supply_rows = np.flatnonzero(
+            np.isin(self.kinds, (MINT, BURN)) & (self.blocks <= end_block)
+        )
+        order = np.lexsort((self.log_indexes[supply_rows], self.blocks[supply_rows]))
+        blocks = self.blocks[supply_rows][order]
+        log_indexes = self.log_indexes[supply_rows][order]
+        supply = np.cumsum(self.amounts[supply_rows][order])
+        opening_supply = 0.0
+        if self.supply_anchor is not None:
+            # Supply minted before the first transfer of the ledger
+            block, log_index, token_supply = self.supply_anchor
+            i = np.searchsorted(
+                blocks * 2**20 + log_indexes, block * 2**20 + log_index, side="right"
+            )
+            opening_supply = token_supply - (supply[i - 1] if i else 0.0)
+        if not len(self.blocks):
+            return 0.0
+        # The opening supply is held from the first row of the ledger
+        blocks = np.r_[self.blocks.min(), blocks]
+        supply = np.r_[0.0, supply] + opening_supply
+        next_blocks = np.r_[blocks[1:], end_block]
+        growth = self.virtual_price(next_blocks) - self.virtual_price(blocks)
+        return float(np.sum(supply * growth))
+
+    def returns(self, end_block=None):
+        """
+        Scores every holder at once.
+
+        :param end_block: The block the open positions are marked at, the last ledger block by default.
+        :return: A DataFrame indexed by address with the balance and its ETH value, the cost basis
+        (ETH paid for the LP tokens received), the proceeds (ETH received for the LP tokens sent),
+        the pnl, the total return (pnl / cost basis), the fees earned (the growth of the virtual
+        price on the balance held) and the share of the pool fees they stand for, sorted by value.
+        """
+        if end_block is None:
+            end_block = int(self.blocks.max()) if len(self.blocks) else 0
+        n = len(self.addresses)
+        received = self.amounts > 0
+
+        cost = np.bincount(self.ids, np.where(received, self.values, 0.0), n)
+        proceeds = np.bincount(self.ids, np.where(received, 0.0, self.values), n)
+        balance = self.balances[self.ends]
+        value = balance * self.virtual_price([end_block])[0]
+        pnl = proceeds + value - cost
+
+        # Each balance is held from its row to the next row of the holder, or to end_block
+        next_blocks = np.r_[self.blocks[1:], end_block]
+        next_blocks[self.ends] = end_block
+        growth = self.virtual_price(next_blocks) - self.virtual_price(self.blocks)
+        fees = np.bincount(self.ids, self.balances * growth, n)
+        total_fees = self.pool_fees(end_block)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            total_return = np.where(cost > 0, pnl / cost, np.nan)
+            fee_share = fees / total_fees if total_fees else np.full(n, np.nan)
+        returns = pd.DataFrame(
+            {
+                "balance": balance,
+                "value": value,
+                "cost_basis": cost,
+                "proceeds": proceeds,
+                "pnl": pnl,
+                "total_return": total_return,
+                "fees_earned": fees,
+                "fee_share": fee_share,
+                "first_block": self.blocks[self.starts],
+                "last_block": self.blocks[self.ends],
+                "transfers": np.bincount(self.ids, self.kinds != OPENING, n).astype(
+                    np.int64
+                ),
+            },
+            index=pd.Index(self.addresses, name="address"),
+        )
+        return returns.sort_values("value", ascending=False)
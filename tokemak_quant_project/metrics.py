@@ -0,0 +1,356 @@
+"""
+Instrumentation of the fetcher: latency histograms per RPC method, bytes received, retries, logs
+decoded and rows written per second, and time spent in each stage.
+
+The METRICS registry is shared by every module. main() saves it as JSON and in the Prometheus text
+format at the end of the run, and can print a live progress line while it runs.
+"""
+
+import bisect
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from config import *
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket bounds, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=RPC_LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        :return: The upper bound of the bucket holding the q-quantile, inf if it is the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [math.inf], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges, histograms and stage timings.
+    """
+
+    def __init__(self, latency_buckets=RPC_LATENCY_BUCKETS):
+        self.latency_buckets = latency_buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start = time.monotonic()
+            self.counters = Counter()
+            self.gauges = {}
+            self.histograms = {}
+            self.stages = {}
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds value to a counter, e.g. increment("retries", job="fetch_curve_window").
+        """
+        with self.lock:
+            self.counters[name, _labels_key(labels)] += value
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge, e.g. the number of blocks to fetch.
+        """
+        with self.lock:
+            self.gauges[name, _labels_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds a value to a histogram, e.g. observe("rpc_latency_seconds", 0.2, method="eth_getLogs").
+        """
+        key = (name, _labels_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.latency_buckets)
+            self.histograms[key].observe(value)
+
+    def counter(self, name, **labels):
+        """
+        :return: The value of a counter, summed over all its labels if none are given.
+        """
+        with self.lock:
+            if labels:
+                return self.counters[name, _labels_key(labels)]
+            return sum(
+                value
+                for (counter, _), value in self.counters.items()
+                if counter == name
+            )
+
+    def record_stage(self, stage, seconds, items=0):
+        """
+        Adds the time spent in a stage and the number of items it processed.
+        """
+        with self.lock:
+            totals = self.stages.setdefault(
+                stage, {"seconds": 0.0, "calls": 0, "items": 0}
+            )
+            totals["seconds"] += seconds
+            totals["calls"] += 1
+            totals["items"] += items
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Times a block of code as a stage. The items it processed are set on the yielded dict:
+
+        with METRICS.stage("decode") as timing:
+            timing["items"] = len(rows)
+        """
+        timing = {"items": 0}
+        start = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            self.record_stage(stage, time.perf_counter() - start, timing["items"])
+
+    def collect(self):
+        """
+        Takes the counters and stage timings recorded so far, resetting them. Worker processes
+        have their own registry, and send what they recorded to the parent with the result of
+        every item.
+
+        :return: A picklable (counters, stages) tuple, to be given to merge.
+        """
+        with self.lock:
+            collected = (dict(self.counters), self.stages)
+            self.counters = Counter()
+            self.stages = {}
+        return collected
+
+    def merge(self, collected):
+        """
+        Adds the counters and stage timings collected from another registry.
+        """
+        counters, stages = collected
+        with self.lock:
+            self.counters.update(counters)
+            for stage, totals in stages.items():
+                merged = self.stages.setdefault(
+                    stage, {"seconds": 0.0, "calls": 0, "items": 0}
+                )
+                for name, value in totals.items():
+                    merged[name] += value
+
+    def summary(self):
+        """
+        :return: A JSON serializable dict of every metric. The stages report their items per second
+        of work, which stays meaningful when several threads run the same stage.
+        """
+        with self.lock:
+            return {
+                "elapsed_seconds": time.monotonic() - self.start,
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.gauges.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.to_dict()}
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+                "stages": {
+                    stage: {
+                        **totals,
+                        "items_per_second": (
+                            totals["items"] / totals["seconds"]
+                            if totals["seconds"]
+                            else None
+                        ),
+                    }
+                    for stage, totals in sorted(self.stages.items())
+                },
+            }
+
+    def to_prometheus(self, prefix="tokemak_"):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{prefix}{name}_total{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{prefix}{name}_bucket{_format_labels(labels, le=bound)} {cumulative}"
+                    )
+                lines.append(
+                    f"{prefix}{name}_sum{_format_labels(labels)} {histogram.sum}"
+                )
+                lines.append(
+                    f"{prefix}{name}_count{_format_labels(labels)} {histogram.count}"
+                )
+            for stage, totals in sorted(self.stages.items()):
+                stage_label = _format_labels((), stage=stage)
+                lines.append(
+                    f"{prefix}stage_seconds_total{stage_label} {totals['seconds']}"
+                )
+                lines.append(
+                    f"{prefix}stage_items_total{stage_label} {totals['items']}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def save(self, path=METRICS_FILENAME, prometheus_path=PROMETHEUS_FILENAME):
+        """
+        Writes the summary as JSON and the Prometheus text, e.g. for the textfile collector of
+        the node exporter.
+        """
+        for target, content in (
+            (path, json.dumps(self.summary(), indent=2)),
+            (prometheus_path, self.to_prometheus()),
+        ):
+            tmp_path = f"{target}.tmp"
+            with open(tmp_path, "w") as metrics_file:
+                metrics_file.write(content)
+            os.replace(tmp_path, target)
+
+    def progress_line(self):
+        """
+        :return: A one line summary of the progress of the run.
+        """
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        blocks = self.counter("blocks_fetched")
+        with self.lock:
+            total = sum(
+                value
+                for (name, _), value in self.gauges.items()
+                if name == "blocks_total"
+            )
+        logs = self.counter("logs_fetched")
+        parts = [f"{elapsed:.0f}s"]
+        if total:
+            parts.append(f"blocks {blocks}/{total} ({100 * blocks / total:.1f}%)")
+        parts += [
+            f"logs {logs} ({logs / elapsed:.0f}/s)",
+            f"rows written {self.counter('rows_written')}",
+            f"RPC {self.counter('rpc_calls')} calls, "
+            f"{self.counter('rpc_bytes_received') / 2**20:.1f} MB",
+            f"retries {self.counter('retries')}",
+        ]
+        return " | ".join(parts)
+
+
+class ProgressReporter:
+    """
+    Rewrites the progress line of a Metrics registry on stderr every interval seconds, in a
+    background thread.
+    """
+
+    def __init__(self, metrics, interval=PROGRESS_INTERVAL, stream=sys.stderr):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.stream.write(f"\r{self.metrics.progress_line()}\033[K")
+            self.stream.flush()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.stream.write(f"\r{self.metrics.progress_line()}\033[K\n")
+        self.stream.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def construct_metrics_middleware(metrics=None):
+    """
+    Builds a web3 provider middleware recording the latency, the calls and the errors of every
+    RPC request per method.
+
+    :param metrics: The Metrics registry, METRICS by default.
+    """
+    metrics = metrics if metrics is not None else METRICS
+
+    def metrics_middleware(make_request, w3):
+        def middleware(method, params):
+            start = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception:
+                metrics.increment("rpc_errors", method=method)
+                raise
+            finally:
+                metrics.observe(
+                    "rpc_latency_seconds", time.perf_counter() - start, method=method
+                )
+                metrics.increment("rpc_calls", method=method)
+            if "error" in response:
+                metrics.increment("rpc_errors", method=method)
+            return response
+
+        return middleware
+
+    return metrics_middleware
+
+
+METRICS = Metrics()
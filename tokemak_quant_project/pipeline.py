@@ -0,0 +1,202 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from config import *
+from tokemak_quant_project.metrics import METRICS
+
+# Sentinel telling a stage thread to stop
+_STOP = object()
+
+
+class StreamingPipeline:
+    """
+    Chain of processing stages (e.g. decode then write), each running in its own thread and fed by a
+    bounded queue. Producers block when the first queue is full, so at most queue_size items wait
+    between two stages whatever the number of windows, and the fetch of the next windows overlaps
+    with the processing of the current ones.
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        """
+        :param stages: A list of (name, callable) tuples. Each callable is called with the item
+        returned by the previous stage, the first one with the items given to put.
+        :param queue_size: Maximum number of items waiting in front of each stage.
+        """
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.failed = []
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, args=(index,), name=name, daemon=True)
+            for index, (name, _) in enumerate(stages)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put(self, task, item):
+        """
+        Hands an item to the first stage, blocking while its queue is full.
+
+        :param task: A tuple identifying the item, reported by drain if a stage fails on it,
+        e.g. (name, start_block, end_block, batch_n).
+        :param item: The input of the first stage.
+        """
+        self.queues[0].put((task, item))
+
+    def _run(self, index):
+        name, func = self.stages[index]
+        input_queue = self.queues[index]
+        while True:
+            entry = input_queue.get()
+            try:
+                if entry is _STOP:
+                    return
+                task, item = entry
+                try:
+                    result = func(item)
+                except Exception as e:
+                    logging.error(f"{name} stage failed on {task}: {e}")
+                    METRICS.increment("pipeline_failures", stage=name)
+                    with self.lock:
+                        self.failed.append(task)
+                    continue
+                if index + 1 < len(self.queues):
+                    self.queues[index + 1].put((task, result))
+            finally:
+                input_queue.task_done()
+
+    def drain(self):
+        """
+        Waits until every item given so far went through all the stages.
+
+        :return: The tasks that failed since the last drain.
+        """
+        # An item is queued for the next stage before being marked done in the previous one
+        for stage_queue in self.queues:
+            stage_queue.join()
+        with self.lock:
+            failed, self.failed = self.failed, []
+        return failed
+
+    def close(self):
+        """
+        Drains the pipeline, then stops the stage threads.
+
+        :return: The tasks that failed since the last drain.
+        """
+        failed = self.drain()
+        for stage_queue, thread in zip(self.queues, self.threads):
+            stage_queue.put(_STOP)
+            thread.join()
+        return failed
+
+
+def available_cpus():
+    """
+    :return: The number of cores the process may run on, which can be fewer than os.cpu_count()
+    in a container or under taskset.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class ProcessPipeline:
+    """
+    Runs a single CPU-bound stage (e.g. decode and write) in a pool of worker processes, so that it
+    uses every core instead of sharing the GIL with the fetch threads. It has the put / drain / close
+    interface of StreamingPipeline: producers block while queue_size items wait for a free worker,
+    and the failures are reported in the order the items were put.
+
+    The function and the items must be picklable: module-level functions, and raw logs packed by
+    decoder.pack_logs rather than web3 objects. The workers are spawned rather than forked, as
+    forking while the fetch threads hold locks (logging, HTTP pools) can deadlock the children.
+    """
+
+    def __init__(
+        self, name, func, workers=None, queue_size=PIPELINE_QUEUE_SIZE, on_result=None
+    ):
+        """
+        :param name: The name of the stage, used in logs and metrics.
+        :param func: A module-level callable, called in a worker process with each item.
+        :param workers: Number of worker processes, one per available core by default.
+        :param queue_size: Maximum number of items waiting for a free worker.
+        :param on_result: An optional callable called in the parent process with the result of
+        each item, e.g. to record the metrics of the workers.
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers or available_cpus()
+        self.on_result = on_result
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def put(self, task, item):
+        """
+        Hands an item to the worker processes, blocking while queue_size items already wait.
+
+        :param task: A tuple identifying the item, reported by drain if the stage fails on it.
+        :param item: The picklable input of the stage.
+        """
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self.func, item)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._done)
+        with self.lock:
+            self.pending.append((task, future))
+
+    def _done(self, future):
+        self.slots.release()
+        if self.on_result is not None and not future.cancelled():
+            if future.exception() is None:
+                self.on_result(future.result())
+
+    def drain(self):
+        """
+        Waits until every item given so far was processed.
+
+        :return: The tasks that failed since the last drain, in the order they were put.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        failed = []
+        for task, future in pending:
+            error = future.exception()
+            if error is not None:
+                logging.error(f"{self.name} stage failed on {task}: {error}")
+                METRICS.increment("pipeline_failures", stage=self.name)
+                failed.append(task)
+        return failed
+
+    def close(self):
+        """
+        Drains the pipeline, then stops the worker processes.
+
+        :return: The tasks that failed since the last drain.
+        """
+        failed = self.drain()
+        self.executor.shutdown()
+        return failed
@@ -0,0 +1,309 @@
+"""
+Rebuilds the state of the Curve stETH/ETH pool by replaying its stored events in (blockNumber, logIndex)
+order, with exact integer arithmetic, and keeps periodic snapshots so that the state at any block is
+found with a binary search plus a short replay.
+"""
+
+import bisect
+import json
+import logging
+import os
+
+import pandas as pd
+
+from config import *
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.events import project_events
+
+# Events of the pool contract changing its coin balances or LP supply
+CURVE_STATE_EVENTS = [
+    "AddLiquidity",
+    "RemoveLiquidity",
+    "RemoveLiquidityOne",
+    "RemoveLiquidityImbalance",
+    "TokenExchange",
+]
+
+# Columns holding uint256 or int128 values, converted to Python ints
+CURVE_INTEGER_COLUMNS = [
+    "token_amounts_a",
+    "token_amounts_b",
+    "token_supply",
+    "token_amount",
+    "coin_amount",
+    "sold_id",
+    "tokens_sold",
+    "bought_id",
+    "tokens_bought",
+]
+
+
+class CurvePoolState:
+    """
+    State of the pool after all the events up to (block_number, log_index):
+    the coin balances moved by the events, the LP token supply, and the coins removed by
+    RemoveLiquidityOne events whose coin is unknown.
+    """
+
+    def __init__(
+        self, block_number=0, log_index=-1, balances=(0, 0), lp_supply=0, unassigned=0
+    ):
+        self.block_number = block_number
+        self.log_index = log_index
+        self.balances = list(balances)
+        self.lp_supply = lp_supply
+        self.unassigned = unassigned
+
+    def __repr__(self):
+        return (
+            f"CurvePoolState(block={self.block_number}, balances={self.balances}, "
+            f"lp_supply={self.lp_supply}, unassigned={self.unassigned})"
+        )
+
+    def copy(self):
+        return CurvePoolState.from_dict(self.to_dict())
+
+    def to_dict(self):
+        return {
+            "blockNumber": self.block_number,
+            "logIndex": self.log_index,
+            "balances": list(self.balances),
+            "lp_supply": self.lp_supply,
+            "unassigned": self.unassigned,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(
+            state["blockNumber"],
+            state["logIndex"],
+            state["balances"],
+            state["lp_supply"],
+            state["unassigned"],
+        )
+
+    def apply(self, event, remove_one_coin=None):
+        """
+        Applies a single event to the state.
+
+        :param event: A row of load_curve_events, with Python int amounts.
+        :param remove_one_coin: An optional callable returning the index of the coin withdrawn by a
+        RemoveLiquidityOne event (the event does not say), or None if it is unknown.
+        """
+        name = event.event
+        if name == "AddLiquidity":
+            self.balances[0] += event.token_amounts_a
+            self.balances[1] += event.token_amounts_b
+            self.lp_supply = event.token_supply
+        elif name in ("RemoveLiquidity", "RemoveLiquidityImbalance"):
+            self.balances[0] -= event.token_amounts_a
+            self.balances[1] -= event.token_amounts_b
+            self.lp_supply = event.token_supply
+        elif name == "RemoveLiquidityOne":
+            self.lp_supply -= event.token_amount
+            coin = remove_one_coin(event) if remove_one_coin is not None else None
+            if coin is None:
+                self.unassigned += event.coin_amount
+            else:
+                self.balances[coin] -= event.coin_amount
+        elif name == "TokenExchange":
+            self.balances[event.sold_id] += event.tokens_sold
+            self.balances[event.bought_id] -= event.tokens_bought
+        self.block_number = int(event.blockNumber)
+        self.log_index = int(event.logIndex)
+
+
+def _to_int(value):
+    return None if pd.isna(value) else int(value)
+
+
+def load_curve_events(start_block=None, end_block=None, store_format=STORE_FORMAT):
+    """
+    Reads the stored events of the Curve pool that change its state.
+
+    :param start_block: The first block to read (inclusive), from the first stored block by default.
+    :param end_block: The last block to read (inclusive), up to the last stored block by default.
+    :param store_format: "csv" to read the consolidated CSV files, "parquet" to read the event store.
+    :return: A DataFrame sorted by (blockNumber, logIndex), with amounts as exact Python ints.
+    """
+    blocks = (
+        start_block if start_block is not None else 0,
+        end_block if end_block is not None else 2**62,
+    )
+    frames = []
+    for spec in project_events("curve"):
+        if spec.contract.lower() != CURVE_POOL_ADDRESS.lower():
+            continue
+        if spec.event not in CURVE_STATE_EVENTS:
+            continue
+        if store_format == "parquet":
+            df = EventStore().read(spec.pool, spec.event, blocks=blocks)
+        elif os.path.exists(spec.filename):
+            # Read as strings, uint256 values do not fit in any numpy integer type
+            df = pd.read_csv(spec.filename, dtype=str)
+            df["blockNumber"] = df["blockNumber"].astype(int)
+            df["logIndex"] = df["logIndex"].astype(int)
+            df = df[df["blockNumber"].between(*blocks)]
+        else:
+            continue
+        frames.append(df)
+
+    columns = ["event", "blockNumber", "logIndex", "transactionHash"]
+    if not frames:
+        return pd.DataFrame(columns=columns + CURVE_INTEGER_COLUMNS)
+    events = pd.concat(frames, ignore_index=True)
+    for column in CURVE_INTEGER_COLUMNS:
+        if column not in events:
+            events[column] = None
+        events[column] = pd.Series(
+            [_to_int(value) for value in events[column]],
+            index=events.index,
+            dtype=object,
+        )
+    events = events[columns + CURVE_INTEGER_COLUMNS]
+    return events.sort_values(["blockNumber", "logIndex"], ignore_index=True)
+
+
+class CurvePoolReplay:
+    """
+    Replays the pool events into a CurvePoolState, saving a snapshot of the state every
+    `interval` blocks so that state_at only replays the events since the closest snapshot. The
+    events are read once and kept in memory, state_at slices them by block.
+
+    The balances are the coins moved in and out of the pool by its events, on top of the initial
+    state: stETH rebases and admin fee withdrawals emit no pool event and are not included.
+    """
+
+    def __init__(
+        self,
+        path=CURVE_SNAPSHOTS_FILENAME,
+        interval=CURVE_SNAPSHOT_INTERVAL,
+        initial_state=None,
+        remove_one_coin=None,
+        loader=load_curve_events,
+    ):
+        """
+        :param path: The JSON file holding the snapshots, created on the first save.
+        :param interval: Number of blocks between two snapshots.
+        :param initial_state: The CurvePoolState before the first stored event, e.g. sampled with
+        eth_call, an empty pool by default.
+        :param remove_one_coin: An optional callable returning the coin index of a RemoveLiquidityOne event.
+        :param loader: A callable loader(start_block, end_block) returning the sorted events of a block range.
+        """
+        self.path = path
+        self.interval = interval
+        self.remove_one_coin = remove_one_coin
+        self.loader = loader
+        self.initial_state = initial_state or CurvePoolState()
+        try:
+            with open(path, "r") as snapshots_file:
+                saved = json.load(snapshots_file)
+            self.snapshots = [CurvePoolState.from_dict(s) for s in saved["snapshots"]]
+            self.head = CurvePoolState.from_dict(saved["head"])
+        except FileNotFoundError:
+            self.snapshots = []
+            self.head = self.initial_state.copy()
+        self.snapshot_blocks = [state.block_number for state in self.snapshots]
+        # The events up to the head, loaded once and kept for state_at
+        self.events = None
+
+    def save(self):
+        """
+        Writes the snapshots atomically.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as snapshots_file:
+            json.dump(
+                {
+                    "head": self.head.to_dict(),
+                    "snapshots": [state.to_dict() for state in self.snapshots],
+                },
+                snapshots_file,
+            )
+        os.replace(tmp_path, self.path)
+
+    def _replay(self, state, events, snapshot=False):
+        last_snapshot = self.snapshot_blocks[-1] if self.snapshot_blocks else None
+        for event in events.itertuples(index=False):
+            if (event.blockNumber, event.logIndex) <= (
+                state.block_number,
+                state.log_index,
+            ):
+                continue
+            if (
+                snapshot
+                and state.block_number < event.blockNumber
+                and (
+                    last_snapshot is None
+                    or event.blockNumber - last_snapshot >= self.interval
+                )
+            ):
+                # The state holds every event up to the end of its block
+                self.snapshots.append(state.copy())
+                self.snapshot_blocks.append(state.block_number)
+                last_snapshot = state.block_number
+            state.apply(event, self.remove_one_coin)
+        return state
+
+    def update(self):
+        """
+        Replays the events stored since the last update, adding the snapshots they cross, and
+        saves the snapshots.
+
+        :return: The state after the last stored event.
+        """
+        # Replaying from the initial state loads every event, kept for state_at
+        from_start = self.head.to_dict() == self.initial_state.to_dict()
+        events = self.loader(self.head.block_number, None)
+        # The events of the head block up to the head are already applied, and kept
+        events = events[
+            (events["blockNumber"] > self.head.block_number)
+            | (
+                (events["blockNumber"] == self.head.block_number)
+                & (events["logIndex"] > self.head.log_index)
+            )
+        ]
+        self._replay(self.head, events, snapshot=True)
+        if from_start and self.events is None:
+            self.events = events.reset_index(drop=True)
+        elif self.events is not None:
+            self.events = pd.concat([self.events, events], ignore_index=True)
+        logging.info(
+            f"Replayed {len(events)} pool events up to block {self.head.block_number}, "
+            f"{len(self.snapshots)} snapshots"
+        )
+        self.save()
+        return self.head.copy()
+
+    def events_between(self, start_block, end_block):
+        """
+        Slices the events kept in memory, loading the events up to the head on the first call
+        rather than reading the stored events again for every state.
+
+        :return: The sorted events of the block range, both inclusive.
+        """
+        if self.events is None:
+            self.events = self.loader(None, self.head.block_number)
+        blocks = self.events["blockNumber"].to_numpy()
+        start = blocks.searchsorted(start_block, side="left")
+        end = blocks.searchsorted(end_block, side="right")
+        return self.events.iloc[start:end]
+
+    def state_at(self, block_number):
+        """
+        Replays the stored events first if they were never replayed, i.e. without a snapshot
+        file, rather than answering with the initial state.
+
+        :return: The CurvePoolState after all the events up to block_number (inclusive).
+        """
+        if not os.path.exists(self.path) and (
+            self.head.to_dict() == self.initial_state.to_dict()
+        ):
+            self.update()
+        if block_number >= self.head.block_number:
+            return self.head.copy()
+        i = bisect.bisect_right(self.snapshot_blocks, block_number) - 1
+        state = (self.snapshots[i] if i >= 0 else self.initial_state).copy()
+        return self._replay(
+            state, self.events_between(state.block_number, block_number)
+        )
@@ -0,0 +1,264 @@
+"""
+A web3 provider spreading the requests over several RPC endpoints, each with its own weight, rate
+limit and pool of kept-alive connections, and failing over to the other endpoints when one answers
+with an HTTP error, e.g. a 429, a 5xx or a 401 for an expired key.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3.providers.base import JSONBaseProvider
+
+from config import *
+from tokemak_quant_project.metrics import METRICS
+from tokemak_quant_project.scheduler import TokenBucket
+
+
+class EndpointError(Exception):
+    """
+    Raised when an endpoint is unavailable: connection error, timeout, or an HTTP error response
+    which does not carry a JSON-RPC error.
+    """
+
+
+def is_rpc_error_response(response):
+    """
+    Tells whether a 4xx response carries a JSON-RPC error, e.g. the HTTP 400 some providers answer
+    "block range too large" with. Such responses are returned like any other JSON-RPC error, so that
+    callers raise a ValueError from it and the log fetchers can bisect the range.
+    """
+    if not 400 <= response.status_code < 500:
+        return False
+    try:
+        body = json.loads(response.content)
+    except ValueError:
+        return False
+    if isinstance(body, dict):
+        return "error" in body
+    return isinstance(body, list) and any(
+        isinstance(item, dict) and "error" in item for item in body
+    )
+
+
+class Endpoint:
+    """
+    An RPC endpoint, with its token bucket, its HTTP session and the statistics used to pick it.
+    """
+
+    def __init__(
+        self,
+        url,
+        weight=1.0,
+        compute_units_per_second=COMPUTE_UNITS_PER_SECOND,
+        pool_size=RPC_POOL_SIZE,
+    ):
+        """
+        :param url: The URL of the endpoint.
+        :param weight: Relative share of the requests sent to the endpoint, all else being equal.
+        :param compute_units_per_second: The rate limit of the endpoint.
+        :param pool_size: Number of connections kept alive.
+        """
+        self.url = url
+        # The URL usually holds an API key, only the host is logged
+        parsed = urlparse(url)
+        self.name = (
+            f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+        )
+        self.weight = float(weight)
+        self.bucket = TokenBucket(compute_units_per_second)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+        )
+
+        self.lock = threading.Lock()
+        self.latency = None
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def score(self, cost):
+        """
+        :return: The expected seconds before a request of the given cost is answered, divided by
+        the weight of the endpoint: lower is better.
+        """
+        # Endpoints never used yet are tried first
+        latency = self.latency if self.latency is not None else 0.0
+        with self.lock:
+            in_flight = self.in_flight
+        return (self.bucket.wait_time(cost) + latency * (1 + in_flight)) / self.weight
+
+    def _failed(self, retry_after=None):
+        with self.lock:
+            self.failures += 1
+            self.errors += 1
+            if retry_after is None:
+                retry_after = min(
+                    ENDPOINT_COOLDOWN * 2 ** (self.failures - 1), MAX_ENDPOINT_COOLDOWN
+                )
+            self.cooldown_until = time.monotonic() + retry_after
+
+    def _succeeded(self, seconds):
+        with self.lock:
+            self.failures = 0
+            self.requests += 1
+            self.latency = (
+                seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            )
+
+    def post(self, data, cost, timeout=RPC_TIMEOUT):
+        """
+        Sends a JSON-RPC payload once the bucket of the endpoint allows it.
+
+        :param data: The encoded JSON-RPC request or batch.
+        :param cost: The compute units of the request.
+        :param timeout: Seconds before the request is abandoned.
+        :return: The raw response body.
+        """
+        self.bucket.acquire(cost)
+        with self.lock:
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            response = self.session.post(self.url, data=data, timeout=timeout)
+        except requests.RequestException as e:
+            self._failed()
+            raise EndpointError(f"{self.name}: {e}") from e
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        # A 401 or 403 too, e.g. an expired key or the plan limit of this provider only
+        if response.status_code >= 400 and (
+            response.status_code == 429 or not is_rpc_error_response(response)
+        ):
+            retry_after = response.headers.get("Retry-After")
+            self._failed(
+                float(retry_after) if retry_after and retry_after.isdigit() else None
+            )
+            raise EndpointError(f"{self.name}: HTTP {response.status_code}")
+        self._succeeded(time.monotonic() - start)
+        METRICS.increment("rpc_bytes_received", len(response.content))
+        return response.content
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "latency": self.latency,
+                "weight": self.weight,
+            }
+
+
+class MultiEndpointProvider(JSONBaseProvider):
+    """
+    Sends each request to the available endpoint expected to answer it first, given its latency,
+    its requests in flight, the tokens left in its bucket and its weight. An endpoint answering
+    with an HTTP error is left aside for a while and the request goes to another one.
+    """
+
+    def __init__(self, endpoints, retries=MAX_RETRIES, timeout=RPC_TIMEOUT):
+        """
+        :param endpoints: A list of Endpoint.
+        :param retries: Number of endpoints tried after the first one failed.
+        :param timeout: Seconds before a request to an endpoint is abandoned.
+        """
+        super().__init__()
+        if not endpoints:
+            raise ValueError("At least one RPC endpoint is required")
+        self.endpoints = endpoints
+        self.retries = retries
+        self.timeout = timeout
+        # Used by rpc.make_batch_request and in logs
+        self.endpoint_uri = endpoints[0].url
+
+    def __str__(self):
+        return f"MultiEndpointProvider({', '.join(e.name for e in self.endpoints)})"
+
+    @classmethod
+    def from_config(cls, endpoints=RPC_ENDPOINTS):
+        """
+        Builds the provider from the RPC_ENDPOINTS entries whose URL variable is set.
+        """
+        return cls(
+            [
+                Endpoint(
+                    os.getenv(entry["url_env"]),
+                    entry.get("weight", 1.0),
+                    entry.get("compute_units_per_second", COMPUTE_UNITS_PER_SECOND),
+                )
+                for entry in endpoints
+                if os.getenv(entry["url_env"])
+            ]
+        )
+
+    def _choose(self, cost):
+        while True:
+            now = time.monotonic()
+            available = [e for e in self.endpoints if e.cooldown_until <= now]
+            if available:
+                return min(available, key=lambda endpoint: endpoint.score(cost))
+            time.sleep(min(e.cooldown_until for e in self.endpoints) - now)
+
+    def _post(self, data, cost):
+        for attempt in range(self.retries + 1):
+            endpoint = self._choose(cost)
+            try:
+                return endpoint.post(data, cost, self.timeout)
+            except EndpointError as e:
+                logging.warning(f"Endpoint unavailable, failing over: {e}")
+                METRICS.increment("rpc_failovers", endpoint=endpoint.name)
+                error = e
+        raise error
+
+    def make_request(self, method, params):
+        cost = RPC_COMPUTE_UNITS.get(method, RPC_DEFAULT_COMPUTE_UNITS)
+        raw_response = self._post(self.encode_rpc_request(method, params), cost)
+        return self.decode_rpc_response(raw_response)
+
+    def make_batch_request(self, calls):
+        """
+        Sends several JSON-RPC calls in a single HTTP request, see rpc.make_batch_request.
+
+        :param calls: A list of (method, params) tuples.
+        :return: The list of JSON-RPC responses, whose ids are the indices of their calls.
+        """
+        payload = [
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": i}
+            for i, (method, params) in enumerate(calls)
+        ]
+        cost = sum(
+            RPC_COMPUTE_UNITS.get(method, RPC_DEFAULT_COMPUTE_UNITS)
+            for method, _ in calls
+        )
+        responses = json.loads(self._post(json.dumps(payload).encode("utf-8"), cost))
+        if isinstance(responses, dict):
+            # The whole batch was rejected, e.g. because it is too large
+            raise ValueError(responses.get("error", responses))
+        return responses
+
+    def is_connected(self):
+        try:
+            return "result" in self.make_request("web3_clientVersion", [])
+        except (EndpointError, requests.RequestException, ValueError):
+            return False
+
+    def stats(self):
+        """
+        :return: A dict endpoint name -> requests, errors, latency and weight of the endpoint.
+        """
+        return {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
@@ -0,0 +1,129 @@
+import json
+import time
+
+from web3._utils.request import make_post_request
+
+from config import *
+from tokemak_quant_project.metrics import METRICS
+
+
+def make_raw_request(w3, method, params):
+    """
+    Sends an RPC request through the provider middlewares only, skipping web3's result formatting,
+    so that the result is the raw JSON returned by the node.
+
+    :param w3: A Web3 instance connected to an Ethereum node.
+    :param method: The JSON-RPC method.
+    :param params: The params of the call.
+    :return: The raw result of the call.
+    """
+    response = w3.provider.request_func(w3, ())(method, params)
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response["result"]
+
+
+def make_batch_request(provider, calls):
+    """
+    Sends several JSON-RPC calls to the provider in a single HTTP request.
+
+    :param provider: The HTTP provider of a Web3 instance.
+    :param calls: A list of (method, params) tuples.
+    :return: The list of JSON-RPC responses, whose ids are the indices of their calls.
+    """
+    if hasattr(provider, "make_batch_request"):
+        return provider.make_batch_request(calls)
+
+    payload = [
+        {"jsonrpc": "2.0", "method": method, "params": params, "id": i}
+        for i, (method, params) in enumerate(calls)
+    ]
+    raw_response = make_post_request(
+        provider.endpoint_uri,
+        json.dumps(payload).encode("utf-8"),
+        **provider.get_request_kwargs(),
+    )
+    METRICS.increment("rpc_bytes_received", len(raw_response))
+    responses = json.loads(raw_response)
+    if isinstance(responses, dict):
+        # The whole batch was rejected, e.g. because it is too large
+        raise ValueError(responses.get("error", responses))
+    return responses
+
+
+def batch_request(
+    w3,
+    method,
+    params_list,
+    batch_size=RPC_BATCH_SIZE,
+    bucket=None,
+    raise_on_error=True,
+):
+    """
+    Calls the same RPC method with many sets of parameters, batch_size calls per HTTP request.
+
+    :param w3: A Web3 instance connected to an Ethereum node over HTTP.
+    :param method: The JSON-RPC method, e.g. eth_getBlockByNumber.
+    :param params_list: A list with the params of each call.
+    :param batch_size: Maximum number of calls per HTTP request.
+    :param bucket: Optional TokenBucket charged with the compute units of each batch.
+    :param raise_on_error: Raise a ValueError when a call fails, instead of returning None as its result.
+    :return: The list of results, in the order of params_list.
+    """
+    # Installed by rpc_cache.install_rpc_cache, batches skip the provider middlewares
+    cache = getattr(w3.provider, "rpc_cache", None)
+
+    def head_block():
+        return int(make_raw_request(w3, "eth_blockNumber", []), 16)
+
+    results = []
+    for i in range(0, len(params_list), batch_size):
+        batch = params_list[i : i + batch_size]
+        responses = [None] * len(batch)
+        cacheable = [False] * len(batch)
+        if cache is not None:
+            for j, params in enumerate(batch):
+                cacheable[j] = cache.cacheable(method, params, head_block)
+                if cacheable[j]:
+                    responses[j] = cache.get(method, params)
+
+        missing = [j for j, response in enumerate(responses) if response is None]
+        if missing:
+            if bucket is not None:
+                bucket.acquire(
+                    RPC_COMPUTE_UNITS.get(method, RPC_DEFAULT_COMPUTE_UNITS)
+                    * len(missing)
+                )
+            start = time.perf_counter()
+            fetched = make_batch_request(
+                w3.provider, [(method, batch[j]) for j in missing]
+            )
+            METRICS.observe(
+                "rpc_latency_seconds",
+                time.perf_counter() - start,
+                method=f"{method} (batch)",
+            )
+            METRICS.increment("rpc_calls", len(missing), method=method)
+            # Nodes may answer a batch in any order, and drop calls from it
+            by_id = {response.get("id"): response for response in fetched}
+            lost = [k for k in range(len(missing)) if k not in by_id]
+            if lost or len(fetched) != len(missing):
+                lost_params = [batch[missing[k]] for k in lost]
+                raise ValueError(
+                    f"{method} batch of {len(missing)} calls got {len(fetched)} responses"
+                    + (f", none for the params {lost_params}" if lost else "")
+                )
+            for k, j in enumerate(missing):
+                response = by_id[k]
+                responses[j] = response
+                if cacheable[j]:
+                    cache.put(method, batch[j], response)
+
+        for response in responses:
+            if "error" in response:
+                if raise_on_error:
+                    raise ValueError(f"{method} failed: {response['error']}")
+                results.append(None)
+            else:
+                results.append(response["result"])
+    return results
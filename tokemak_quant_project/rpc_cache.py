@@ -0,0 +1,216 @@
+"""
+Content-addressed on-disk cache of RPC responses on final blocks.
+
+Every response is stored gzip-compressed under the SHA-256 of its method and params, so that reruns,
+notebook reprocessing and benchmarks replaying the same requests never reach the node for historical
+data. Requests on blocks within the finality depth of the head, or on tags such as "latest", are
+never cached.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from config import *
+
+# Position of the block parameter of the cacheable methods taking one
+BLOCK_PARAM_POSITIONS = {
+    "eth_getBlockByNumber": 0,
+    "eth_call": 1,
+    "eth_getBalance": 1,
+    "eth_getCode": 1,
+    "eth_getStorageAt": 2,
+}
+
+
+def _block_number(tag):
+    """
+    :return: The block number of a block parameter, None for tags such as 'latest'.
+    """
+    if isinstance(tag, int):
+        return tag
+    if isinstance(tag, str) and tag.startswith("0x"):
+        return int(tag, 16)
+    return None
+
+
+def last_block(method, params):
+    """
+    :return: The last block a request depends on, or None if it depends on the head or on no block.
+    """
+    if method == "eth_getLogs":
+        log_filter = params[0]
+        if "blockHash" in log_filter:
+            return None
+        if _block_number(log_filter.get("fromBlock", "latest")) is None:
+            return None
+        return _block_number(log_filter.get("toBlock", "latest"))
+    position = BLOCK_PARAM_POSITIONS.get(method)
+    if position is None or len(params) <= position:
+        return None
+    return _block_number(params[position])
+
+
+class RPCResponseCache:
+    """
+    Stores the JSON-RPC responses of final blocks as compressed files named after the hash of the request.
+    """
+
+    def __init__(
+        self,
+        root=RPC_CACHE_DIR,
+        finality_depth=FINALITY_DEPTH,
+        methods=RPC_CACHE_METHODS,
+        head_ttl=RPC_CACHE_HEAD_TTL,
+    ):
+        """
+        :param root: The directory of the cache, created if it does not exist.
+        :param finality_depth: Blocks behind the head after which responses are cached.
+        :param methods: The methods whose responses are cached.
+        :param head_ttl: Seconds the head block number is reused before being requested again.
+        """
+        self.root = root
+        self.finality_depth = finality_depth
+        self.methods = set(methods)
+        self.head_ttl = head_ttl
+        self.head = None
+        self.head_time = 0.0
+        self.hits = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, method, params):
+        request = json.dumps([method, params], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def path(self, method, key):
+        return os.path.join(self.root, method, key[:2], f"{key}.json.gz")
+
+    def _head_block(self, head_fn):
+        with self.lock:
+            if (
+                self.head is not None
+                and time.monotonic() - self.head_time < self.head_ttl
+            ):
+                return self.head
+        head = head_fn()
+        with self.lock:
+            self.head, self.head_time = head, time.monotonic()
+        return head
+
+    def cacheable(self, method, params, head_fn):
+        """
+        Tells whether the response of a request is final, requesting the head block with head_fn
+        only when the cached head is too old to tell.
+
+        :param method: The JSON-RPC method.
+        :param params: The params of the call.
+        :param head_fn: A callable returning the current block number.
+        """
+        if method not in self.methods:
+            return False
+        block = last_block(method, params)
+        if block is None:
+            return False
+        # The head only moves forward, a block final for an old head still is
+        if self.head is not None and block <= self.head - self.finality_depth:
+            return True
+        return block <= self._head_block(head_fn) - self.finality_depth
+
+    def get(self, method, params):
+        """
+        :return: The stored response of a request, or None if it was never stored.
+        """
+        path = self.path(method, self.key(method, params))
+        try:
+            with gzip.open(path, "rt") as response_file:
+                response = json.load(response_file)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses[method] += 1
+            return None
+        with self.lock:
+            self.hits[method] += 1
+        return response
+
+    def put(self, method, params, response):
+        """
+        Stores the response of a request atomically, errors are never stored.
+        """
+        if "error" in response:
+            return
+        path = self.path(method, self.key(method, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            with gzip.GzipFile(fileobj=tmp_file, mode="wb") as response_file:
+                response_file.write(
+                    json.dumps({"result": response["result"]}).encode("utf-8")
+                )
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        """
+        :return: A dict with the hits and misses of the cache, in total and per method.
+        """
+        with self.lock:
+            return {
+                "hits": sum(self.hits.values()),
+                "misses": sum(self.misses.values()),
+                "methods": {
+                    method: {"hits": self.hits[method], "misses": self.misses[method]}
+                    for method in sorted(set(self.hits) | set(self.misses))
+                },
+            }
+
+
+def construct_cache_middleware(cache):
+    """
+    Builds a web3 provider middleware answering the requests on final blocks from the cache.
+
+    :param cache: The RPCResponseCache to read and fill.
+    """
+
+    def cache_middleware(make_request, w3):
+        def head_block():
+            return int(make_request("eth_blockNumber", [])["result"], 16)
+
+        def middleware(method, params):
+            if not cache.cacheable(method, params, head_block):
+                return make_request(method, params)
+            response = cache.get(method, params)
+            if response is None:
+                response = make_request(method, params)
+                cache.put(method, params, response)
+            return response
+
+        return middleware
+
+    return cache_middleware
+
+
+def install_rpc_cache(w3, cache=None):
+    """
+    Puts an RPC cache in front of the provider of a Web3 instance, for both the single requests
+    and the batched ones of rpc.batch_request.
+
+    :param w3: A Web3 instance connected to an Ethereum node over HTTP.
+    :param cache: The RPCResponseCache to use, one under RPC_CACHE_DIR by default.
+    :return: The installed cache.
+    """
+    cache = cache if cache is not None else RPCResponseCache()
+    # Outermost, so that cache hits return before the other middlewares and never reach an endpoint
+    w3.provider.middlewares = (
+        construct_cache_middleware(cache),
+        *w3.provider.middlewares,
+    )
+    w3.provider.rpc_cache = cache
+    logging.info(f"Caching the RPC responses of final blocks in {cache.root}")
+    return cache
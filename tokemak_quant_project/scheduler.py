@@ -0,0 +1,205 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import *
+from tokemak_quant_project.metrics import METRICS
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to keep the request rate under the provider's compute-unit limit.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Number of tokens added to the bucket per second.
+        :param capacity: Maximum number of tokens the bucket can hold (defaults to one second worth of tokens).
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+
+    def wait_time(self, tokens=1):
+        """
+        :return: Seconds until the requested number of tokens is available, without consuming them.
+        """
+        with self.lock:
+            self._refill()
+            return max(0.0, (min(tokens, self.capacity) - self.tokens) / self.rate)
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until the requested number of tokens is available, then consumes them.
+
+        :param tokens: Number of tokens (compute units) to consume.
+        """
+        remaining = float(tokens)
+        while remaining > 0:
+            # Requests costing more than the bucket capacity are paid in several refills
+            chunk = min(remaining, self.capacity)
+            with self.lock:
+                self._refill()
+                if self.tokens >= chunk:
+                    self.tokens -= chunk
+                    remaining -= chunk
+                    continue
+                wait = (chunk - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_with_backoff(func, *args, retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+    """
+    Calls func(*args), retrying with exponential backoff and jitter when it raises.
+
+    :param func: The callable to run.
+    :param retries: Number of retries after the first attempt.
+    :param backoff: Base delay in seconds, doubled after every failed attempt.
+    :return: The value returned by func.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt * (1 + random.random())
+            METRICS.increment("retries", job=func.__name__)
+            logging.warning(
+                f"Attempt {attempt + 1} of {func.__name__}{args} failed ({e}), retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+
+class AdaptiveWindow:
+    """
+    Sizes the block windows from the log density observed in the previous ones, so that quiet
+    periods are covered with few requests and busy ones stay under the provider's result cap.
+    """
+
+    def __init__(
+        self,
+        initial=BLOCK_WINDOW,
+        min_size=MIN_BLOCK_WINDOW,
+        max_size=MAX_BLOCK_WINDOW,
+        target_logs=TARGET_LOGS_PER_REQUEST,
+    ):
+        """
+        :param initial: Size of the first window, in blocks.
+        :param min_size: Smallest window size, in blocks.
+        :param max_size: Largest window size, in blocks.
+        :param target_logs: Number of logs each request should ideally return.
+        """
+        self.size = initial
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_logs = target_logs
+        self.windows = []
+        self.lock = threading.Lock()
+
+    def observe(self, n_blocks, n_logs):
+        """
+        Updates the window size from the number of logs returned for a window.
+
+        :param n_blocks: Number of blocks of the window.
+        :param n_logs: Largest number of logs returned by a single request over the window.
+        """
+        with self.lock:
+            if n_logs:
+                ideal = n_blocks * self.target_logs / n_logs
+            else:
+                ideal = self.max_size
+            # Grow progressively, but shrink right away when the logs get denser
+            size = min(ideal, 2 * self.size)
+            self.size = int(max(self.min_size, min(self.max_size, size)))
+
+    def split(self, start_block, end_block):
+        """
+        Yields consecutive, non-overlapping windows covering [start_block, end_block], newest first,
+        each one sized from the observations made so far. The windows yielded are kept in self.windows.
+
+        :param start_block: The first block of the range (inclusive).
+        :param end_block: The last block of the range (inclusive).
+        """
+        current_block = end_block
+        while current_block >= start_block:
+            with self.lock:
+                window_start = max(start_block, current_block - self.size + 1)
+                self.windows.append((window_start, current_block))
+            yield window_start, current_block
+            current_block = window_start - 1
+
+
+def run_windows(
+    jobs, windows, max_workers=MAX_WORKERS, retries=MAX_RETRIES, sizer=None
+):
+    """
+    Runs every job over every block window on a bounded thread pool.
+
+    Each job is called as job(start_block, end_block, batch_n), where batch_n is the index of the window,
+    and returns the largest number of logs it got from a single request. Windows are pulled lazily
+    from the iterable, so that an AdaptiveWindow can size them from the results of the previous ones.
+
+    :param jobs: A list of callables to run for each window.
+    :param windows: An iterable of (start_block, end_block) tuples, e.g. from AdaptiveWindow.split.
+    :param max_workers: Maximum number of windows fetched concurrently.
+    :param retries: Number of retries per (job, window) before giving up.
+    :param sizer: An optional AdaptiveWindow notified with the number of logs of each window.
+    :return: A list of (job name, start_block, end_block, batch_n) for the tasks that failed.
+    """
+    failed = []
+    windows = enumerate(windows)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        def submit_next_window():
+            try:
+                batch_n, (start_block, end_block) = next(windows)
+            except StopIteration:
+                return False
+            for job in jobs:
+                future = executor.submit(
+                    retry_with_backoff,
+                    job,
+                    start_block,
+                    end_block,
+                    batch_n,
+                    retries=retries,
+                )
+                futures[future] = (job.__name__, start_block, end_block, batch_n)
+            return True
+
+        while len(futures) < max_workers and submit_next_window():
+            pass
+
+        n_done = 0
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = futures.pop(future)
+                try:
+                    n_logs = future.result()
+                    if sizer is not None and n_logs is not None:
+                        sizer.observe(task[2] - task[1] + 1, n_logs)
+                except Exception as e:
+                    logging.error(f"Giving up on {task}: {e}")
+                    failed.append(task)
+                n_done += 1
+                if n_done % 100 == 0:
+                    logging.info(f"{n_done} tasks done")
+
+            while len(futures) < max_workers and submit_next_window():
+                pass
+
+    return failed
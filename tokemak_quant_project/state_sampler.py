@@ -0,0 +1,236 @@
+"""
+Samples contract views (balances, get_virtual_price, totalSupply, ...) at historical blocks with
+batched eth_call requests, caching the results of final blocks so that they are never requested twice.
+
+Historical eth_call requires an archive node.
+"""
+
+import logging
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+from eth_abi import decode_abi
+from web3 import Web3
+
+from config import *
+from tokemak_quant_project.rpc import batch_request
+from utilities import load_abi
+
+SQLITE_MAX_VARIABLES = 900
+
+
+class EthCallCache:
+    """
+    Persistent (contract, calldata, block) -> result store of eth_call results.
+    """
+
+    def __init__(self, path=ETH_CALL_CACHE_DB):
+        """
+        :param path: Path of the SQLite database, created if it does not exist.
+        """
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS eth_calls (address TEXT NOT NULL, data TEXT NOT NULL, "
+                "block_number INTEGER NOT NULL, result TEXT NOT NULL, "
+                "PRIMARY KEY (address, data, block_number))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def get(self, address, data, block_numbers):
+        """
+        :return: A dict block number -> raw result of the stored calls of the contract with the calldata.
+        """
+        block_numbers = [int(block_number) for block_number in block_numbers]
+        results = {}
+        with closing(self._connect()) as conn:
+            for i in range(0, len(block_numbers), SQLITE_MAX_VARIABLES):
+                chunk = block_numbers[i : i + SQLITE_MAX_VARIABLES]
+                rows = conn.execute(
+                    "SELECT block_number, result FROM eth_calls WHERE address = ? AND data = ? "
+                    f"AND block_number IN ({','.join('?' * len(chunk))})",
+                    [address.lower(), data] + chunk,
+                )
+                results.update(rows)
+        return results
+
+    def put(self, rows):
+        """
+        :param rows: A list of (address, data, block number, raw result) tuples.
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO eth_calls VALUES (?, ?, ?, ?)",
+                [
+                    (address.lower(), data, int(block_number), result)
+                    for address, data, block_number, result in rows
+                ],
+            )
+
+
+class ViewCall:
+    """
+    A contract view sampled by the StateSampler, e.g. balances(0) of the Curve pool.
+    """
+
+    def __init__(self, name, address, abi, function, args=()):
+        """
+        :param name: The column the results are stored in.
+        :param address: The address of the contract.
+        :param abi: The ABI of the contract.
+        :param function: The name of the view function.
+        :param args: The arguments of the call.
+        """
+        self.name = name
+        self.address = Web3.to_checksum_address(address)
+        contract = Web3().eth.contract(address=self.address, abi=abi)
+        self.data = contract.encodeABI(fn_name=function, args=list(args))
+        function_abi = next(
+            entry
+            for entry in abi
+            if entry.get("type") == "function"
+            and entry["name"] == function
+            and len(entry["inputs"]) == len(args)
+        )
+        self.output_types = [output["type"] for output in function_abi["outputs"]]
+
+    def decode(self, result):
+        """
+        :return: The decoded return value, None if the call failed or returned nothing, e.g. before
+        the contract was deployed.
+        """
+        if result is None or result == "0x":
+            return None
+        values = decode_abi(self.output_types, bytes.fromhex(result[2:]))
+        return values[0] if len(values) == 1 else values
+
+
+class StateSampler:
+    """
+    Reads contract views at many historical blocks, sending the eth_calls of up to batch_size
+    (view, block) pairs per HTTP request with JSON-RPC batching.
+    """
+
+    def __init__(
+        self,
+        w3,
+        calls,
+        cache=None,
+        batch_size=RPC_BATCH_SIZE,
+        bucket=None,
+        finality_depth=FINALITY_DEPTH,
+    ):
+        """
+        :param w3: A Web3 instance connected to an archive node over HTTP.
+        :param calls: A list of ViewCall.
+        :param cache: An EthCallCache, ETH_CALL_CACHE_DB by default.
+        :param batch_size: Maximum number of eth_call per HTTP request.
+        :param bucket: Optional TokenBucket used to rate limit the requests.
+        :param finality_depth: Blocks behind the head after which results are cached.
+        """
+        self.w3 = w3
+        self.calls = calls
+        self.cache = cache if cache is not None else EthCallCache()
+        self.batch_size = batch_size
+        self.bucket = bucket
+        self.finality_depth = finality_depth
+
+    def sample(self, block_numbers):
+        """
+        Reads every view at every block, from the cache when possible.
+
+        :param block_numbers: An iterable of block numbers.
+        :return: A DataFrame indexed by blockNumber with one column per view, uint256 values as
+        exact Python ints.
+        """
+        block_numbers = sorted({int(block_number) for block_number in block_numbers})
+        final_block = self.w3.eth.block_number - self.finality_depth
+
+        results = {}
+        missing = []
+        for call in self.calls:
+            cached = self.cache.get(call.address, call.data, block_numbers)
+            for block_number in block_numbers:
+                if block_number in cached:
+                    results[call.name, block_number] = cached[block_number]
+                else:
+                    missing.append((call, block_number))
+        logging.info(
+            f"{len(results)} eth_call results found in {self.cache.path}, requesting {len(missing)}"
+        )
+
+        for i in range(0, len(missing), self.batch_size):
+            chunk = missing[i : i + self.batch_size]
+            raw_results = batch_request(
+                self.w3,
+                "eth_call",
+                [
+                    [{"to": call.address, "data": call.data}, hex(block_number)]
+                    for call, block_number in chunk
+                ],
+                batch_size=self.batch_size,
+                bucket=self.bucket,
+                raise_on_error=False,
+            )
+            final_rows = []
+            for (call, block_number), result in zip(chunk, raw_results):
+                results[call.name, block_number] = result
+                if result is not None and block_number <= final_block:
+                    final_rows.append((call.address, call.data, block_number, result))
+            # Store every chunk right away so that an interrupted run keeps its progress
+            self.cache.put(final_rows)
+
+        frame = pd.DataFrame(index=pd.Index(block_numbers, name="blockNumber"))
+        for call in self.calls:
+            frame[call.name] = pd.Series(
+                [call.decode(results[call.name, block]) for block in block_numbers],
+                index=frame.index,
+                dtype=object,
+            )
+        return frame
+
+
+def sample_blocks(start_block, end_block, cadence):
+    """
+    :return: The blocks from start_block to end_block, both included, every cadence blocks, or an
+    empty list if start_block is after end_block.
+    """
+    blocks = list(range(start_block, end_block + 1, cadence))
+    if blocks and blocks[-1] != end_block:
+        blocks.append(end_block)
+    return blocks
+
+
+def curve_pool_calls():
+    """
+    :return: The ViewCalls describing the state of the Curve stETH/ETH pool: both coin balances, the
+    virtual price and the LP token supply.
+    """
+    pool_abi = load_abi(CURVE_POOL_ABI_PATH)
+    token_abi = load_abi(CURVE_TOKEN_ABI_PATH)
+    return [
+        ViewCall("balances_0", CURVE_POOL_ADDRESS, pool_abi, "balances", [0]),
+        ViewCall("balances_1", CURVE_POOL_ADDRESS, pool_abi, "balances", [1]),
+        ViewCall("virtual_price", CURVE_POOL_ADDRESS, pool_abi, "get_virtual_price"),
+        ViewCall("lp_supply", CURVE_TOKEN_ADDRESS, token_abi, "totalSupply"),
+    ]
+
+
+def sample_curve_pool_state(
+    w3, start_block, end_block, cadence=CURVE_SAMPLE_CADENCE, bucket=None
+):
+    """
+    Samples the on-chain state of the Curve stETH/ETH pool every cadence blocks.
+
+    :param w3: A Web3 instance connected to an archive node over HTTP.
+    :param start_block: The first sampled block.
+    :param end_block: The last sampled block.
+    :param cadence: Blocks between two samples, e.g. 7200 for daily or 300 for hourly samples.
+    :param bucket: Optional TokenBucket used to rate limit the requests.
+    :return: A DataFrame indexed by blockNumber with balances_0, balances_1, virtual_price and lp_supply columns.
+    """
+    sampler = StateSampler(w3, curve_pool_calls(), bucket=bucket)
+    return sampler.sample(sample_blocks(start_block, end_block, cadence))
@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+
+from config import *
+from tokemak_quant_project.block_index import BlockTimeIndex
+from tokemak_quant_project.consolidate import read_fragments
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.scheduler import AdaptiveWindow, run_windows
+
+
+class SyncManifest:
+    """
+    Keeps the highest fully stored block of every (contract, event) pair, so that a rerun or a
+    crashed run only fetches the missing block ranges.
+    """
+
+    def __init__(self, path=SYNC_MANIFEST_FILENAME):
+        """
+        :param path: Path of the JSON manifest, created on the first save.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r") as manifest_file:
+                self.checkpoints = json.load(manifest_file)
+        except FileNotFoundError:
+            self.checkpoints = {}
+
+    @staticmethod
+    def _key(address, event):
+        return f"{address.lower()}:{event}"
+
+    def get(self, address, event):
+        """
+        :return: The highest fully stored block for the event of the contract, or None.
+        """
+        return self.checkpoints.get(self._key(address, event))
+
+    def set(self, address, event, block_number):
+        with self.lock:
+            self.checkpoints[self._key(address, event)] = int(block_number)
+
+    def save(self):
+        """
+        Writes the manifest atomically, so that a crash never leaves a truncated file behind.
+        """
+        with self.lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as manifest_file:
+                json.dump(self.checkpoints, manifest_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def _last_stored_block(filename):
+    """
+    Highest block number already present in a consolidated event file, or None.
+    """
+    try:
+        return int(pd.read_csv(filename, usecols=["blockNumber"])["blockNumber"].max())
+    except (FileNotFoundError, ValueError, pd.errors.EmptyDataError):
+        return None
+
+
+def bootstrap_checkpoints(manifest, targets):
+    """
+    Initializes the missing checkpoints from the data already stored by a previous backfill.
+
+    :param manifest: The SyncManifest to update.
+    :param targets: A list of EventSpec.
+    """
+    for spec in targets:
+        if manifest.get(spec.contract, spec.event) is None:
+            if STORE_FORMAT == "parquet":
+                last_block = EventStore().last_block(spec.pool, spec.event)
+            else:
+                last_block = _last_stored_block(spec.filename)
+            if last_block is not None:
+                logging.info(
+                    f"Resuming {spec.event} of {spec.contract} after block {last_block}"
+                )
+                manifest.set(spec.contract, spec.event, last_block)
+
+
+def _migrate_header(filename, columns, index):
+    """
+    Rewrites a consolidated CSV file with a wider header, e.g. for the files stored before their
+    blocks were dated, so that no column of the appended rows is dropped.
+
+    :param filename: The consolidated CSV file.
+    :param columns: The new columns of the file, in order.
+    :param index: The BlockTimeIndex dating the stored rows when block_date is added.
+    """
+    df = pd.read_csv(filename, dtype=str)
+    added = [column for column in columns if column not in df]
+    if "block_date" in added and not df.empty:
+        df["block_date"] = index.dates(df["blockNumber"].astype("int64"))
+    tmp_path = f"{filename}.tmp"
+    df.reindex(columns=columns).to_csv(tmp_path, index=False)
+    os.replace(tmp_path, filename)
+    logging.warning(f"\t\tAdded the columns {added} to {filename}")
+
+
+def append_frame(spec, df, index):
+    """
+    Appends new rows of an event to its consolidated CSV file, with the dates of their blocks.
+    Columns missing from the header of the file are added to it first, and the stored rows get
+    empty values for them, or their dates for block_date.
+
+    :param spec: The EventSpec of the event.
+    :param df: The new rows, as built by spec.to_frame.
+    :param index: The BlockTimeIndex resolving the dates of the blocks.
+    """
+    if df.empty:
+        return
+    filename = spec.filename
+    df = df.sort_values(["blockNumber", "logIndex"])
+    df["block_date"] = index.dates(df["blockNumber"])
+    if os.path.exists(filename):
+        # Keep the column layout of the existing file
+        columns = list(pd.read_csv(filename, nrows=0).columns)
+        added = [column for column in df.columns if column not in columns]
+        if added:
+            columns += added
+            _migrate_header(filename, columns, index)
+        df.reindex(columns=columns).to_csv(
+            filename, mode="a", header=False, index=False
+        )
+    else:
+        df.to_csv(filename, index=False)
+    logging.info(f"\t\tAppended {len(df)} {spec.event} rows to {filename}")
+
+
+def append_windows(targets, windows, manifest, w3, bucket=None):
+    """
+    Appends the fragments written for the given windows to the consolidated event files, then
+    moves the checkpoints to the end of the last window.
+
+    :param targets: A list of EventSpec.
+    :param windows: A list of (start_block, end_block, batch_n) tuples, in ascending block order
+    and without gaps.
+    :param manifest: The SyncManifest to update.
+    :param w3: A Web3 instance, used to fetch the dates of the new blocks.
+    :param bucket: An optional TokenBucket used to rate limit the block requests.
+    """
+    if not windows:
+        return
+
+    end_block = windows[-1][1]
+    new_data = {}
+    for spec in targets:
+        paths = [f"{spec.filename}_{batch_n}" for _, _, batch_n in windows]
+        df = read_fragments([path for path in paths if os.path.exists(path)])
+        if df is None:
+            df = pd.DataFrame()
+        checkpoint = manifest.get(spec.contract, spec.event)
+        if not df.empty and checkpoint is not None:
+            df = df[df["blockNumber"] > checkpoint]
+        new_data[spec] = df
+
+    blocks = [df["blockNumber"] for df in new_data.values() if not df.empty]
+    blocks = pd.concat(blocks).unique() if blocks else []
+    index = BlockTimeIndex(w3, bucket=bucket)
+    index.timestamps(blocks)
+
+    for spec, df in new_data.items():
+        append_frame(spec, df, index)
+        manifest.set(spec.contract, spec.event, end_block)
+        for _, _, batch_n in windows:
+            if os.path.exists(f"{spec.filename}_{batch_n}"):
+                os.remove(f"{spec.filename}_{batch_n}")
+
+    manifest.save()
+
+
+def commit_store_windows(targets, windows, manifest, w3, bucket=None):
+    """
+    Moves the checkpoints to the end of the given windows, once their partitions are written to
+    the event store, and fetches the dates of their blocks.
+
+    :param targets: A list of EventSpec.
+    :param windows: A list of (start_block, end_block, batch_n) tuples, in ascending block order
+    and without gaps.
+    :param manifest: The SyncManifest to update.
+    :param w3: A Web3 instance, used to fetch the dates of the new blocks.
+    :param bucket: An optional TokenBucket used to rate limit the block requests.
+    """
+    if not windows:
+        return
+
+    store = EventStore()
+    blocks = set()
+    for spec in targets:
+        frame = store.read(
+            spec.pool,
+            spec.event,
+            columns=["blockNumber"],
+            blocks=(windows[0][0], windows[-1][1]),
+        )
+        blocks.update(frame["blockNumber"].tolist())
+    BlockTimeIndex(w3, bucket=bucket).timestamps(sorted(blocks))
+
+    for spec in targets:
+        manifest.set(spec.contract, spec.event, windows[-1][1])
+    manifest.save()
+
+
+def sync_project(job, targets, manifest, w3, head, bucket=None, pipeline=None):
+    """
+    Fetches the blocks between the lowest checkpoint of the project and the chain head, and
+    appends them to the consolidated event files.
+
+    :param job: The fetch and store callable of the project, called as job(start_block, end_block, batch_n).
+    :param targets: A list of EventSpec of the project, or of the whole registry.
+    :param manifest: The SyncManifest holding the checkpoints.
+    :param w3: A Web3 instance connected to an Ethereum node.
+    :param head: The last block to fetch.
+    :param bucket: An optional TokenBucket used to rate limit the block requests.
+    :param pipeline: The store pipeline the job hands its logs over to, if any. It is drained
+    before the windows are appended.
+    """
+    bootstrap_checkpoints(manifest, targets)
+    # Events never stored before start MAX_BATCH windows back from the head, like a backfill
+    default_start = head - MAX_BATCH * BLOCK_WINDOW + 1
+    start_block = min(
+        default_start if checkpoint is None else checkpoint + 1
+        for checkpoint in (manifest.get(spec.contract, spec.event) for spec in targets)
+    )
+
+    if start_block > head:
+        logging.info(f"{job.__name__}: already synced up to block {head}")
+        return
+
+    logging.info(f"{job.__name__}: syncing blocks {start_block} to {head}")
+    if STORE_FORMAT == "parquet":
+        # Partitions past a checkpoint were left by an interrupted sync and are fetched again
+        for spec in targets:
+            checkpoint = manifest.get(spec.contract, spec.event)
+            if checkpoint is not None:
+                EventStore().drop_after(spec.pool, spec.event, checkpoint)
+    sizer = AdaptiveWindow()
+    failed = run_windows([job], sizer.split(start_block, head), sizer=sizer)
+    if pipeline is not None:
+        failed += pipeline.drain()
+    failed = {batch_n for _, _, _, batch_n in failed}
+    windows = sizer.windows
+
+    # Only the windows before the first failure can be appended without leaving a gap
+    done = []
+    for batch_n in reversed(range(len(windows))):
+        if batch_n in failed:
+            logging.error(
+                f"{job.__name__}: window {windows[batch_n]} failed, stopping the sync there"
+            )
+            break
+        done.append((*windows[batch_n], batch_n))
+
+    if STORE_FORMAT == "parquet":
+        commit_store_windows(targets, done, manifest, w3, bucket=bucket)
+    else:
+        append_windows(targets, done, manifest, w3, bucket=bucket)
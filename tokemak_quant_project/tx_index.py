@@ -0,0 +1,409 @@
+"""
+Transaction index spanning every stored event table.
+
+The index holds one entry per stored log, (transactionHash, logIndex, blockNumber, table), sorted
+by transaction hash and cached as an uncompressed Arrow IPC file, rebuilt when a stored event
+changes. A transaction is found with a single hash table lookup on the first 8 bytes of its hash,
+a hash prefix with a binary search, and a block with a binary search in the entries sorted by block.
+As the entries of a transaction are contiguous, the events of several tables sharing a transaction
+are joined by merging integer transaction ids, and only the matching rows of each table are loaded.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from config import *
+from tokemak_quant_project.decoder import hex_to_bytes_array
+from tokemak_quant_project.event_store import EventStore
+from tokemak_quant_project.events import REGISTRY
+from tokemak_quant_project.loader import find_spec, load_events
+
+# Bumped when the layout of the index changes, to invalidate the indexes already written
+INDEX_VERSION = "1"
+
+INDEX_COLUMNS = ["transactionHash", "logIndex", "blockNumber"]
+
+
+def _log_keys(blocks, log_indexes):
+    """
+    :return: An int64 key per log, ordered like (blockNumber, logIndex).
+    """
+    return np.asarray(blocks, dtype=np.int64) * 2**20 + np.asarray(
+        log_indexes, dtype=np.int64
+    )
+
+
+def hash_bytes(values):
+    """
+    Converts transaction hashes, as hex strings or 32-byte binary, to a numpy array of 32-byte
+    strings, which sort like the hashes.
+    """
+    if len(values) and isinstance(values[0], bytes):
+        return np.asarray(list(values), dtype="S32")
+    return hex_to_bytes_array(list(values), 32).reshape(-1).view("S32")
+
+
+def _hash_key(hashes):
+    """
+    :return: The first 8 bytes of 32-byte hashes as big-endian uint64, ordered like the hashes.
+    """
+    return np.frombuffer(np.ascontiguousarray(hashes).tobytes(), dtype=">u8")[
+        ::4
+    ].astype(np.uint64)
+
+
+class TransactionIndex:
+    """
+    Index of the logs of every stored event by transaction and by block.
+    """
+
+    def __init__(
+        self, specs=REGISTRY, path=TX_INDEX_FILENAME, store_format=STORE_FORMAT
+    ):
+        """
+        :param specs: The EventSpec of the indexed event tables.
+        :param path: The Arrow IPC file caching the index.
+        :param store_format: "csv" or "parquet", where the events are read from, see loader.load_events.
+        """
+        self.specs = list(specs)
+        self.path = path
+        self.store_format = store_format
+        self.refresh()
+
+    def _sources(self):
+        """
+        :return: A dict "pool/event" -> state of the stored files of the event, to detect changes.
+        """
+        sources = {}
+        for spec in self.specs:
+            if self.store_format == "parquet":
+                paths = [
+                    path
+                    for _, _, path in EventStore().partitions(spec.pool, spec.event)
+                ]
+            else:
+                paths = [spec.filename] if os.path.exists(spec.filename) else []
+            sources[f"{spec.pool}/{spec.event}"] = [
+                [path, os.stat(path).st_mtime_ns, os.stat(path).st_size]
+                for path in paths
+            ]
+        return sources
+
+    def _stored(self, spec):
+        return bool(self._source_state[f"{spec.pool}/{spec.event}"])
+
+    def refresh(self):
+        """
+        Memory-maps the cached index, or builds it again if an event was stored since it was written.
+        """
+        self._source_state = self._sources()
+        metadata = {
+            b"version": INDEX_VERSION.encode("utf-8"),
+            b"store_format": self.store_format.encode("utf-8"),
+            b"sources": json.dumps(self._source_state, sort_keys=True).encode("utf-8"),
+        }
+        table = None
+        try:
+            reader = pa.ipc.open_file(pa.memory_map(self.path))
+            if reader.schema.metadata == metadata:
+                table = reader.read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            pass
+        if table is None:
+            table = self._build().replace_schema_metadata(metadata)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with pa.OSFile(f"{self.path}.tmp", "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(f"{self.path}.tmp", self.path)
+            logging.info(f"Indexed {table.num_rows} logs in {self.path}")
+        self._load(table)
+
+    def _build(self):
+        """
+        Reads the transaction hash, log index and block of every stored log.
+
+        :return: An Arrow table of the entries sorted by (transactionHash, logIndex), with the order
+        of the entries by (blockNumber, logIndex).
+        """
+        hashes, log_indexes, blocks, tables = [], [], [], []
+        for code, spec in enumerate(self.specs):
+            if not self._stored(spec):
+                continue
+            df = load_events(
+                spec.pool,
+                spec.event,
+                columns=INDEX_COLUMNS,
+                decimals=None,
+                store_format=self.store_format,
+                compact=True,
+            )
+            if not len(df):
+                continue
+            hashes.append(hash_bytes(df["transactionHash"].to_numpy()))
+            log_indexes.append(df["logIndex"].to_numpy(dtype=np.int64))
+            blocks.append(df["blockNumber"].to_numpy(dtype=np.int64))
+            tables.append(np.full(len(df), code, dtype=np.int16))
+
+        if hashes:
+            hashes = np.concatenate(hashes)
+            log_indexes = np.concatenate(log_indexes)
+            blocks = np.concatenate(blocks)
+            tables = np.concatenate(tables)
+        else:
+            hashes = np.empty(0, dtype="S32")
+            log_indexes = blocks = np.empty(0, dtype=np.int64)
+            tables = np.empty(0, dtype=np.int16)
+
+        order = np.lexsort((log_indexes, hashes))
+        hashes = hashes[order]
+        log_indexes = log_indexes[order]
+        blocks = blocks[order]
+        by_block = np.lexsort((log_indexes, blocks))
+        return pa.table(
+            {
+                "transactionHash": pa.FixedSizeBinaryArray.from_buffers(
+                    pa.binary(32), len(hashes), [None, pa.py_buffer(hashes.tobytes())]
+                ),
+                "logIndex": log_indexes,
+                "blockNumber": blocks,
+                "table": tables[order],
+                "by_block": by_block,
+            }
+        )
+
+    def _load(self, table):
+        column = table.column("transactionHash").combine_chunks()
+        self.hashes = np.frombuffer(
+            column.buffers()[1],
+            dtype="S32",
+            count=len(column),
+            offset=column.offset * 32,
+        )
+        self.log_indexes = table.column("logIndex").to_numpy()
+        self.blocks = table.column("blockNumber").to_numpy()
+        self.tables = table.column("table").to_numpy()
+        self.by_block = table.column("by_block").to_numpy()
+        self.sorted_blocks = self.blocks[self.by_block]
+
+        # Transaction id of every entry and first entry of every transaction
+        new = np.r_[True, self.hashes[1:] != self.hashes[:-1]] if len(self) else []
+        self.starts = np.r_[np.flatnonzero(new), len(self)]
+        self.transaction_ids = np.cumsum(new) - 1
+        keys = _hash_key(self.hashes[self.starts[:-1]])
+        # Distinct transactions may share their first 8 bytes, the lookup then checks the hashes
+        if len(keys):
+            self.key_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            keys = keys[self.key_starts]
+        else:
+            self.key_starts = np.empty(0, dtype=np.int64)
+        self.keys = pd.Index(keys)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _code(self, pool, event):
+        return self.specs.index(find_spec(pool, event, self.specs))
+
+    def transaction_entries(self, transaction_hash):
+        """
+        :param transaction_hash: A transaction hash, or a prefix of one like the notebooks search for.
+        :return: The positions of the entries of the transaction(s), sorted by (transactionHash, logIndex).
+        """
+        digits = transaction_hash.lower()
+        if digits.startswith("0x"):
+            digits = digits[2:]
+        if len(digits) == 64:
+            target = bytes.fromhex(digits)
+            try:
+                i = self.keys.get_loc(_hash_key(np.array([target], dtype="S32"))[0])
+            except KeyError:
+                return np.empty(0, dtype=np.int64)
+            first = self.key_starts[i]
+            last = (
+                self.key_starts[i + 1]
+                if i + 1 < len(self.key_starts)
+                else len(self.starts) - 1
+            )
+            entries = np.arange(self.starts[first], self.starts[last])
+            return entries[self.hashes[entries] == target]
+
+        # Every hash starting with the prefix sorts between the prefix padded with 0s and with fs
+        low = bytes.fromhex(digits.ljust(64, "0"))
+        high = bytes.fromhex(digits.ljust(64, "f"))
+        return np.arange(
+            np.searchsorted(self.hashes, np.array(low, dtype="S32"), side="left"),
+            np.searchsorted(self.hashes, np.array(high, dtype="S32"), side="right"),
+        )
+
+    def block_entries(self, start_block, end_block=None):
+        """
+        :return: The positions of the entries of the blocks start_block to end_block (inclusive),
+        sorted by (blockNumber, logIndex).
+        """
+        end_block = start_block if end_block is None else end_block
+        first = np.searchsorted(self.sorted_blocks, start_block, side="left")
+        last = np.searchsorted(self.sorted_blocks, end_block, side="right")
+        return self.by_block[first:last]
+
+    def entries(self, positions):
+        """
+        :return: A DataFrame of the given entries: transactionHash, logIndex, blockNumber, pool and event.
+        """
+        codes = self.tables[positions]
+        pools = np.array([spec.pool for spec in self.specs], dtype=object)
+        events = np.array([spec.event for spec in self.specs], dtype=object)
+        return pd.DataFrame(
+            {
+                "transactionHash": [
+                    "0x" + value.hex() for value in self.hashes[positions].tolist()
+                ],
+                "logIndex": self.log_indexes[positions],
+                "blockNumber": self.blocks[positions],
+                "pool": pools[codes],
+                "event": events[codes],
+            }
+        )
+
+    def lookup(self, transaction_hash):
+        """
+        Replaces the scans of the notebooks, df[df.transactionHash.str.contains(hash_tx)].
+
+        :param transaction_hash: A transaction hash or a prefix of one.
+        :return: The logs of the transaction(s) in every indexed event, see entries.
+        """
+        return self.entries(self.transaction_entries(transaction_hash))
+
+    def _rows(self, code, positions, columns=None):
+        """
+        Loads the rows of an event table at the given entries, reading only their block range.
+
+        :return: A DataFrame aligned with positions.
+        """
+        spec = self.specs[code]
+        blocks = self.blocks[positions]
+        df = load_events(
+            spec.pool,
+            spec.event,
+            columns=(
+                None
+                if columns is None
+                else list(dict.fromkeys(columns + ["blockNumber", "logIndex"]))
+            ),
+            blocks=(int(blocks.min()), int(blocks.max())),
+            store_format=self.store_format,
+        )
+        keys = _log_keys(df["blockNumber"], df["logIndex"])
+        rows = np.searchsorted(keys, _log_keys(blocks, self.log_indexes[positions]))
+        df = df.iloc[rows].reset_index(drop=True)
+        return df[columns] if columns is not None else df
+
+    def _selection(self, events, transaction_hash=None, blocks=None):
+        """
+        :return: The positions of the entries of the given events in the transactions holding the
+        first event, optionally only the given transaction(s) or block range.
+        """
+        codes = [self._code(pool, event) for pool, event in events]
+        if transaction_hash is not None:
+            candidates = self.transaction_entries(transaction_hash)
+            if blocks is not None:
+                in_range = (self.blocks[candidates] >= blocks[0]) & (
+                    self.blocks[candidates] <= blocks[1]
+                )
+                candidates = candidates[in_range]
+        elif blocks is not None:
+            candidates = np.sort(self.block_entries(*blocks))
+        else:
+            candidates = np.arange(len(self))
+        ids = self.transaction_ids[candidates]
+        anchored = np.zeros(len(self.starts), dtype=bool)
+        anchored[ids[self.tables[candidates] == codes[0]]] = True
+        return candidates[anchored[ids] & np.isin(self.tables[candidates], codes)]
+
+    def view(self, events, transaction_hash=None, blocks=None, columns=None):
+        """
+        Unified view of the transactions holding an event, e.g. the swaps of the Curve pool with the
+        steCRV transfers of the same transactions:
+        view([("curve_steth_pool", "TokenExchange"), ("curve_steth_lp_token", "Transfer")])
+
+        :param events: A list of (pool, event) tuples, see loader.load_events. Only the transactions
+        holding the first event are kept.
+        :param transaction_hash: An optional transaction hash or prefix of one.
+        :param blocks: An optional (start_block, end_block) tuple, both inclusive.
+        :param columns: An optional list of columns, each event bringing the ones it has.
+        :return: A DataFrame of the logs of these events, sorted by (blockNumber, logIndex), with the
+        columns of every event and the pool of each log.
+        """
+        positions = self._selection(events, transaction_hash, blocks)
+        frames = []
+        for code in np.unique(self.tables[positions]):
+            code_positions = positions[self.tables[positions] == code]
+            df = self._rows(code, code_positions)
+            df.insert(0, "pool", self.specs[code].pool)
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(frames, ignore_index=True).sort_values(
+            ["blockNumber", "logIndex"], ignore_index=True
+        )
+        if columns is not None:
+            df = df[[column for column in columns if column in df]]
+        return df
+
+    def join(
+        self,
+        left,
+        right,
+        transaction_hash=None,
+        blocks=None,
+        left_columns=None,
+        right_columns=None,
+        suffixes=("_x", "_y"),
+    ):
+        """
+        Inner join of two events on the transaction hash, e.g. the swaps and the steCRV transfers
+        of the same transactions, merging the transaction ids of the index rather than the hashes.
+
+        :param left: A (pool, event) tuple.
+        :param right: A (pool, event) tuple.
+        :param transaction_hash: An optional transaction hash or prefix of one.
+        :param blocks: An optional (start_block, end_block) tuple, both inclusive.
+        :param left_columns: An optional list of columns of the left event.
+        :param right_columns: An optional list of columns of the right event.
+        :param suffixes: The suffixes of the columns of both events, like pandas.merge.
+        :return: A DataFrame with one row per pair of logs of the same transaction.
+        """
+        left_code, right_code = self._code(*left), self._code(*right)
+        positions = self._selection([left, right], transaction_hash, blocks)
+        # Both are sorted by transaction, as the positions are
+        left_positions = positions[self.tables[positions] == left_code]
+        right_positions = positions[self.tables[positions] == right_code]
+        if not len(left_positions) or not len(right_positions):
+            return pd.DataFrame()
+
+        right_ids = self.transaction_ids[right_positions]
+        left_ids = self.transaction_ids[left_positions]
+        first = np.searchsorted(right_ids, left_ids, side="left")
+        counts = np.searchsorted(right_ids, left_ids, side="right") - first
+        pairs = np.repeat(np.arange(len(left_positions)), counts)
+        offsets = np.arange(len(pairs)) - np.repeat(np.cumsum(counts) - counts, counts)
+        right_rows = first[pairs] + offsets
+
+        left_df = self._rows(left_code, left_positions, left_columns).iloc[pairs]
+        right_df = self._rows(right_code, right_positions, right_columns).iloc[
+            right_rows
+        ]
+        # Equal on every row, kept once like the key of pandas.merge
+        if "transactionHash" in left_df and "transactionHash" in right_df:
+            right_df = right_df.drop(columns="transactionHash")
+        common = set(left_df.columns) & set(right_df.columns)
+        left_df = left_df.rename(columns={c: f"{c}{suffixes[0]}" for c in common})
+        right_df = right_df.rename(columns={c: f"{c}{suffixes[1]}" for c in common})
+        return pd.concat(
+            [left_df.reset_index(drop=True), right_df.reset_index(drop=True)], axis=1
+        )